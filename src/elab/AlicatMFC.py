@@ -3,6 +3,33 @@ import time
 
 class AlicatMFC(instrument):
 
+    ## Define useful command codes, {0}, {1}, {2} are filled with the parameters when the command is compiled
+    command_dict = {
+                    'query_dataframe' : 'A??D*',
+                    'query_data' : 'A',
+                    'query_avg_data' : 'ADV {0} {1} {2}',
+                    'query_gas' : 'AGS',
+                    'query_setpoint_range' : 'ALR',
+                    'query_max_ramp_rate' : 'ASR',
+                    'query_setpoint' : 'ALS',
+                    'start_streaming' : 'A@ @',
+                    'stop_streaming' : '@@ A',
+                    'set_gas' : 'AGS {0}',
+                    'set_startup_gas' : 'AGS {0} 1',
+                    'change_setpoint' : 'AS {0}',
+                    'set_setpoint' : 'ALS {0} {1}',
+                    'set_units' : 'ADCU {0} 1 {1}',
+                    #'tare_absolute_pressure' : 'APC,  #requires an internal barometer, unclear if we have this or not atm
+                    'set_setpoint_mode' : 'ALV {0}',
+                    'tare_flow' : 'AV',
+                    'set_pressure_limit' : 'AOPL {0}'
+                    }
+
+    query_dict = {'query_dataframe' : True,'query_data' : True,
+                  'query_avg_data' : True,'query_gas' : True,
+                  'query_setpoint_range' : True,'query_max_ramp_rate' : True,
+                  'query_setpoint' : True, 'tare_flow' : True}
+
     def __init__(self, com_port, **kwargs):
         super().__init__(com_port,baud_rate=57600, **kwargs)
 
@@ -21,56 +48,55 @@ class AlicatMFC(instrument):
         ## Define user input variables
         parameter1, parameter2, parameter3 = [kwargs.get(param, '') for param in ('parameter1', 'parameter2', 'parameter3')]
 
-        ## Define useful command codes
-        command_dict = {
-                        'query_dataframe' : 'A??D*',
-                        'query_data' : 'A',
-                        'query_avg_data' : f'ADV {parameter1} {parameter2} {parameter3}',
-                        'query_gas' : 'AGS',
-                        'query_setpoint_range' : 'ALR',
-                        'query_max_ramp_rate' : 'ASR',
-                        'query_setpoint' : 'ALS',
-                        'start_streaming' : 'A@ @',
-                        'stop_streaming' : '@@ A',
-                        'set_gas' : f'AGS {parameter1}',
-                        'set_startup_gas' : f'AGS {parameter1} 1',
-                        'change_setpoint' : f'AS {parameter1}',
-                        'set_setpoint' : f'ALS {parameter1} {parameter2}',
-                        'set_units' : f'ADCU {parameter1} 1 {parameter2}',
-                        #'tare_absolute_pressure' : 'APC,  #requires an internal barometer, unclear if we have this or not atm
-                        'set_setpoint_mode' : f'ALV {parameter1}',
-                        'tare_flow' : 'AV',
-                        'set_pressure_limit' : f'AOPL {parameter1}'
-                        }
-        
-        query_dict = {'query_dataframe' : True,'query_data' : True,
-                      'query_avg_data' : True,'query_gas' : True,
-                      'query_setpoint_range' : True,'query_max_ramp_rate' : True,
-                      'query_setpoint' : True, 'tare_flow' : True}
-        
         ## Use kwargs to define if you want to print the command hex for troubleshoot
         if 'show_cmd' in kwargs:
             self.show_cmd = kwargs.get('show_cmd')
 
-        command_packet = command_dict[command]+'\r'
+        command_packet = self.command_dict[command].format(parameter1, parameter2, parameter3)+'\r'
         packet = command_packet.encode()
-        self.ser.write(packet)
+        with self.io_lock:
+            self.ser.write(packet)
 
-        try:
-            if query_dict[command] == True:
-                time.sleep(1)
-        except KeyError: 
-            pass
+            try:
+                if self.query_dict[command] == True:
+                    time.sleep(1)
+            except KeyError: 
+                pass
 
-        self.response = self.ser.read_all()
-        if self.response == b'':
-            time.sleep(0.1)
             self.response = self.ser.read_all()
+            if self.response == b'':
+                time.sleep(0.1)
+                self.response = self.ser.read_all()
         if self.verbose == True:
             print('command Alicat: ',packet)
             print('response Alicat:',self.response)
         return self.response
 
+    def exchange(self, packet):
+        ## One round trip without the fixed sleeps, the MFC answers with a data frame ending in '\r'
+        with self.io_lock:
+            self.ser.write(packet)
+            self.response = self.ser.read_until(b'\r')
+        return self.response
+
+    def parse_data(self, response):
+        ## unit ID, pressure, temperature, volumetric flow, mass flow, setpoint, gas
+        fields = response.decode(errors='replace').split()
+        if len(fields) < 6:
+            raise ValueError(f'Unexpected data frame {response!r}')
+        names = ['pressure', 'temperature', 'volumetric_flow', 'mass_flow', 'setpoint']
+        data = {name : float(x) for name, x in zip(names, fields[1:6])}
+        data['gas'] = fields[6] if len(fields) > 6 else None
+        self.publish('flow', data['mass_flow'])
+        return data
+
+    def read_data(self):
+        return self.parse_data(self.exchange((self.command_dict['query_data']+'\r').encode()))
+
+    def setpoint_data(self, value):
+        ## Sets the setpoint and returns the data frame the MFC answers with
+        return self.parse_data(self.exchange((self.command_dict['change_setpoint'].format(value)+'\r').encode()))
+
     def query_dataframe(self):
         return self.compile_cmd(command = 'query_dataframe')
 
@@ -107,9 +133,10 @@ class AlicatMFC(instrument):
     
     def list_gases(self):
         packet = 'A??G*\r'
-        self.ser.write(packet.encode())
-        time.sleep(1)
-        return self.ser.read_all()
+        with self.io_lock:
+            self.ser.write(packet.encode())
+            time.sleep(1)
+            return self.ser.read_all()
         #return self.compile_cmd(command = 'list_gases')
     
     def start_streaming(self):
@@ -14,26 +14,30 @@ class E0RR80(instrument):
 
 
     def query_mass(self):
-        self.ser.setRTS(False)
-        self.ser.read_all()
-        time.sleep(1)
-        packet = 'P\r'
-        self.ser.write(packet.encode('ascii'))
-        output, mass = self.ser.readline().decode().split('g')[0].split(' '), []
+        with self.io_lock:
+            self.ser.setRTS(False)
+            self.ser.read_all()
+            time.sleep(1)
+            packet = 'P\r'
+            self.ser.write(packet.encode('ascii'))
+            output, mass = self.ser.readline().decode().split('g')[0].split(' '), []
         for x in output:
             if x != '':
                 mass.append(x)
         mass = float(''.join(mass))
-        return mass
+        return self.publish('mass', mass)
     
     def tare(self):
         packet = 'T\r'
-        self.ser.write(packet.encode('ascii'))
+        with self.io_lock:
+            self.ser.write(packet.encode('ascii'))
 
     def on(self):
         packet = 'ON\r'
-        self.ser.write(packet.encode('ascii'))
+        with self.io_lock:
+            self.ser.write(packet.encode('ascii'))
 
     def on(self):
         packet = 'ON\r'
-        self.ser.write(packet.encode('ascii'))
\ No newline at end of file
+        with self.io_lock:
+            self.ser.write(packet.encode('ascii'))
\ No newline at end of file
@@ -1,4 +1,8 @@
 from .main import instrument
+import threading
+import time
+import numpy as np
+from scipy.optimize import curve_fit
 
 class HS7(instrument):
 
@@ -8,6 +12,10 @@ class HS7(instrument):
         self.model = 'C-MAG HS7'
         self.type = 'hotplate'
         self.max_temp = 50
+        self.setpoint = None
+        self.samples = [] #(monotonic time, temperature) from the background sampler
+        self.sample_thread = None
+        self.sample_error = None #exception that stopped the sampler
 
         if 'max_temp' in kwargs:
             self.max_temp = kwargs.get('max_temp')
@@ -17,24 +25,30 @@ class HS7(instrument):
 
     def query_temp(self):
         packet = 'IN_PV_1\r\n'
-        self.ser.write(packet.encode('utf-8'))
-        return float(self.ser.read_until().decode().split(' ')[0])
+        with self.io_lock:
+            self.ser.write(packet.encode('utf-8'))
+            return self.publish('temperature', float(self.ser.read_until().decode().split(' ')[0]))
     
     def set_temp(self, temp, **kwargs):
         if (self.max_temp >= temp > 0) == True:
             packet = f'OUT_SP_1 {temp}\r\n'
+            self.setpoint = temp
         else:
             packet = f'OUT_SP_1 {self.max_temp}\r\n'
+            self.setpoint = self.max_temp
             print(f'Value out of range! Set to {self.max_temp}')
-        self.ser.write(packet.encode('utf-8'))
+        with self.io_lock:
+            self.ser.write(packet.encode('utf-8'))
         
     def start_temp(self):
         packet = f'START_1\r\n'
-        self.ser.write(packet.encode('utf-8'))
+        with self.io_lock:
+            self.ser.write(packet.encode('utf-8'))
 
     def stop_temp(self):
         packet = f'STOP_1\r\n'
-        self.ser.write(packet.encode('utf-8'))
+        with self.io_lock:
+            self.ser.write(packet.encode('utf-8'))
     
     def set_spin(self, spin):
         if (1500 >= spin  > 0) == True:
@@ -42,12 +56,149 @@ class HS7(instrument):
         else:
             packet = f'OUT_SP_1 {1500}\r\n'
             print(f'Value out of range! Set to {1500}')
-        self.ser.write(packet.encode('utf-8'))
+        with self.io_lock:
+            self.ser.write(packet.encode('utf-8'))
 
     def start_spin(self):
         packet = f'START_4\r\n'
-        self.ser.write(packet.encode('utf-8'))
+        with self.io_lock:
+            self.ser.write(packet.encode('utf-8'))
         
     def stop_spin(self):
         packet = f'STOP_4\r\n'
-        self.ser.write(packet.encode('utf-8'))
+        with self.io_lock:
+            self.ser.write(packet.encode('utf-8'))
+
+    #sample the temperature on a background thread
+    def start_sampling(self, interval=1):
+        if self.sample_thread != None:
+            return
+        self.samples = []
+        self.sample_error = None
+        self.sample_stop = threading.Event()
+
+        def sample():
+            while not self.sample_stop.is_set():
+                try:
+                    self.samples.append((time.monotonic(), self.query_temp()))
+                except Exception as error:
+                    self.sample_error = error
+                    return
+                self.sample_stop.wait(interval)
+
+        self.sample_thread = threading.Thread(target=sample, name=f'{self.com_port} temperature', daemon=True)
+        self.sample_thread.start()
+
+    def stop_sampling(self):
+        if self.sample_thread != None:
+            self.sample_stop.set()
+            self.sample_thread.join()
+            self.sample_thread = None
+        return list(self.samples)
+
+    #fit T = final - offset*exp(-t/tau) to the recent samples, returns (seconds to reach the band, predicted final temperature)
+    def predict(self, setpoint, tolerance, window=300):
+        samples = [x for x in self.samples if x[0] >= time.monotonic() - window]
+        if len(samples) < 5:
+            return None, None
+        t = np.array([x[0] for x in samples]) - samples[-1][0]
+        T = np.array([x[1] for x in samples])
+        model = lambda t, final, offset, tau: final - offset*np.exp(-t/tau)
+        try:
+            (final, offset, tau), _ = curve_fit(model, t, T, p0=(setpoint, setpoint - T[-1], 60), bounds=([-np.inf, -np.inf, 1], [np.inf, np.inf, 1e5]), maxfev=2000)
+        except (RuntimeError, ValueError):
+            return None, None
+        if abs(final - setpoint) >= tolerance:
+            return None, float(final) #never settles inside the band on the current trend
+        ## offset*exp(-t/tau) has to shrink below what is left of the band around the asymptote
+        margin = tolerance - abs(final - setpoint)
+        remaining = tau*np.log(abs(offset)/margin) if abs(offset) > margin else 0.0
+        return float(max(remaining, 0.0)), float(final)
+
+    #block until the temperature has stayed within tolerance of the setpoint for hold seconds
+    def wait_until_stable(self, setpoint=None, **kwargs):
+        setpoint = self.setpoint if setpoint == None else setpoint
+        tolerance = kwargs.get('tolerance', 0.5)
+        hold = kwargs.get('hold', 60)
+        interval = kwargs.get('interval', 1)
+        timeout = kwargs.get('timeout', None)
+        callback = kwargs.get('callback', None) #called with (temperature, predicted seconds to the band)
+        stale = kwargs.get('stale', max(10*interval, 10)) #seconds without a new sample before giving up
+        if setpoint == None:
+            raise ValueError('No setpoint given')
+
+        started_sampler = self.sample_thread == None
+        self.start_sampling(interval)
+        start = time.monotonic()
+        try:
+            while True:
+                self.abort_event.wait(interval)
+                self.check_abort()
+                now = time.monotonic()
+                ## a dead sampler leaves only stale samples, which would never get into the band
+                if self.sample_thread == None or not self.sample_thread.is_alive():
+                    raise RuntimeError(f'Temperature sampling stopped ({self.sample_error!r})') from self.sample_error
+                if now - (self.samples[-1][0] if len(self.samples) > 0 else start) > stale:
+                    raise TimeoutError(f'No temperature reading for {stale} s')
+                recent = [x for x in self.samples if x[0] >= start]
+                if len(recent) == 0:
+                    continue
+                ## start of the current run of in-band samples
+                inside = None
+                for t, temp in reversed(recent):
+                    if abs(temp - setpoint) > tolerance:
+                        break
+                    inside = t
+                remaining, final = self.predict(setpoint, tolerance) if inside == None else (0.0, None)
+                if callback != None:
+                    callback(recent[-1][1], remaining)
+                if self.verbose == True:
+                    print(f'{recent[-1][1]:.2f} C, setpoint {setpoint} C, predicted {remaining} s to band')
+                if inside != None and now - inside >= hold:
+                    return {'temp' : recent[-1][1], 'time' : now - start, 'stable_since' : inside - start}
+                if timeout != None and now - start > timeout:
+                    raise TimeoutError(f'Temperature not stable after {timeout} s ({recent[-1][1]} C)')
+        finally:
+            if started_sampler:
+                self.stop_sampling()
+
+    #run a list of segments (target, rate in C/min or None to step, hold in s), waiting for each target to be stable.
+    #rate 0 is a hold: the setpoint stays where it is for hold seconds
+    def run_program(self, segments, **kwargs):
+        step_interval = kwargs.get('step_interval', 10) #seconds between setpoint updates on a ramp
+        tolerance = kwargs.get('tolerance', 0.5)
+        stable = kwargs.get('stable', 30) #seconds in band before a target counts as reached
+        self.program_log = []
+        self.start_temp()
+        self.start_sampling(kwargs.get('interval', 1))
+        start = time.monotonic()
+        try:
+            for n, (target, rate, hold) in enumerate(segments):
+                begin = time.monotonic()
+                if rate == 0:
+                    self.abort_event.wait(hold)
+                    self.check_abort()
+                    self.program_log.append({'segment' : n, 'target' : self.setpoint, 'start' : begin - start,
+                                             'reached' : begin - start, 'end' : time.monotonic() - start})
+                    continue
+                if rate != None and self.setpoint != None:
+                    ## the hotplate has no ramp of its own, move the setpoint along a monotonic schedule
+                    origin = self.setpoint
+                    duration = abs(target - origin)/rate*60
+                    ticks = int(duration//step_interval)
+                    for k in range(1, ticks + 1):
+                        self.abort_event.wait(max(begin + k*step_interval - time.monotonic(), 0))
+                        self.check_abort()
+                        self.set_temp(round(origin + (target - origin)*k*step_interval/duration, 2))
+                    self.abort_event.wait(max(begin + duration - time.monotonic(), 0))
+                    self.check_abort()
+                self.set_temp(target)
+                self.wait_until_stable(target, tolerance=tolerance, hold=stable, interval=kwargs.get('interval', 1))
+                reached = time.monotonic()
+                self.abort_event.wait(hold)
+                self.check_abort()
+                self.program_log.append({'segment' : n, 'target' : target, 'start' : begin - start,
+                                         'reached' : reached - start, 'end' : time.monotonic() - start})
+        finally:
+            self.stop_sampling()
+        return self.program_log
@@ -1,7 +1,45 @@
 from .main import instrument
+import asyncio
+import hashlib
+import re
+import threading
+import time
+
+prompt_re = re.compile(rb'(?:^|\n)\s*(T\*|[:><*])\s*$') #':' idle, '>' infusing, '<' withdrawing, '*' stalled, 'T*' target reached
+volume_units = {'l' : 1e3, 'ml' : 1, 'ul' : 1e-3, 'nl' : 1e-6, 'pl' : 1e-9} #to mL
 
 class Legato100(instrument):
 
+    ## Define useful command codes, {0} and {1} are filled with the parameters when the command is compiled
+    command_dict = {'query_address' : 'address {0}', 
+                    'query_catalog' : 'cat',
+                    'delete_program' : 'delmethod {0}', 
+                    'set_brightness' : 'dim {0}',
+                    'set_force' : 'force {0}',
+                    'set_rate' : 'irate {0} {1}',
+                    'calibrate_tilt' : 'tilt',
+                    'set_run_mode' : 'run',
+                    'stop' : 'stop',
+                    'display_config' : 'Config',
+                    'display_syringe' : 'syrm',
+                    'set_syringe_volume' : 'svolume {0}',
+                    'set_syringe_diameter' : 'diameter {0}',
+                    'set_target_volume' : 'tvolume {0} {1}',
+                    'set_time' :'ttime {0}',
+                    'status' : 'status',
+                    'infused_volume' : 'ivolume',
+                    'withdrawn_volume' : 'wvolume',
+                    'clear_volumes' : 'cvolume',
+                    'clear_target_volume' : 'ctvolume',
+                    'clear_target_time' : 'cttime',
+                    'set_withdraw_rate' : 'wrate {0} {1}',
+                    'set_ramp' : 'iramp {0} {1} {2} {1}',
+                    'set_withdraw_ramp' : 'wramp {0} {1} {2} {1}',
+                    'infuse' : 'irun',
+                    'withdraw' : 'wrun',
+                    'load_method' : 'load {0}'
+                    }
+
     def __init__(self, com_port, **kwargs):
         super().__init__(com_port,baud_rate=115200, **kwargs)
 
@@ -9,6 +47,10 @@ class Legato100(instrument):
         self.type = 'pump'
         self.address = 0
         self.unit = 'mL'
+        self.prompt = None #last prompt, ':' idle, '>' infusing, '<' withdrawing, '*' stalled, 'T*' target reached
+        self.methods = {} #content hash -> compiled method frames, kept on the host
+        self.method_thread = None
+        self.method_error = None #exception that ended the last host-sequenced method
 
         if 'address' in kwargs:
             self.address = kwargs.get('address')
@@ -21,40 +63,119 @@ class Legato100(instrument):
         ## Define user input variables
         parameter1, parameter2 = [kwargs.get(param, '') for param in ('parameter1', 'parameter2')]
 
-        ## Define useful command codes
-        command_dict = {'query_address' : f'address {parameter1}', 
-                        'query_catalog' : 'cat',
-                        'delete_program' : f'delmethod {parameter1}', 
-                        'set_brightness' : f'dim {parameter1}',
-                        'set_force' : f'force {parameter1}',
-                        'set_rate' : f'irate {parameter1} {parameter2}',
-                        'calibrate_tilt' : 'tilt',
-                        'set_run_mode' : 'run',
-                        'stop' : 'stop',
-                        'display_config' : 'Config',
-                        'display_syringe' : 'syrm',
-                        'set_syringe_volume' : f'svolume {parameter1}',
-                        'set_syringe_diameter' : f'diameter {parameter1}',
-                        'set_target_volume' : f'tvolume {parameter1} {parameter2}',
-                        'set_time' :f'ttime {parameter1}'
-                        }
-        
         ## Use kwargs to define if you want to print the command hex for troubleshoot
         if 'show_cmd' in kwargs:
             self.show_cmd = kwargs.get('show_cmd')
 
-        command_packet = command_dict[command]+'\r'
-        packet = command_packet.encode()
+        return self.send_packet(self.encode(command, parameter1, parameter2))
 
-        self.ser.write(packet)
-        self.response = self.ser.read_all()
-        if self.response == '':
-            self.response = self.ser.read_all()
+    def encode(self, command, parameter1='', parameter2='', parameter3=''):
+        return (self.command_dict[command].format(parameter1, parameter2, parameter3)+'\r').encode()
+
+    def send_packet(self, packet):
+        with self.io_lock:
+            self.check_abort()
+            self.ser.write(packet)
+            self.response = self.read_reply()
         if self.verbose == True:
             print('command Legato100: ',packet)
             print('response Legato100:',self.response)
         return self.response
     
+    def read_reply(self):
+        ## Every reply ends with the prompt on its own line, read until it arrives rather than taking whatever is buffered
+        response = b''
+        deadline = time.monotonic() + (self.timeout if self.timeout else 1)
+        while time.monotonic() < deadline:
+            response += self.ser.read(max(self.ser.in_waiting, 1))
+            match = prompt_re.search(response)
+            if match != None:
+                self.prompt = match.group(1).decode()
+                break
+        return response
+
+    def reply_text(self, response):
+        ## Last line of the reply, without the prompt
+        lines = [x.strip() for x in prompt_re.sub(b'', response).decode(errors='replace').splitlines()]
+        lines = [x for x in lines if x != '']
+        return lines[-1] if len(lines) > 0 else ''
+
+    def status(self):
+        ## 'status' answers with rate (fL/s), time (ms), volume (fL) and flags
+        text = self.reply_text(self.compile_cmd(command = 'status'))
+        fields = text.split()
+        if len(fields) < 4:
+            raise ValueError(f'Unexpected status reply {text!r}')
+        self.last_status = {'rate' : int(fields[0])*1e-12, 'time' : int(fields[1])/1000, 'volume' : int(fields[2])*1e-12,
+                            'flags' : fields[3], 'prompt' : self.prompt, 'running' : self.prompt in ['>','<'],
+                            'done' : self.prompt in [':','T*'], 'stalled' : self.prompt == '*'}
+        self.publish('volume', self.last_status['volume'])
+        return self.last_status
+
+    def parse_volume(self, text):
+        match = re.search(r'([-+0-9.eE]+)\s*([munp]?l)', text, re.IGNORECASE)
+        if match == None:
+            raise ValueError(f'Unexpected volume reply {text!r}')
+        return float(match.group(1))*volume_units[match.group(2).lower()]
+
+    def infused_volume(self): ## mL
+        return self.parse_volume(self.reply_text(self.compile_cmd(command = 'infused_volume')))
+
+    def withdrawn_volume(self): ## mL
+        return self.parse_volume(self.reply_text(self.compile_cmd(command = 'withdrawn_volume')))
+
+    def clear_volumes(self):
+        self.compile_cmd(command = 'clear_volumes')
+
+    def is_running(self):
+        return self.status()['running']
+
+    def wait_until_done(self, **kwargs):
+        ## Polls status until the pump stops, callback(status) is called on every poll for progress
+        interval = kwargs.get('interval', 0.2)
+        timeout = kwargs.get('timeout', None)
+        callback = kwargs.get('callback', None)
+        start = time.monotonic()
+        while True:
+            self.check_abort()
+            status = self.status()
+            if callback != None:
+                callback(status)
+            if status['stalled']:
+                raise RuntimeError(f'{self.model} on {self.com_port} stalled')
+            if not status['running']:
+                return status
+            if timeout != None and time.monotonic() - start > timeout:
+                raise TimeoutError(f'{self.model} on {self.com_port} still running after {timeout} s')
+            self.abort_event.wait(interval)
+
+    async def wait_done(self, **kwargs):
+        ## Awaitable wait_until_done, the serial polls run in the default executor
+        interval = kwargs.get('interval', 0.2)
+        timeout = kwargs.get('timeout', None)
+        callback = kwargs.get('callback', None)
+        loop = asyncio.get_event_loop()
+        start = time.monotonic()
+        while True:
+            self.check_abort()
+            status = await loop.run_in_executor(None, self.status)
+            if callback != None:
+                callback(status)
+            if status['stalled']:
+                raise RuntimeError(f'{self.model} on {self.com_port} stalled')
+            if not status['running']:
+                return status
+            if timeout != None and time.monotonic() - start > timeout:
+                raise TimeoutError(f'{self.model} on {self.com_port} still running after {timeout} s')
+            await asyncio.sleep(interval)
+
+    def stop_frame(self):
+        ## prebuilt stop, sent by emergency_stop straight to the port
+        return self.encode('stop')
+
+    def read_stop_ack(self):
+        return self.read_reply()
+
     def query_address(self):
         return self.compile_cmd(command = 'query_address', parameter1=self.address)
     
@@ -90,7 +211,10 @@ class Legato100(instrument):
         self.compile_cmd(command = 'set_run_mode')
 
     def stop(self):
-        self.compile_cmd(command = 'stop')
+        ## goes out even after an emergency stop
+        with self.io_lock:
+            self.ser.write(self.stop_frame())
+            return self.read_reply()
 
     def display_config(self):
         self.compile_cmd(command = 'config')
@@ -125,9 +249,141 @@ class Legato100(instrument):
             self.unit=kwargs.get('unit')
         self.set_target_volume(volume, unit = self.unit)
         if 'rate' in kwargs:
-            self.set_rate(kwargs.get('rate'))
+            self.set_rate(kwargs.get('rate'), kwargs.get('rate_unit', f'{self.unit}/min'))
         if 'target_time' in kwargs:
             self.set_target_time(kwargs.get('target_time'))
         self.set_run_mode()
+        if kwargs.get('wait', False):
+            return self.wait_until_done(callback=kwargs.get('callback', None))
+
+    
+
+    ## Methods: multi-step profiles compiled once into ready-to-send frames. The serial command set cannot store
+    ## a method on the pump, so the frames stay on the host and run_method sends them step by step
+
+    def compile_method(self, method):
+        ## Compiles a legato_method on the host, cached by content hash so the same profile is only compiled once
+        key = method.digest()
+        if key not in self.methods:
+            self.methods[key] = method.compile(self)
+        elif self.verbose == True:
+            print(f'method {method.name} already compiled ({key[:8]})')
+        return key
+
+    def run_method(self, method, **kwargs):
+        ## Methods saved on the pump itself (stored=) start with one load + run. Other profiles are host-sequenced:
+        ## a dedicated thread sends each step's precompiled frames on a monotonic schedule
+        if method.stored != None:
+            self.compile_cmd(command = 'load_method', parameter1 = method.stored)
+            self.set_run_mode()
+            if kwargs.get('wait', True):
+                return self.wait_until_done(callback=kwargs.get('callback', None))
+            return None
+
+        steps = self.methods[self.compile_method(method)]
+        self.method_log = []
+        self.method_error = None
+
+        def execute():
+            try:
+                start = time.monotonic()
+                planned, pumping = 0, False
+                for n, (frames, duration, runs) in enumerate(steps):
+                    ## wait for the planned start, then for the previous step to finish if the pump is running late
+                    self.abort_event.wait(max(start + planned - time.monotonic(), 0))
+                    while pumping and self.status()['running']:
+                        self.abort_event.wait(0.01)
+                        self.check_abort()
+                    self.check_abort()
+                    began = time.monotonic()
+                    for packet in frames:
+                        self.send_packet(packet)
+                    self.method_log.append({'step' : n, 'planned' : planned, 'start' : began - start, 'error' : began - start - planned})
+                    planned, pumping = planned + duration, runs
+                self.abort_event.wait(max(start + planned - time.monotonic(), 0))
+                self.check_abort()
+            except BaseException as error:
+                ## kept for the caller, and the pump is not left running a half-finished profile
+                self.method_error = error
+                try:
+                    self.stop()
+                except Exception:
+                    pass
+
+        self.method_thread = threading.Thread(target=execute, name=f'{self.com_port} method', daemon=True)
+        self.method_thread.start()
+        if kwargs.get('wait', True):
+            return self.join_method()
+        return self.method_thread
+
+    def join_method(self, timeout=None):
+        ## Waits for a host-sequenced method, re-raises whatever stopped it, returns the step log
+        if self.method_thread != None:
+            self.method_thread.join(timeout)
+            if self.method_thread.is_alive():
+                raise TimeoutError(f'{self.model} on {self.com_port} method still running after {timeout} s')
+        if self.method_error != None:
+            raise self.method_error
+        return self.method_log
+
+
+class legato_method():
+    ## Python-defined infusion/withdraw profile, rates in unit/min
+
+    def __init__(self, name='method', **kwargs):
+        self.name = name
+        self.unit = kwargs.get('unit', 'ml')
+        self.stored = kwargs.get('stored', None) #name of a method saved on the pump
+        self.steps = []
+
+    def infuse(self, volume, rate):
+        self.steps.append(('infuse', float(volume), float(rate)))
+        return self
+
+    def withdraw(self, volume, rate):
+        self.steps.append(('withdraw', float(volume), float(rate)))
+        return self
+
+    def ramp(self, start_rate, end_rate, seconds, direction='infuse'):
+        self.steps.append(('ramp', float(start_rate), float(end_rate), float(seconds), direction))
+        return self
+
+    def pause(self, seconds):
+        self.steps.append(('pause', float(seconds)))
+        return self
+
+    def digest(self):
+        return hashlib.sha1(repr((self.unit, self.steps)).encode()).hexdigest()
+
+    def compile(self, pump):
+        ## (frames, duration in s, pump runs during the step) for every step
+        rate_unit = f'{self.unit}/min'
+        compiled = []
+        for step in self.steps:
+            if step[0] in ['infuse', 'withdraw']:
+                kind, volume, rate = step
+                set_rate = 'set_rate' if kind == 'infuse' else 'set_withdraw_rate'
+                frames = [pump.encode('clear_target_time'), pump.encode('set_target_volume', volume, self.unit),
+                          pump.encode(set_rate, rate, rate_unit), pump.encode(kind)]
+                compiled.append((frames, 60*volume/rate, True))
+            elif step[0] == 'ramp':
+                kind, start_rate, end_rate, seconds, direction = step
+                set_ramp = 'set_ramp' if direction == 'infuse' else 'set_withdraw_ramp'
+                frames = [pump.encode('clear_target_volume'), pump.encode(set_ramp, start_rate, rate_unit, end_rate),
+                          pump.encode('set_time', seconds), pump.encode(direction)]
+                compiled.append((frames, seconds, True))
+            else:
+                compiled.append(([], step[1], False))
+        return compiled
 
-    
\ No newline at end of file
+    def volume(self):
+        ## net volume moved by the profile, ramps are linear in rate
+        total = 0
+        for step in self.steps:
+            if step[0] == 'infuse':
+                total += step[1]
+            elif step[0] == 'withdraw':
+                total -= step[1]
+            elif step[0] == 'ramp':
+                total += (1 if step[4] == 'infuse' else -1)*(step[1] + step[2])/2*step[3]/60
+        return total
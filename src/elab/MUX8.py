@@ -1,4 +1,6 @@
-from .main import instrument
+from .main import instrument, null_lock
+import time
+import pandas as pd
 
 class MUX8(instrument):
 
@@ -32,9 +34,94 @@ class MUX8(instrument):
             raise ValueError('Collector n must be between 1 and 4')
         self.send_comm(n_coll[n-1])
 
+    def codes(self, kind, *n):
+        ## Relay command numbers for one plan step, validated like the single-switch methods
+        if kind == 'electrode':
+            if n[0] not in range(1,9):
+                raise ValueError('Electrode n must be between 1 and 8')
+            return [n[0]+10]
+        if kind == 'ida':
+            if n[0] not in range(1,5):
+                raise ValueError('IDA n must be between 1 and 4')
+            return [n[0]]
+        if kind in ['gen', 'coll', 'pair']:
+            gen, coll = (n[0], None) if kind == 'gen' else (None, n[0]) if kind == 'coll' else n
+            if any(x not in range(1,5) for x in [gen, coll] if x != None):
+                raise ValueError('Generator/collector n must be between 1 and 4')
+            return ([[14,13,12,11][gen-1]] if gen != None else []) + ([[15,16,17,18][coll-1]] if coll != None else [])
+        if kind in ['gen_all', 'coll_all', 'all']:
+            return [{'gen_all' : 30, 'coll_all' : 20, 'all' : 40}[kind]]
+        raise ValueError(f'Unknown plan step {kind}')
+
+    def scan(self, plan, acquire, **kwargs):
+        ## Runs acquire(step, mux) on every step of the plan. Each step's commands are prebuilt, written back to back
+        ## and their acknowledgements collected together, so a gen/coll pair costs one round trip instead of two.
+        ## With a relay settle time the scan is pipelined by default, a step's acknowledgements are read once the next
+        ## step's switch has gone out, taking the round trip off the critical path. Without settle the acknowledgement
+        ## is the only sign the relay has switched, so each step waits for it. pipeline=True/False overrides either
+        settle = kwargs.get('settle', 0) #seconds after switching before acquiring
+        repeat = kwargs.get('repeat', 1)
+        pipeline = kwargs.get('pipeline', settle > 0)
+        steps = [(step, b''.join(f'<{n}>'.encode() for n in self.codes(*step)), len(self.codes(*step))) for step in plan]
+        self.scan_log = []
+        self.scan_results = []
+        start = time.monotonic()
+
+        def read_acks(count, strict=True):
+            for x in range(count):
+                msg = self.ser.readline()
+                if msg == b'':
+                    if not strict:
+                        return
+                    raise TimeoutError(f'{self.model} on {self.com_port} did not acknowledge a switch')
+                if self.verbose == True:
+                    print(msg.decode('utf-8'))
+
+        pending = 0 #acknowledgements written for but not read yet
+        failed = True
+        ## while pipelining the port stays held from a switch to its acknowledgements, so nobody else reads them
+        with self.io_lock if pipeline else null_lock():
+            try:
+                for cycle in range(repeat):
+                    for step, packet, acks in steps:
+                        self.check_abort()
+                        begin = time.monotonic()
+                        with self.io_lock:
+                            self.ser.write(packet)
+                            switched = time.monotonic()
+                            previous, pending = pending, acks
+                            read_acks(previous) #previous step's, already waiting in the buffer
+                            if not pipeline:
+                                read_acks(acks)
+                                pending = 0
+                                switched = time.monotonic()
+                        if settle > 0:
+                            self.abort_event.wait(max(0, settle - (time.monotonic() - switched)))
+                            self.check_abort()
+                        acquired = time.monotonic()
+                        result = acquire(step, self)
+                        done = time.monotonic()
+                        self.scan_results.append((cycle, step, result))
+                        self.scan_log.append({'cycle' : cycle, 'step' : ' '.join(str(x) for x in step), 'start' : begin - start,
+                                              'switch' : switched - begin, 'acquire' : done - acquired,
+                                              'total' : done - begin})
+                failed = False
+            finally:
+                ## the last step's acknowledgements, read even when acquire fails so they don't answer the next
+                ## command, without hiding its error
+                with self.io_lock:
+                    read_acks(pending, strict=not failed)
+        return self.scan_results
+
+    def scan_timing(self):
+        ## mean switching, acquisition and total time per plan step
+        return pd.DataFrame(self.scan_log).groupby('step', sort=False)[['switch','acquire','total']].mean()
+
     def send_comm(self,n):
-        self.ser.write(bytes(f'<{n}>', 'utf-8'))
-        msg = self.ser.readline()
+        with self.io_lock:
+            self.check_abort()
+            self.ser.write(bytes(f'<{n}>', 'utf-8'))
+            msg = self.ser.readline()
         if self.verbose == True:
             print(msg.decode('utf-8'))
 
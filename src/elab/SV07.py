@@ -1,9 +1,15 @@
 from .main import instrument
+from .codec import runze_codec
 import time
 
 class SV07(instrument):
     '''
     '''
+    ##define possible command codes
+    command_dict = {'query_address' : 0x20, 'query_position' : 0x3E,
+                'query_version' : 0x3F, 'change_port' : 0x44, 
+                'reset' : 0x45, 'origin_reset' : 0x4F, 'strong_stop' : 0x49}
+
     def __init__(self, com_port, **kwargs):
         super().__init__(com_port, **kwargs)
 
@@ -11,62 +17,75 @@ class SV07(instrument):
         self.type = 'valve'
         self.address = 0x00
         self.ports = 16
+        self.position = None #last port moved to, None until the first move and after any other command or a stop
+        self.move_timeout = 30 #seconds check_movement waits for a move to finish
+        self.max_silent = 5 #unanswered status queries in a row before check_movement gives up
         if 'address' in kwargs:
             self.address = kwargs.get('address')
+        if 'move_timeout' in kwargs:
+            self.move_timeout = kwargs.get('move_timeout')
+        self.codec = runze_codec(self.address)
 
         if self.verbose == True:
             print(f'{self.model} connected on {com_port} at {self.baud_rate} bits/s')
 
 
     def compile_cmd(self, command, **kwargs):
-
-        ##define possible command codes
-        command_dict = {'query_address' : 0x20, 'query_position' : 0x3E,
-                    'query_version' : 0x3F, 'change_port' : 0x44, 
-                    'reset' : 0x45, 'origin_reset' : 0x4F, 'strong_stop' : 0x49}
-        command_hex = command_dict[command]
-        parameter1 = 0x00
-        parameter2 = 0x00
-        if 'parameter1' in kwargs:
-            parameter1 = kwargs.get('parameter1')
-        if 'parameter2' in kwargs:
-            parameter2 = kwargs.get('parameter2')
+        command_hex = self.command_dict[command]
+        parameter1 = kwargs.get('parameter1', 0x00)
+        parameter2 = kwargs.get('parameter2', 0x00)
         packet = self.build_packet(command_hex,parameter1,parameter2)
+        if not command.startswith('query'):
+            self.position = None #unknown until port() confirms the move
         self.response = self.write_read(packet)
-        if self.response == '':
-            self.response = self.ser.read(8)
         if self.verbose == True:
             print('command SV07: ',packet.hex())
             print('response SV07:',self.response.hex())
         return self.response
     
     def build_packet(self,command_hex,parameter1,parameter2):
-        # compile: B0 frame header, B1 address byte, B2 command byte, B3 parameter byte 1, B4 parameter byte 2, B5 end of frame, B6 checksum MSB, B7 checksum LSB B8 frame end
-        packet = bytearray([0xCC,self.address,command_hex,parameter1,parameter2,0xDD])
-        #Make sure checksum is little end, here the bytearray goes: [Least significant bit, Most significant bit]
-        checksum = bytearray([(sum(packet) & 0xFF), (sum(packet) >> 8)])
-        packet.extend(checksum)
-        return packet
+        # compile: B0 frame header, B1 address byte, B2 command byte, B3 parameter byte 1, B4 parameter byte 2, B5 end of frame, B6 checksum LSB, B7 checksum MSB
+        return self.codec.encode(command_hex,parameter1,parameter2)
     
     def write_read(self,packet):
-        self.ser.write(packet)
-        return self.ser.read(8)
+        #checksum-validated reply, b'' if nothing valid arrived before the timeout. An abort is checked under the
+        #port lock, so once it is set the emergency stop is the next exchange on the port
+        with self.io_lock:
+            self.check_abort()
+            self.ser.write(packet)
+            return self.codec.read_frame(self.ser)
 
     def check_movement(self):
-        packet = self.build_packet(0x4A,0x00,0x00)
+        #polls until the motor is idle, raises TimeoutError if the move outlasts move_timeout or the device stops answering
+        packet = self.codec.frame(0x4A)
+        deadline = time.monotonic() + self.move_timeout
+        silent = 0
         movement_status = self.write_read(packet)
-        while movement_status[2] != 0x00:
+        while movement_status == b'' or movement_status[2] != 0x00:
+            silent = silent + 1 if movement_status == b'' else 0
+            if silent >= self.max_silent or time.monotonic() > deadline:
+                raise TimeoutError(f'{self.model} on {self.com_port} did not finish moving')
+            self.check_abort()
             movement_status = self.write_read(packet)
         return
+
+    def stop_frame(self):
+        #prebuilt strong stop, sent by emergency_stop straight to the port
+        return self.codec.frame(self.command_dict['strong_stop'])
+
+    def read_stop_ack(self):
+        return self.codec.read_frame(self.ser)
     
     def reset(self):
         self.compile_cmd('reset')
         self.check_movement()
+        self.position = None
         time.sleep(1)
 
     def origin_reset(self):
         self.compile_cmd('origin_reset')
         self.check_movement()
+        self.position = None
         time.sleep(1)
 
     def port(self, port):
@@ -76,5 +95,6 @@ class SV07(instrument):
             print(f'Moving to port {port}!')
         self.compile_cmd(command='change_port', parameter1=port)
         self.check_movement()
+        self.position = port
         time.sleep(1)
 
@@ -3,11 +3,59 @@ This class implements serial communication with the Runze multichannel syringe p
 '''
 
 from .main import instrument
+from .settle import settle_model
+from .codec import dt_codec
 import time
-import re
 
 class SY01B(instrument):
 
+    ## Define useful command codes, {0} is filled with parameter1 when the command is compiled
+    command_dict = {
+        'set_mode' : 'N{0}R',                ## 0,1,2 = Normal, fine and microstep mode
+        'set_backlash_increments':'K{0}R',   ## 0-1600, helps compensate for mechanical play to ensure correct position for dispensing
+        'init_pump' : 'N2Z1R',               ## Initializes pump-valve to be in microstep mode, backlash of 3200, at half force, default speed. Sets valve to change in CW manner.
+        'set_port' : 'I{0}R',                ## Sets valve position to port [parameter1]
+        'set_position' : 'A{0}R',            ## Sets absolute plunger position, 0-96000 for microstep mode, 0-12000 in standard mode
+        'relative_pickup' : 'P{0}R',         ## Moves plunger down specified number of increments
+        'relative_dispense' : 'D{0}R',       ## Moves plunger up specified number of increments
+        'set_acceleration' : 'L{0}R',        ## Sets speed ramp of plunger, [parameter1] * 2500 pulses/sec^2, 1-20, default=14
+        'set_start_speed' : 'v{0}R',         ## Sets start speed of plunger in pulses/sec, 1-1000, default=900, must be less than top speed, will ramp up to start speed
+        'set_top_speed' : 'V{0}R',           ## Set top speed of plunger, 1-6000, default=4000
+        'set_speed' : 'V{0}R',               ## Use top speed to set speed, if top speed is lower than start and cutoff speed, auto sets speed to this
+        'set_preset_speed' : 'S{0}R',        ## A list of 41 preset speed modes, 0-40, 40 being the slowest and 0 being the fastest
+        'set_cutoff_speed' : 'c{0}R',        ## Speed at which the plunger ends its movement, 1-1500 in microstep, default = 900, only valid during dispense
+                                             ## start speed <= cutoff speed <= top speed, speed values are in half-steps or microsteps/second (each pulse is one half/microstep)
+        'repeat' : 'XR',                     ## The device repeats the last executed command
+        'repeat_sequence' : 'G{0}R',         ## Repeat the last executed command n number of times, n = 0-48000
+        'delay' : 'M{0}R',                   ## Delay execution of a command in milliseconds rounded to nearest multiple of 5. Allows for liquid to stop oscillating in syringe
+        'stop' : 'HR',                       ## Halts execution of string command
+        'strong_stop' : 'TR',                ## Terminates plunger movement, reinitialization is recommended
+        'reset' : 'A0R',                     ## Reset pump to position 0
+        'origin_reset' : 'A0A150R',
+
+        ## Report commands below, do not require R exection commands
+        'query_position' : '?',              ## Reports absolute position of plunger in microsteps
+        'query_start_speed' : '?1',          ## Report start speed in pulses/sec
+        'query_top_speed' : '?2',
+        'query_cutoff_speed' : '?3',
+        'query_actual_position' : '?4',      ##Reports plunger encoder position
+        'query_valve' : '?6',
+        'query_command_status' : '?10',      ## Returns 0 if buffer empty, 1 if not
+        'query_backlash_increments' : '?12',
+        'query_input_1_status' : '?13',      ## Returns 0 or 1, 0 = low, 1 = high
+        'query_input_2_status' : '?14',      ## ^
+        'query_movement' : '?16',            ## Returns number of plunger moves
+        'query_valve_movement' : '?17',      ## Returns number of valve movements
+        'query_acceleration' : '?25',
+        'query_mode' : '?28',                ## Reports mode set by N (0,1,2 = normal, fine, microstep)
+        'query_device_status' : '?29',       ## Reports device status (error code)
+        'query_status' : 'Q',                ## Reports error codes and pump status, bits 0-3 = error code, bit 5 = status bit, 0 = busy, 1 = not
+        'query_version' : '#',
+        'query_max_speed' : '?2'}
+
+    ## commands that can leave the valve somewhere other than the cached position
+    valve_commands = ('init_pump', 'set_port', 'stop', 'strong_stop', 'origin_reset')
+
     def __init__(self, com_port, **kwargs):
         super().__init__(com_port, **kwargs)
 
@@ -17,13 +65,30 @@ class SY01B(instrument):
         self.total_volume = 500 #define total volume, for our model it is 500 uL
         self.current_position = 0 #setting a fake starting position
         self.ports = 9
+        self.position = None #last valve port moved to, None until the first move and after any other command or a stop
+        self.move_timeout = 60 #seconds check_movement waits for the pump to become ready
+        self.max_silent = 5 #unanswered position queries in a row before query_position gives up
         self.mode = 0 #store motor mode
         self.position_range = 12001 
         self.unit = 'uL'
+        self.speed = 4000 #top speed in microsteps/sec, pump default
+
+        ## settle delays after each move, at the default speed in microstep mode (about 0.042 strokes/s) a full stroke
+        ## waits 0.8 s after an aspirate and 0.33 s after a discharge, under the old fixed sleeps (volume/1000+0.5 s
+        ## and 0.5 s) for any volume, and slower speeds wait less
+        self.settle_defaults = {'aspirate' : {'base' : 0, 'k_rate' : 12, 'k_volume' : 0.3},
+                                'discharge' : {'base' : 0, 'k_rate' : 8, 'k_volume' : 0}}
+        self.legacy_settle = {'aspirate' : {'base' : 0.5, 'k_rate' : 0, 'k_volume' : self.total_volume/1000},
+                              'discharge' : {'base' : 0.5, 'k_rate' : 0, 'k_volume' : 0}}
 
-    
         if 'address' in kwargs:
             self.address = kwargs.get('address')
+        if 'move_timeout' in kwargs:
+            self.move_timeout = kwargs.get('move_timeout')
+        self.codec = dt_codec(self.address)
+        self.status_packet = self.build_packet('Q')
+
+        self.settle = settle_model(self, **kwargs.get('settle', {}))
 
         if self.verbose == True:
             print(f'{self.model} connected on {com_port} at {self.baud_rate} bits/s')
@@ -35,61 +100,18 @@ class SY01B(instrument):
         ## Define user input variables with kwargs
         parameter1 = kwargs.get('parameter1', '')  ##If not found, default parameter = ''
 
-        ## Define useful command codes
-        command_dict = {
-            'set_mode' : f'N{parameter1}R',              ## 0,1,2 = Normal, fine and microstep mode
-            'set_backlash_increments':f'K{parameter1}R', ## 0-1600, helps compensate for mechanical play to ensure correct position for dispensing
-            'init_pump' : 'N2Z1R',                       ## Initializes pump-valve to be in microstep mode, backlash of 3200, at half force, default speed. Sets valve to change in CW manner.
-            'set_port' : f'I{parameter1}R',              ## Sets valve position to port [parameter1]
-            'set_position' : f'A{parameter1}R',          ## Sets absolute plunger position, 0-96000 for microstep mode, 0-12000 in standard mode
-            'relative_pickup' : f'P{parameter1}R',       ## Moves plunger down specified number of increments
-            'relative_dispense' : f'D{parameter1}R',     ## Moves plunger up specified number of increments
-            'set_acceleration' : f'L{parameter1}R',      ## Sets speed ramp of plunger, [parameter1] * 2500 pulses/sec^2, 1-20, default=14
-            'set_start_speed' : f'v{parameter1}R',       ## Sets start speed of plunger in pulses/sec, 1-1000, default=900, must be less than top speed, will ramp up to start speed
-            'set_top_speed' : f'V{parameter1}R',         ## Set top speed of plunger, 1-6000, default=4000
-            'set_speed' : f'V{parameter1}R',             ## Use top speed to set speed, if top speed is lower than start and cutoff speed, auto sets speed to this
-            'set_preset_speed' : f'S{parameter1}R',      ## A list of 41 preset speed modes, 0-40, 40 being the slowest and 0 being the fastest
-            'set_cutoff_speed' : f'c{parameter1}R',      ## Speed at which the plunger ends its movement, 1-1500 in microstep, default = 900, only valid during dispense
-                                                         ## start speed <= cutoff speed <= top speed, speed values are in half-steps or microsteps/second (each pulse is one half/microstep)
-            'repeat' : 'XR',                             ## The device repeats the last executed command
-            'repeat_sequence' : f'G{parameter1}R',       ## Repeat the last executed command n number of times, n = 0-48000
-            'delay' : f'M{parameter1}R',                 ## Delay execution of a command in milliseconds rounded to nearest multiple of 5. Allows for liquid to stop oscillating in syringe
-            'stop' : 'HR',                               ## Halts execution of string command
-            'strong_stop' : 'TR',                        ## Terminates plunger movement, reinitialization is recommended
-            'reset' : 'A0R',                              ## Reset pump to position 0
-            'origin_reset' : 'A0A150R',
-
-            ## Report commands below, do not require R exection commands
-            'query_position' : '?',             ## Reports absolute position of plunger in microsteps
-            'query_start_speed' : '?1',         ## Report start speed in pulses/sec
-            'query_top_speed' : '?2',
-            'query_cutoff_speed' : '?3',
-            'query_actual_position' : '?4',     ##Reports plunger encoder position
-            'query_valve' : '?6',
-            'query_command_status' : '?10',     ## Returns 0 if buffer empty, 1 if not
-            'query_backlash_increments' : '?12',
-            'query_input_1_status' : '?13',     ## Returns 0 or 1, 0 = low, 1 = high
-            'query_input_2_status' : '?14',     ## ^
-            'query_movement' : '?16',           ## Returns number of plunger moves
-            'query_valve_movement' : '?17',     ## Returns number of valve movements
-            'query_acceleration' : '?25',
-            'query_mode' : '?28',               ## Reports mode set by N (0,1,2 = normal, fine, microstep)
-            'query_device_status' : '?29',      ## Reports device status (error code)
-            'query_status' : 'Q',               ## Reports error codes and pump status, bits 0-3 = error code, bit 5 = status bit, 0 = busy, 1 = not
-            'query_version' : '#',
-            'query_max_speed' : '?2'}               
-
-
         ## Use kwargs to define if you want to print the command hex for troubleshoot
         if 'show_cmd' in kwargs:
             self.show_cmd = kwargs.get('show_cmd')
 
         ## Compile and send command, read out instrument response
-        packet = self.build_packet(command_dict[command])
-        self.response = self.write_read(packet)
-        if self.response == b'':
-            time.sleep(0.3)
-            self.response = self.ser.read_all()
+        packet = self.build_packet(self.command_dict[command].format(parameter1))
+        if command in self.valve_commands:
+            self.position = None ## unknown until port() confirms the move
+        with self.io_lock:
+            self.response = self.write_read(packet)
+            if self.response == b'':
+                self.response = self.ser.read_all()
         if self.verbose == True:
             print('command SY01B: ',packet)
             print('response SY01B:',self.response)
@@ -132,18 +154,17 @@ class SY01B(instrument):
     def build_packet(self,command_ascii,**kwargs): ##
         parameter1,parameter2 = [kwargs.get(param,'') for param in ('parameter1','parameter2')]
         ## Required packet for DT protocol is: start command ('/'), pump address, data block (length n), carriage return ('\r')
-        packet = f'/{self.address}{command_ascii}{parameter1}{parameter2}\r'.encode()  #Some commands require an input variable as well as a 'R' character before \r to execute properly
+        packet = self.codec.prefix + f'{command_ascii}{parameter1}{parameter2}\r'.encode()  #Some commands require an input variable as well as a 'R' character before \r to execute properly
         return packet
 
-    def write_read(self,packet): ##
-        self.ser.write(packet)
-        response = self.ser.read_all()
-        if response == b'':
-            time.sleep(0.1)
-            response = self.ser.read_all()
-        return response
+    def write_read(self,packet): ## abort is checked under the port lock, so once it is set the emergency stop goes next
+        with self.io_lock:
+            self.check_abort()
+            self.ser.write(packet)
+            return self.codec.read_reply(self.ser) ## returns as soon as the ETX byte arrives, skips line noise in front of the reply
     
     def init_pump(self): ##
+        self.position = None
         return self.compile_cmd('init_pump')
     
     def set_mode(self,mode): ##
@@ -158,16 +179,25 @@ class SY01B(instrument):
             raise ValueError('Mode must be 0, 1, or 2: denoting normal, fine, or micropositioning modes')
         
     def decode_response(self,response):
-        cleaned_response = re.sub(r'[^\x20-\x7E]','',response.decode('latin-1').strip()) #Get rid of all non convertable hex, decode the byte array, strip the response
-        return cleaned_response
+        return self.codec.decode(response) #Get rid of all non convertable hex, decode the byte array, strip the response
         
     def check_movement(self):  
-        packet = self.build_packet('Q')
+        packet = self.status_packet
+        deadline = time.monotonic() + self.move_timeout
         movement_status = self.write_read(packet)
         response = self.decode_response(movement_status)
         while not response.startswith('/0`'):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f'{self.model} on {self.com_port} did not become ready')
+            self.check_abort()
             response = self.decode_response(self.write_read(packet))
         return
+
+    def stop_frame(self): ## prebuilt strong stop, sent by emergency_stop straight to the port
+        return self.build_packet(self.command_dict['strong_stop'])
+
+    def read_stop_ack(self):
+        return self.codec.read_reply(self.ser)
     
     def stop(self):
         self.compile_cmd('stop')
@@ -175,12 +205,16 @@ class SY01B(instrument):
     
     def query_position(self):  ## Query plunger position
         query_result = self.compile_cmd('query_position')
-        while query_result == '':
-            query_result = self.ser.read_all() 
+        for attempt in range(self.max_silent):
+            if query_result != b'':
+                break
+            query_result = self.compile_cmd('query_position') ## each try waits up to the port timeout and stops on an abort
+        if query_result == b'':
+            raise TimeoutError(f'{self.model} on {self.com_port} did not report its position')
         position = int(self.decode_response(query_result).split('`')[1])  
         if self.verbose == True:
             print(f'query: {query_result}, position: {position}')
-        return position
+        return self.publish('position', position)
     
     def reset(self): ##
         self.compile_cmd('reset')
@@ -189,6 +223,7 @@ class SY01B(instrument):
 
     def full_reset(self):  ##
         self.compile_cmd('init_pump')
+        self.position = None
 
     def origin_reset(self): ##
         self.compile_cmd('origin_reset')
@@ -200,6 +235,7 @@ class SY01B(instrument):
             print(f'Moving to port {port}!')
         self.compile_cmd(command='set_port', parameter1=port)
         self.check_movement()
+        self.position = port
         time.sleep(1)
     
 
@@ -209,6 +245,7 @@ class SY01B(instrument):
                 rate = self.total_volume/96000*speed*60
                 print(f'Speed set to {speed} steps/sec! Flow rate is {rate} uL/min')
             self.compile_cmd(command='set_speed', parameter1=speed)
+            self.speed = speed
         else:
             raise ValueError("Speed is too fast!")
 
@@ -222,6 +259,21 @@ class SY01B(instrument):
             raise ValueError("Flow rate is too fast!")
         
 
+    def flow_rate(self): ## uL/s at the current speed
+        return self.speed*self.total_volume/(self.position_range-1)
+
+    def step_volume(self): ## smallest volume the plunger can move
+        return self.total_volume/(self.position_range-1)
+
+    def set_flow_rate(self, rate): ## store a measured flow rate, expressed back as a speed
+        self.speed = int(rate*(self.position_range-1)/self.total_volume)
+
+    def move_volume(self, volume, direction): ## move the plunger without any settling, used for calibration
+        steps_to_move = int(volume*((self.position_range-1)/self.total_volume))
+        command = {'aspirate' : 'relative_pickup', 'discharge' : 'relative_dispense'}[direction]
+        self.compile_cmd(command=command, parameter1=steps_to_move)
+        self.check_movement()
+
     def move_to_position(self, position, **kwargs): ##
         #check kwargs for speed first, adjust if desired
         if 'speed' in kwargs:
@@ -259,7 +311,7 @@ class SY01B(instrument):
             self.compile_cmd(command='relative_pickup', parameter1=steps_to_move)
             self.check_movement()
             self.current_position = self.query_position()
-            time.sleep(volume/1000+0.5)
+            self.settle.wait(volume, 'aspirate')
         else:
             #driver will not move if command is beyond limits so no need to raise Value error
             raise ValueError("Beyond stroke limits!")
@@ -275,7 +327,9 @@ class SY01B(instrument):
         #query current position
         self.current_position = self.query_position()
         #allow for string 'all' to dispense everything in syringe
+        discharged = volume
         if volume == 'all':
+            discharged = self.current_position*self.total_volume/(self.position_range-1)
             self.compile_cmd('set_position',parameter1=0)
             self.check_movement()
             self.current_position = self.query_position()
@@ -291,7 +345,7 @@ class SY01B(instrument):
                 self.compile_cmd(command='set_position',parameter1=0)
                 self.check_movement()
                 self.current_position = self.query_position()
-        time.sleep(0.5)
+        self.settle.wait(discharged, 'discharge')
 
 def set_total_volume(self,vol):
     if type(vol) == int:
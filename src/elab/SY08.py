@@ -1,8 +1,19 @@
 from .main import instrument
+from .settle import settle_model
+from .codec import runze_codec
 import time
 
 class SY08(instrument):
 
+    ##define useful command codes
+    command_dict = {'query_address' : 0x20, 'query_subdivision' : 0x25,
+                'query_max_speed' : 0x27, 'query_version' : 0x3F,
+                'query_motor_status' : 0x4A, 'query_position' : 0x66,
+                'set_speed' : 0x4B, 'aspirate' : 0x4D,
+                'discharge' : 0x42,'set_position' : 0x4E, 
+                'reset' : 0x45, 'forced_reset' : 0x4F, 
+                'strong_stop' : 0x49, 'device_reset' : 0xAA}
+
     def __init__(self, com_port, **kwargs):
         super().__init__(com_port, **kwargs)
 
@@ -11,68 +22,90 @@ class SY08(instrument):
         self.address = 0x00
         self.total_volume = 5 #define total volume, for our model it is 5 mL
         self.current_position = 0 #setting a fake starting position
+        self.unit = 'mL'
+        self.speed = 600 #speed parameter, 0-600
+        self.max_rate = 1.0 #mL/s at speed 600, estimate until settle.calibrate_rate() is run
+
+        ## settle delays after each move, at speed 600 (0.2 strokes/s) an aspirate waits 0.9 s/mL and a discharge
+        ## at most 0.3 s, under the old fixed sleeps (volume*1.1 s and 0.5 s) for any volume, slower speeds wait less
+        self.settle_defaults = {'aspirate' : {'base' : 0, 'k_rate' : 10, 'k_volume' : 2.5},
+                                'discharge' : {'base' : 0, 'k_rate' : 1.5, 'k_volume' : 0}}
+        self.legacy_settle = {'aspirate' : {'base' : 0, 'k_rate' : 0, 'k_volume' : 5.5},
+                              'discharge' : {'base' : 0.5, 'k_rate' : 0, 'k_volume' : 0}}
+
+        self.move_timeout = 60 #seconds check_movement waits for a move to finish
+        self.max_silent = 5 #unanswered status queries in a row before check_movement gives up
 
         if 'address' in kwargs:
             self.address = kwargs.get('address')
+        if 'move_timeout' in kwargs:
+            self.move_timeout = kwargs.get('move_timeout')
+        self.codec = runze_codec(self.address)
+
+        self.settle = settle_model(self, **kwargs.get('settle', {}))
 
         if self.verbose == True:
             print(f'{self.model} connected on {com_port} at {self.baud_rate} bits/s')
         
 
     def compile_cmd(self, command, **kwargs):
-        ##define useful command codes
-        command_dict = {'query_address' : 0x20, 'query_subdivision' : 0x25,
-                    'query_max_speed' : 0x27, 'query_version' : 0x3F,
-                    'query_motor_status' : 0x4A, 'query_position' : 0x66,
-                    'set_speed' : 0x4B, 'aspirate' : 0x4D,
-                    'discharge' : 0x42,'set_position' : 0x4E, 
-                    'reset' : 0x45, 'forced_reset' : 0x4F, 
-                    'strong_stop' : 0x49, 'device_reset' : 0xAA}
-        command_hex = command_dict[command]
-        parameter1 = 0x00
-        parameter2 = 0x00
-        if 'parameter1' in kwargs:
-            parameter1 = kwargs.get('parameter1')
-        if 'parameter2' in kwargs:
-            parameter2 = kwargs.get('parameter2')
+        command_hex = self.command_dict[command]
+        parameter1 = kwargs.get('parameter1', 0x00)
+        parameter2 = kwargs.get('parameter2', 0x00)
         packet = self.build_packet(command_hex,parameter1,parameter2)
         self.response = self.write_read(packet)
-        if self.response == '':
-            self.response = self.ser.read(8)
         if self.verbose == True:
             print('command SY08: ',packet.hex())
             print('response SY08:',self.response.hex())
         return self.response
         
     def build_packet(self,command_hex,parameter1,parameter2):
-        # compile: B0 frame header, B1 address byte, B2 command byte, B3 parameter byte 1, B4 parameter byte 2, B5 end of frame, B6 checksum MSB, B7 checksum LSB B8 frame end
-        packet = bytearray([0xCC,self.address,command_hex,parameter1,parameter2,0xDD])
-        #Make sure checksum is little end, here the bytearray goes: [Least significant bit, Most significant bit]
-        checksum = bytearray([(sum(packet) & 0xFF), (sum(packet) >> 8)])
-        packet.extend(checksum)
-        return packet
+        # compile: B0 frame header, B1 address byte, B2 command byte, B3 parameter byte 1, B4 parameter byte 2, B5 end of frame, B6 checksum LSB, B7 checksum MSB
+        return self.codec.encode(command_hex,parameter1,parameter2)
     
     def write_read(self,packet):
-        self.ser.write(packet)
-        return self.ser.read(8)
+        #checksum-validated reply, b'' if nothing valid arrived before the timeout. An abort is checked under the
+        #port lock, so once it is set the emergency stop is the next exchange on the port
+        with self.io_lock:
+            self.check_abort()
+            self.ser.write(packet)
+            return self.codec.read_frame(self.ser)
 
     def check_movement(self):
-        packet = self.build_packet(0x4A,0x00,0x00)
+        #polls until the motor is idle, raises TimeoutError if the move outlasts move_timeout or the device stops answering
+        packet = self.codec.frame(0x4A)
+        deadline = time.monotonic() + self.move_timeout
+        silent = 0
         movement_status = self.write_read(packet)
-        while movement_status[2] != 0x00:
+        while movement_status == b'' or movement_status[2] != 0x00:
+            silent = silent + 1 if movement_status == b'' else 0
+            if silent >= self.max_silent or time.monotonic() > deadline:
+                raise TimeoutError(f'{self.model} on {self.com_port} did not finish moving')
+            self.check_abort()
             movement_status = self.write_read(packet)
         return
 
+    def stop_frame(self):
+        #prebuilt strong stop, sent by emergency_stop straight to the port
+        return self.codec.frame(self.command_dict['strong_stop'])
+
+    def read_stop_ack(self):
+        return self.codec.read_frame(self.ser)
+
 
     def query_position(self):
-        packet = self.build_packet(0x66,0x00,0x00)
+        packet = self.codec.frame(0x66)
         query_result = self.write_read(packet)
-        while query_result == '':
-            query_result = self.ser.read(8)
+        for attempt in range(self.max_silent):
+            if query_result != b'':
+                break
+            query_result = self.write_read(packet)
+        if query_result == b'':
+            raise TimeoutError(f'{self.model} on {self.com_port} did not report its position')
         position = (query_result[4]<<8)|(query_result[4])
         if self.verbose == True:
             print(f'query hex: {query_result.hex()}, position: {position}')
-        return position
+        return self.publish('position', position)
     
 
     def set_speed(self, speed):
@@ -80,6 +113,7 @@ class SY08(instrument):
             if self.verbose == True:
                 print(f'Speed set to {speed/600*800:.1f} rpm!')
             self.compile_cmd(command='set_speed', parameter1=speed.to_bytes(2,'little')[0], parameter2 = speed.to_bytes(2,'little')[1])
+            self.speed = speed
         else:
             raise ValueError("Speed is too fast!")
         
@@ -99,6 +133,25 @@ class SY08(instrument):
             raise ValueError("Beyond stroke limits!")
         
 
+    def flow_rate(self):
+        return self.max_rate*self.speed/600
+
+    def step_volume(self):
+        #smallest volume the plunger can move, 12000 steps over the stroke
+        return self.total_volume/12000
+
+    def set_flow_rate(self, rate):
+        #store a measured flow rate (mL/s) at the current speed
+        if self.speed <= 0:
+            raise ValueError('Flow rate can only be stored at a speed above 0')
+        self.max_rate = rate*600/self.speed
+
+    def move_volume(self, volume, direction):
+        #move the plunger without any settling, used for calibration
+        steps_to_move = int(volume*(12000/5))
+        self.compile_cmd(command=direction, parameter1=steps_to_move.to_bytes(2,'little')[0], parameter2 = steps_to_move.to_bytes(2,'little')[1])
+        self.check_movement()
+
     def full_reset(self):
         self.compile_cmd(command = 'forced_reset')
         self.check_movement()
@@ -127,7 +180,7 @@ class SY08(instrument):
             self.compile_cmd(command='aspirate', parameter1=steps_to_move.to_bytes(2,'little')[0], parameter2 = steps_to_move.to_bytes(2,'little')[1])
             self.check_movement()
             self.current_position = self.query_position()
-            time.sleep(volume*1.1)
+            self.settle.wait(volume, 'aspirate')
         else:
             #driver will not move if command is beyond limits so no need to raise Value error
             raise ValueError("Beyond stroke limits!")
@@ -141,7 +194,9 @@ class SY08(instrument):
         #query current position
         self.current_position = self.query_position()
         #allow for string 'all' to dispense everything in syringe
+        discharged = volume
         if volume == 'all':
+            discharged = self.current_position*5/12000
             self.reset()
             self.check_movement()
             self.current_position = self.query_position()
@@ -156,6 +211,6 @@ class SY08(instrument):
             elif (self.current_position - steps_to_move) < 0:
                 self.reset()
                 self.current_position = self.query_position()
-        time.sleep(0.5)
+        self.settle.wait(discharged, 'discharge')
                 
     
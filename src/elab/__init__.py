@@ -14,8 +14,25 @@ from .Legato100 import *
 from .gen_serial import *
 from .MUX8 import *
 from .SY01B import*
+from .settle import *
+from .recorder import *
+from .discovery import *
+from .codec import *
+from .transport import *
+from .server import *
+from .scheduler import *
+from .routing import *
+from .sequencer import *
+from .solver import *
+from .titration import *
+from .trajectory import *
+from .telemetry import *
+from .shared import *
+from .jsonutil import *
+from .jobs import *
+from .abort import *
 
 __version__ = "1.01"
 __author__ = 'Michael Pence'
 
-__all__ = ['main','HS7','pH_arduino','SV07','SY08','E0RR80','AlicatMFC','Legato100','gen_serial','MUX8','SY01B']
+__all__ = ['main','HS7','pH_arduino','SV07','SY08','E0RR80','AlicatMFC','Legato100','gen_serial','MUX8','SY01B','settle','recorder','discovery','codec','transport','server','scheduler','routing','sequencer','solver','titration','trajectory','telemetry','shared','jsonutil','jobs','abort']
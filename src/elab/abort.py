@@ -0,0 +1,171 @@
+'''
+Emergency stop. Stop frames for every instrument that has one (SY08 and SV07 0x49, SY01B 'TR', Legato100 'stop')
+are built up front and one armed thread per port waits to send its frame. A trigger from a signal handler, a
+watchdog or any thread sets the abort flag, so polling loops and timed waits in the drivers give up, and releases all the
+threads at once. Each takes its port's I/O lock, which the drivers give up at their next exchange once the
+abort flag is set, so the stop frame goes out next and its acknowledgement is not read by anyone else. The
+time from the trigger to each acknowledgement is recorded. The abort flag belongs to the bundle, a stop on one
+rig leaves another in the same script running.
+
+    stop = elab.emergency_stop(lab)
+    stop.install()                 # Ctrl-C stops every pump and valve before the script exits
+    stop.start_watchdog(30)        # stop if stop.kick() has not been called for 30 s
+    ...
+    stop.trigger('manual')
+    print(stop.report)             # per port send/ack latency, 'last_ack' is the slowest
+'''
+
+import atexit
+import signal
+import threading
+import time
+
+class emergency_stop():
+
+    def __init__(self, target, **kwargs):
+        insts = target.inst_list if hasattr(target, 'inst_list') else list(target)
+        self.ack_timeout = kwargs.get('ack_timeout', 0.5) #seconds to wait for each acknowledgement
+        self.verbose = kwargs.get('verbose', False)
+        self.insts = insts
+
+        ## one entry per port, pump-valves are a single instrument so each port is only stopped once
+        self.targets = []
+        seen = set()
+        for inst in insts:
+            if hasattr(inst, 'stop_frame') and id(inst.ser) not in seen:
+                seen.add(id(inst.ser))
+                self.targets.append((inst, bytes(inst.stop_frame())))
+
+        ## the abort flags to set, one per bundle
+        self.abort_events = []
+        for inst in insts:
+            if not any(inst.abort_event is x for x in self.abort_events):
+                self.abort_events.append(inst.abort_event)
+
+        self.fire = None
+        self.done = threading.Event()
+        self.lock = threading.RLock() #reentrant, a signal can arrive while the main thread holds it
+        self.report = None
+        self.triggered = None
+        self.reason = None
+        self.watchdog_thread = None
+        self.last_kick = time.monotonic()
+        self.arm()
+
+    def arm(self):
+        ## (re)starts the per-port threads, they sleep on a fresh fire event until trigger()
+        self.fire = threading.Event()
+        self.done.clear()
+        self.results = {}
+        self.threads = [threading.Thread(target=self.send_stop, args=x + (self.fire,), name=f'{x[0].com_port} stop', daemon=True) for x in self.targets]
+        for thread in self.threads:
+            thread.start()
+
+    def send_stop(self, inst, frame, fire):
+        fire.wait()
+        if fire is not self.fire:
+            return #released by reset() without a trigger
+        ## the driver holding the port stops at its next exchange once the abort flag is set, a port still busy
+        ## after that gets the frame anyway and no acknowledgement is read
+        locked = inst.io_lock.acquire(timeout=inst.timeout + self.ack_timeout)
+        try:
+            if locked:
+                inst.ser.reset_input_buffer()
+            inst.ser.write(frame)
+            sent = time.monotonic()
+            ack = inst.read_stop_ack() if locked else None
+            acked = time.monotonic() if ack else None
+            error = None if locked else 'port busy, acknowledgement not read'
+        except Exception as exc:
+            sent, acked, error = time.monotonic(), None, f'{type(exc).__name__}: {exc}'
+        finally:
+            if locked:
+                inst.io_lock.release()
+        with self.lock:
+            self.results[inst.com_port] = {'model' : inst.model, 'sent' : sent - self.triggered,
+                                           'ack' : None if acked == None else acked - self.triggered, 'error' : error}
+            if len(self.results) == len(self.targets):
+                self.done.set()
+
+    def forget_positions(self):
+        ## a valve stopped mid-move is somewhere between ports, the next move has to go through change_port
+        for inst in self.insts:
+            if hasattr(inst, 'position'):
+                inst.position = None
+
+    def trigger(self, reason='manual', wait=True):
+        ## Safe to call from any thread or a signal handler, only the first call does anything until reset()
+        with self.lock:
+            if self.triggered != None:
+                return self.report
+            self.triggered = time.monotonic()
+            self.reason = reason
+        for event in self.abort_events:
+            event.set()
+        self.fire.set()
+        self.forget_positions()
+        if len(self.targets) == 0:
+            self.done.set()
+        if wait:
+            return self.wait()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout if timeout != None else self.ack_timeout + 1)
+        with self.lock:
+            acks = [x['ack'] for x in self.results.values() if x['ack'] != None]
+            self.report = {'reason' : self.reason, 'ports' : dict(self.results),
+                           'last_sent' : max([x['sent'] for x in self.results.values()], default=None),
+                           'last_ack' : max(acks, default=None),
+                           'missing' : [port for port, x in self.results.items() if x['ack'] == None] +
+                                       [x[0].com_port for x in self.targets if x[0].com_port not in self.results]}
+        if self.verbose == True:
+            print(f'emergency stop ({self.reason}): last acknowledgement after {self.report["last_ack"]} s, missing {self.report["missing"]}')
+        return self.report
+
+    def reset(self):
+        ## Clears the abort flag and re-arms, instruments stopped mid-move should be re-initialised before use.
+        ## Threads still waiting (reset before any trigger) are released without sending, so they never fire twice
+        stale, threads = self.fire, self.threads
+        self.fire = None
+        stale.set()
+        for thread in threads:
+            thread.join(self.ack_timeout)
+        with self.lock:
+            self.triggered = None
+        for event in self.abort_events:
+            event.clear()
+        self.forget_positions()
+        self.arm()
+
+    def install(self, signals=(signal.SIGINT,)):
+        ## Stops every instrument on the given signals, then lets the script stop as it would have. The handler
+        ## only releases the stop threads, waiting for their acknowledgements is left to exit
+        def handler(signum, frame):
+            self.trigger(signal.Signals(signum).name, wait=False)
+            raise KeyboardInterrupt
+        for signum in signals:
+            signal.signal(signum, handler)
+        atexit.register(self.wait_on_exit)
+
+    def wait_on_exit(self):
+        ## the stop threads are daemons, give them time to send and read the acknowledgements before they die
+        if self.triggered != None:
+            self.wait()
+
+    def kick(self):
+        self.last_kick = time.monotonic()
+
+    def start_watchdog(self, timeout, check=None, interval=0.1):
+        ## Triggers when kick() has not been called for timeout seconds, or when check() returns True
+        self.kick()
+
+        def watch():
+            while self.triggered == None:
+                if time.monotonic() - self.last_kick > timeout:
+                    self.trigger('watchdog timeout')
+                elif check != None and check():
+                    self.trigger('watchdog check')
+                time.sleep(interval)
+
+        self.watchdog_thread = threading.Thread(target=watch, name='watchdog', daemon=True)
+        self.watchdog_thread.start()
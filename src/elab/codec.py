@@ -0,0 +1,104 @@
+'''
+Protocol codecs shared by the drivers.
+
+runze_codec encodes the 8 byte Runze binary frames (SV07, SY08) with a precomputed partial checksum, and reads replies back checksum-validated, resynchronising on garbage bytes instead of
+waiting out the port timeout on a corrupted frame.
+
+dt_codec does the same for the Runze ASCII DT protocol (SY01B): '/' address data ETX CR LF.
+'''
+
+import re
+
+RUNZE_HEADER, RUNZE_END, RUNZE_SIZE = 0xCC, 0xDD, 8
+DT_START, DT_ETX = b'/0', b'\x03'
+printable_re = re.compile(r'[^\x20-\x7E]')
+
+def runze_checksum(frame):
+    return sum(frame[:6]) & 0xFFFF
+
+def runze_valid(frame):
+    return (len(frame) == RUNZE_SIZE and frame[0] == RUNZE_HEADER and frame[5] == RUNZE_END
+            and runze_checksum(frame) == (frame[6] | frame[7] << 8))
+
+class runze_codec():
+
+    def __init__(self, address=0x00):
+        self.address = address
+        self.base = RUNZE_HEADER + address + RUNZE_END #checksum of the fixed bytes
+        self.frames = {} #parameterless frames, built once
+        self.resyncs = 0
+        self.bad_frames = 0
+
+    def encode(self, command_hex, parameter1=0x00, parameter2=0x00):
+        ## A new frame on every call, so drivers used from several threads never share one
+        checksum = self.base + command_hex + parameter1 + parameter2
+        return bytearray([RUNZE_HEADER, self.address, command_hex, parameter1, parameter2, RUNZE_END, checksum & 0xFF, checksum >> 8])
+
+    def frame(self, command_hex):
+        ## Immutable frame for parameterless commands (queries, stops), safe to keep and reuse
+        if command_hex not in self.frames:
+            self.frames[command_hex] = bytes(self.encode(command_hex))
+        return self.frames[command_hex]
+
+    def read_frame(self, ser, size=RUNZE_SIZE):
+        ## Reads one checksum-valid reply, dropping bytes until a frame lines up. Returns b'' on timeout
+        data = bytearray(ser.read(size))
+        while len(data) >= size:
+            if runze_valid(data[:size]):
+                return bytes(data[:size])
+            self.bad_frames += 1
+            start = data.find(RUNZE_HEADER, 1)
+            if start < 0:
+                data.clear()
+            else:
+                del data[:start]
+            self.resyncs += 1
+            more = ser.read(size - len(data))
+            if more == b'':
+                return b''
+            data.extend(more)
+        return b''
+
+
+class dt_codec():
+
+    def __init__(self, address='1', max_skips=16):
+        self.address = address
+        self.prefix = f'/{address}'.encode()
+        self.max_skips = max_skips #garbage lines dropped while looking for one reply before giving up
+        self.resyncs = 0
+
+    def encode(self, command_ascii):
+        return self.prefix + command_ascii.encode() + b'\r'
+
+    def read_reply(self, ser):
+        ## Reads one '/0<status><data>ETX' reply, skipping anything in front of the start bytes.
+        ## Returns b'' on timeout or when max_skips replies in a row had no start bytes
+        for attempt in range(self.max_skips + 1):
+            data = ser.read_until(DT_ETX)
+            if not data.endswith(DT_ETX):
+                return data
+            start = data.rfind(DT_START)
+            if start < 0:
+                self.resyncs += 1
+                continue
+            if start > 0:
+                self.resyncs += 1
+            ser.read_until(b'\n') #trailing CR LF
+            return data[start:]
+        return b''
+
+    @staticmethod
+    def decode(response):
+        return printable_re.sub('', response.decode('latin-1').strip())
+
+    @staticmethod
+    def status(response):
+        ## Returns (status byte, data string) of a DT reply or None
+        start = response.find(DT_START)
+        if start < 0 or len(response) < start + 3:
+            return None
+        end = response.find(DT_ETX, start)
+        if end < 0:
+            end = len(response)
+        return response[start+2], response[start+3:end].decode('latin-1')
@@ -0,0 +1,140 @@
+'''
+Serial port autodiscovery. Every available port is probed concurrently at each driver's baud rate with the
+instruments' own identity queries, and the identified instruments are returned as a ready to use bundle.
+
+    lab = elab.discover()
+    lab.discovered  # {'COM8' : 'SV07', 'COM11' : 'SY08', ...}
+'''
+
+import re
+import time
+import serial
+import serial.tools.list_ports
+from concurrent.futures import ThreadPoolExecutor
+from .main import bundle
+from .codec import runze_codec
+from .SV07 import SV07
+from .SY08 import SY08
+from .SY01B import SY01B
+from .AlicatMFC import AlicatMFC
+from .Legato100 import Legato100
+from .HS7 import HS7
+from .E0RR80 import E0RR80
+from .MUX8 import MUX8
+from .pH_arduino import pH_arduino
+
+driver_dict = {'SV07' : SV07, 'SY08' : SY08, 'SY01B' : SY01B, 'AlicatMFC' : AlicatMFC,
+               'Legato100' : Legato100, 'HS7' : HS7, 'E0RR80' : E0RR80, 'MUX8' : MUX8, 'pH_arduino' : pH_arduino}
+
+def runze_reply(ser, command_hex):
+    ## Returns the status byte of a checksum-valid Runze reply, None if nothing sensible came back
+    codec = runze_codec()
+    ser.reset_input_buffer()
+    ser.write(codec.frame(command_hex))
+    reply = codec.read_frame(ser)
+    if reply == b'':
+        return None
+    return reply[2]
+
+def ascii_reply(ser, packet, wait):
+    ser.reset_input_buffer()
+    ser.write(packet)
+    time.sleep(wait)
+    return ser.read(ser.in_waiting or 1) + ser.read_all()
+
+def probe_runze(ser, wait):
+    ## SV07 and SY08 both answer query_version (0x3F), only the pump answers query_max_speed (0x27) without an error status
+    if runze_reply(ser, 0x3F) == None:
+        return None
+    if runze_reply(ser, 0x27) == 0x00:
+        return 'SY08'
+    return 'SV07'
+
+def probe_SY01B(ser, wait):
+    if ascii_reply(ser, b'/1#\r', wait).startswith(b'/0'):
+        return 'SY01B'
+
+def probe_HS7(ser, wait):
+    if b'C-MAG' in ascii_reply(ser, b'IN_NAME\r\n', wait):
+        return 'HS7'
+
+def probe_E0RR80(ser, wait):
+    if re.search(rb'[-\d.]+\s*g', ascii_reply(ser, b'P\r', wait)):
+        return 'E0RR80'
+
+def probe_pH_arduino(ser, wait):
+    if re.fullmatch(rb'\s*-?\d+\s*', ascii_reply(ser, b'<pH>', wait) or b'x'):
+        return 'pH_arduino'
+
+def probe_AlicatMFC(ser, wait):
+    if ascii_reply(ser, b'A??D*\r', wait).startswith(b'A'):
+        return 'AlicatMFC'
+
+def probe_Legato100(ser, wait):
+    if b'Legato' in ascii_reply(ser, b'ver\r', wait):
+        return 'Legato100'
+
+def probe_MUX8(ser, wait):
+    ## <0> is not a relay code, the firmware only acknowledges it
+    if ascii_reply(ser, b'<0>', wait).strip() != b'':
+        return 'MUX8'
+
+## baud rate -> probes in the order they are tried, Arduino probes last since they need the board reset delay
+probe_dict = {9600 : [probe_runze, probe_SY01B, probe_HS7, probe_E0RR80, probe_pH_arduino],
+              57600 : [probe_AlicatMFC],
+              115200 : [probe_Legato100, probe_MUX8]}
+arduino_probes = [probe_pH_arduino, probe_MUX8]
+
+def identify(com_port, **kwargs):
+    ## Try every baud rate and probe on one port, returns the model name or None
+    timeout = kwargs.get('timeout', 0.3)
+    wait = kwargs.get('wait', 0.2)
+    arduino_delay = kwargs.get('arduino_delay', 2) #Arduinos reset when the port opens
+    models = kwargs.get('models', driver_dict.keys())
+
+    for baud_rate, probes in probe_dict.items():
+        try:
+            ser = serial.Serial(port=com_port, baudrate=baud_rate, timeout=timeout, rtscts=False)
+        except serial.SerialException:
+            return None
+        try:
+            opened = time.monotonic()
+            for probe in probes:
+                if probe.__name__[6:] not in models and probe != probe_runze:
+                    continue
+                if probe in arduino_probes:
+                    time.sleep(max(0, arduino_delay - (time.monotonic() - opened)))
+                model = probe(ser, wait)
+                if model != None and model in models:
+                    return model
+        except (serial.SerialException, OSError):
+            pass
+        finally:
+            ser.close()
+    return None
+
+def scan_ports(ports=None, **kwargs):
+    ## Probe all ports concurrently, returns {port : model} for everything identified
+    if ports == None:
+        ports = [x.device for x in serial.tools.list_ports.comports()]
+    if len(ports) == 0:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+        models = list(pool.map(lambda port: identify(port, **kwargs), ports))
+    return {port : model for port, model in zip(ports, models) if model != None}
+
+def discover(ports=None, **kwargs):
+    ## Returns a bundle of every identified instrument, kwargs are passed to the probes and instruments
+    verbose = kwargs.get('verbose', False)
+    start = time.monotonic()
+    found = scan_ports(ports, **kwargs)
+    scan_time = time.monotonic() - start
+    if verbose == True:
+        print(f'found {found} in {scan_time:.2f} s')
+
+    inst_kwargs = {key : value for key, value in kwargs.items() if key not in ('timeout','wait','arduino_delay','models')}
+    inst_list = [(driver_dict[model], port, inst_kwargs) for port, model in found.items()]
+    lab = bundle(inst_list, verbose=verbose)
+    lab.discovered = found
+    lab.discovery_time = scan_time
+    return lab
@@ -1,4 +1,8 @@
 from .main import instrument
+import asyncio
+import queue
+import re
+import threading
 import time
 import numpy as np
 
@@ -7,6 +11,18 @@ class gen_serial(instrument):
     def __init__(self, com_port, **kwargs):
         super().__init__(com_port, **kwargs)
         self.model = 'gen_serial'
+        self.terminator = b'\n' #end of a line or frame for the background reader
+        self.reader_thread = None
+        self.handlers = [] #(matcher, callback or asyncio queue, event loop)
+        self.waiters = [] #pending request() replies, oldest first
+        self.unmatched = queue.Queue(maxsize=1000) #lines no handler or request took, read by readline(), oldest dropped
+        self.lock = threading.Lock()
+        self.counts = {'lines' : 0, 'dispatched' : 0, 'replies' : 0}
+        self.errors = [] #(line, exception) raised by callbacks, the reader keeps going
+
+        if 'terminator' in kwargs:
+            self.terminator = kwargs.get('terminator')
+
         if self.verbose == True:
             print(f'{self.model} connected on {com_port} at {self.baud_rate} bits/s')
 
@@ -14,4 +30,137 @@ class gen_serial(instrument):
         self.ser.write(bytes(comm, 'utf-8'))
 
     def readline(self):
+        if self.reader_thread != None:
+            ## like a port read, the line keeps its terminator and a timeout returns an empty line
+            try:
+                return self.unmatched.get(timeout=self.timeout)
+            except queue.Empty:
+                return ''
         return self.ser.readline().decode('utf-8')
+
+    #matchers: a compiled regex or regex string is searched, prefix=True matches the start of the line
+    def matcher(self, pattern, prefix=False):
+        if prefix:
+            return lambda line: line if line.startswith(pattern) else None
+        regex = re.compile(pattern) if type(pattern) == str else pattern
+        return regex.search
+
+    #callback(line, match) or an asyncio.Queue getting (line, match) for every line that matches
+    def on(self, pattern, target, prefix=False, **kwargs):
+        loop = kwargs.get('loop', None)
+        if isinstance(target, asyncio.Queue) and loop == None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = asyncio.get_event_loop()
+        handler = (self.matcher(pattern, prefix), target, loop)
+        with self.lock:
+            self.handlers.append(handler)
+        return handler
+
+    def off(self, handler):
+        with self.lock:
+            self.handlers.remove(handler)
+
+    def start_reader(self):
+        if self.reader_thread != None:
+            return
+        self.reader_stop = threading.Event()
+        self.reader_thread = threading.Thread(target=self.read_loop, name=f'{self.com_port} reader', daemon=True)
+        self.reader_thread.start()
+
+    def stop_reader(self):
+        if self.reader_thread != None:
+            self.reader_stop.set()
+            self.reader_thread.join()
+            self.reader_thread = None
+
+    def read_loop(self):
+        ## Reads whatever has arrived (or waits up to the port timeout for one byte) and splits out complete lines,
+        ## only the bytes after the last terminator are searched again
+        buffer = bytearray()
+        size = len(self.terminator)
+        while not self.reader_stop.is_set():
+            data = self.ser.read(max(self.ser.in_waiting, 1))
+            if not data:
+                continue
+            searched = max(len(buffer) - size + 1, 0)
+            buffer += data
+            start = 0
+            end = buffer.find(self.terminator, searched)
+            while end >= 0:
+                ## handlers get the line without its terminator, readline() gets it as the port sent it
+                raw = buffer[start:end + size].decode('utf-8', errors='replace')
+                self.dispatch(buffer[start:end].decode('utf-8', errors='replace').strip('\r'), raw)
+                start = end + size
+                end = buffer.find(self.terminator, start)
+            del buffer[:start]
+
+    def dispatch(self, line, raw=None):
+        self.counts['lines'] += 1
+        with self.lock:
+            ## a pending request takes the first line that matches it
+            for waiter in self.waiters:
+                match = waiter['matcher'](line)
+                if match:
+                    self.waiters.remove(waiter)
+                    waiter['reply'] = (line, match)
+                    self.counts['replies'] += 1
+                    if waiter['loop'] != None:
+                        waiter['loop'].call_soon_threadsafe(lambda f=waiter['future']: f.done() or f.set_result((line, match)))
+                    else:
+                        waiter['event'].set()
+                    return
+            handlers = list(self.handlers)
+        matched = False
+        for matcher, target, loop in handlers:
+            match = matcher(line)
+            if not match:
+                continue
+            matched = True
+            self.counts['dispatched'] += 1
+            try:
+                if isinstance(target, asyncio.Queue):
+                    loop.call_soon_threadsafe(target.put_nowait, (line, match))
+                else:
+                    target(line, match)
+            except RuntimeError as error:
+                if loop != None and loop.is_closed():
+                    self.off((matcher, target, loop)) #the queue's event loop has ended
+                else:
+                    self.errors.append((line, error))
+            except Exception as error:
+                self.errors.append((line, error))
+        if not matched:
+            if self.unmatched.full():
+                self.unmatched.get_nowait()
+            self.unmatched.put_nowait(line if raw == None else raw)
+
+    #send a command and return the first line matching the reply pattern, (line, match)
+    def request(self, comm, pattern, timeout=None, prefix=False):
+        self.start_reader()
+        waiter = {'matcher' : self.matcher(pattern, prefix), 'event' : threading.Event(), 'loop' : None, 'reply' : None}
+        with self.lock:
+            self.waiters.append(waiter)
+        self.send(comm)
+        if not waiter['event'].wait(self.timeout if timeout == None else timeout):
+            with self.lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+            raise TimeoutError(f'No reply to {comm!r} on {self.com_port}')
+        return waiter['reply']
+
+    async def request_async(self, comm, pattern, timeout=None, prefix=False):
+        self.start_reader()
+        loop = asyncio.get_running_loop()
+        waiter = {'matcher' : self.matcher(pattern, prefix), 'future' : loop.create_future(), 'loop' : loop, 'reply' : None}
+        with self.lock:
+            self.waiters.append(waiter)
+        self.send(comm)
+        try:
+            return await asyncio.wait_for(waiter['future'], self.timeout if timeout == None else timeout)
+        except asyncio.TimeoutError:
+            with self.lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+            raise TimeoutError(f'No reply to {comm!r} on {self.com_port}')
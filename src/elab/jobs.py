@@ -0,0 +1,111 @@
+'''
+Background post-processing. Experiment steps hand analysis (file parsing, fits, derivatives) to a process pool
+and carry on with the fluidics; results come back as futures and every finished job is written to the run log.
+The queue is bounded, a step only waits when max_pending jobs are already outstanding.
+
+    lab = elab.bundle([valve, pump, pH], jobs=elab.job_pool(log='run_log.jsonl'))
+    future = lab.submit('CV1', analyse_cv, 'CV1.txt', folder)   # returns straight away
+    ...
+    results = lab.gather()
+
+Jobs run in other processes, so the callable has to be importable (a module level function, not a lambda).
+kind='thread' runs them on threads instead. A label already in use gets a suffix (CV1_2, CV1_3, ...), so
+gather() returns every result.
+'''
+
+import json
+import threading
+import time
+import concurrent.futures
+from .jsonutil import to_json
+
+class job_pool():
+
+    def __init__(self, **kwargs):
+        self.max_workers = kwargs.get('max_workers', None)
+        self.max_pending = kwargs.get('max_pending', 8) #outstanding jobs before submit() waits
+        self.log_path = kwargs.get('log', None) #json lines file, one line per finished job
+        self.verbose = kwargs.get('verbose', False)
+        executor = concurrent.futures.ThreadPoolExecutor if kwargs.get('kind', 'process') == 'thread' else concurrent.futures.ProcessPoolExecutor
+        self.executor = executor(max_workers=self.max_workers)
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.futures = [] #jobs still running
+        self.completed = [] #finished jobs not yet returned by gather()
+        self.labels = set()
+        self.log = []
+        self.blocked = 0.0 #time submit() spent waiting for a free slot
+
+    def submit(self, label, fn, *args, **kwargs):
+        requested = time.monotonic()
+        self.slots.acquire()
+        self.blocked += time.monotonic() - requested
+        submitted = time.monotonic()
+        with self.lock:
+            label = self.unique_label(label)
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.label = label
+        future.gathered = False
+        with self.lock:
+            self.futures.append(future)
+        future.add_done_callback(lambda x: self.finished(x, label, submitted))
+        return future
+
+    def unique_label(self, label):
+        unique, n = label, 1
+        while unique in self.labels:
+            n += 1
+            unique = f'{label}_{n}'
+        self.labels.add(unique)
+        return unique
+
+    def finished(self, future, label, submitted):
+        self.slots.release()
+        entry = {'label' : label, 'submitted' : submitted - self.start, 'finished' : time.monotonic() - self.start}
+        entry['duration'] = entry['finished'] - entry['submitted']
+        if future.cancelled():
+            entry['error'] = 'cancelled'
+        elif future.exception() != None:
+            entry['error'] = f'{type(future.exception()).__name__}: {future.exception()}'
+        else:
+            entry['result'] = future.result()
+        with self.lock:
+            ## finished jobs leave the running list, gather() drops them once their results are returned
+            if future in self.futures:
+                self.futures.remove(future)
+            if not future.gathered:
+                self.completed.append(future)
+            self.log.append(entry)
+            if self.log_path != None:
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps(entry, default=to_json) + '\n')
+        if self.verbose == True:
+            print(f'job {label} finished in {entry["duration"]:.1f} s' + (f' ({entry["error"]})' if 'error' in entry else ''))
+
+    def pending(self):
+        with self.lock:
+            return [x for x in self.futures if not x.done()]
+
+    def gather(self, timeout=None):
+        ## Waits for every job submitted so far, returns {label : result} for the jobs not gathered before,
+        ## failed jobs raise here
+        with self.lock:
+            futures = self.completed + self.futures
+        done, not_done = concurrent.futures.wait(futures, timeout=timeout)
+        if len(not_done) > 0:
+            raise TimeoutError(f'{len(not_done)} jobs still running')
+        with self.lock:
+            for future in futures:
+                future.gathered = True
+            ## a job's done callback can still be pending when wait() returns, drop it here as well
+            self.futures = [x for x in self.futures if not x.gathered]
+            self.completed = [x for x in self.completed if not x.gathered]
+        return {x.label : x.result() for x in futures}
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,11 @@
+'''
+JSON helpers shared by the lab server and the job log.
+'''
+
+def to_json(value):
+    ## Fallback for numpy values, bytes and anything else the drivers return
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    if type(value) in (bytes, bytearray):
+        return value.decode('latin-1')
+    return repr(value)
@@ -1,8 +1,24 @@
 import numpy as np
 import pandas as pd
-import serial
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.linear_model import LinearRegression
+from .recorder import traffic_log
+from .transport import open_transport
+from .routing import valve_router, route_entry
+from .jobs import job_pool
+
+class run_aborted(RuntimeError):
+    pass
+
+class null_lock():
+    ## stands in for the deliver lock when a transfer has nobody to take turns with (contextlib.nullcontext is 3.7+)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
 
 class instrument():
 
@@ -12,6 +28,9 @@ class instrument():
         self.baud_rate = 9600 #bits/, default for most devices, may need to be changed 
         self.timeout = 1 #1 second timeout
         self.verbose = False #verbose is used by children to either print detailed info or not during operation
+        self.io_lock = threading.RLock() #held for each command/reply exchange, so threads sharing the port never interleave
+        self.listeners = [] #callback(reading, t, value) for every reading the driver takes, see publish()
+        self.abort_event = threading.Event() #set by emergency_stop, shared by every instrument of a bundle
 
         # redefining the below variables if they are found in kwargs
         if 'baud_rate' in kwargs:
@@ -23,22 +42,145 @@ class instrument():
         if 'timeout' in kwargs:
             self.timeout = kwargs.get('timeout')
 
-        self.ser = serial.Serial(port=com_port, baudrate=self.baud_rate, timeout=1, rtscts=False)
+        ## replay=traffic_log.load(...) plays a recorded run back instead of opening the port
+        ## otherwise the transport is picked from the port string: 'COM8', 'tcp://host:port' or 'loop://'
+        if 'replay' in kwargs:
+            self.ser = kwargs.get('replay').port(com_port)
+        else:
+            transport_kwargs = {key : kwargs.get(key) for key in ('transport','responder','connect_timeout') if key in kwargs}
+            self.ser = open_transport(com_port, self.baud_rate, self.timeout, **transport_kwargs)
+
+        ## record=traffic_log(...) (or a file path) logs all traffic on this port
+        if 'record' in kwargs:
+            log = kwargs.get('record')
+            if type(log) == str:
+                log = traffic_log(log)
+            self.ser = log.wrap(self.ser, com_port)
 
     def close(self):
         self.ser.close()
 
+    def subscribe(self, callback):
+        ## callback(reading, t, value) is called with every reading the driver takes anyway, without extra queries
+        self.listeners.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def publish(self, reading, value):
+        t = time.monotonic()
+        for callback in list(self.listeners):
+            callback(reading, t, value)
+        return value
+
+    def check_abort(self):
+        ## every polling loop in the drivers gives up once the abort flag is set, waits use abort_event.wait() so they end early
+        if self.abort_event.is_set():
+            raise run_aborted(f'{self.com_port}: run aborted')
+
+class fluid_channel():
+    ## One syringe pump and the valve in front of it. A bundle can hold several, the first is lab.pump/lab.valve
+
+    def __init__(self, lab, pump, valve, **kwargs):
+        self.lab = lab
+        self.pump = pump
+        self.valve = valve
+        self.port_dict = None #own port map, falls back to the bundle's
+        self.router = valve_router(valve) #resolves port map entries to valve moves, including cascaded valves
+
+        if 'port_dict' in kwargs:
+            self.port_dict = kwargs.get('port_dict')
+
+    def ports(self):
+        return self.lab.port_dict if self.port_dict == None else self.port_dict
+
+    def reaches(self, *lines):
+        if not self.lab.port_dict_bool:
+            return False
+        ports = self.ports()
+        return all(x in ports and self.router.reaches(ports[x]) for x in lines)
+
+    def select(self, line):
+        self.router.select(self.ports()[line])
+
+    def select_settle(self, line_from):
+        if hasattr(self.pump,'settle'):
+            self.pump.settle.select(line_from)
+
+    def from_to(self, line_from, line_to, vol, deliver=None):
+        ## deliver is an optional lock held while discharging, so syringes sharing a destination take turns
+        self.select_settle(line_from)
+        self.select(line_from)
+        self.pump.aspirate(vol)
+        with deliver or null_lock():
+            self.select(line_to)
+            self.pump.discharge(vol)
+
+    def from_to_all(self, line_from, line_to, deliver=None):
+        self.select_settle(line_from)
+        self.select(line_from)
+        self.pump.aspirate(self.pump.total_volume)
+        with deliver or null_lock():
+            self.select(line_to)
+            self.pump.discharge('all')
+
+    def reset_to_waste(self):
+        self.select(self.lab.waste_name)
+        self.pump.reset()
+
+    def light_dispense(self, solution, volume, air_volume=1, deliver=None):
+        self.from_to(solution, self.lab.cell_name, volume, deliver)
+        self.from_to(self.lab.air_name, self.lab.cell_name, air_volume, deliver)
+
+class mix_component():
+    ## One solution of a mixture. send(None) dispenses it, so it still works like the old mix_component generator
+
+    def __init__(self, lab, solution, volume, **kwargs):
+        self.lab = lab
+        self.solution = solution
+        self.volume = volume
+        self.kwargs = kwargs
+
+    def dispense(self, **kwargs):
+        self.lab.dispense(self.solution, self.volume, **{**self.kwargs, **kwargs})
+        return self.volume
+
+    def send(self, value):
+        return self.dispense()
+
+    def __next__(self):
+        return self.dispense()
+
+    def __repr__(self):
+        return f'mix_component({self.solution!r}, {self.volume})'
+
 class bundle():
     
     def __init__(self, inst_list, **kwargs):
         self.pH_bool, self.plate_bool, self.pump_bool, self.valve_bool, self.port_dict_bool, self.balance_bool = False, False, False, False, False, False
         self.mix_volume = 0
+        self.conc_dict = {}
         self.verbose = False
+        self.double_buffer = True #alternate large transfers between pump/valve pairs when more than one can reach the lines
 
         if 'verbose' in kwargs:
             self.verbose = kwargs.get('verbose')
-
+        if 'double_buffer' in kwargs:
+            self.double_buffer = kwargs.get('double_buffer')
+        self.telemetry = kwargs.get('telemetry', None) #telemetry_hub that gets an event for every dispense and clean
+        self.jobs = kwargs.get('jobs', None) #job_pool for background analysis, made on the first submit()
+
+        ## (driver, com_port[, kwargs[, setup]]) entries are opened and configured concurrently
+        inst_list = self.open_instruments(inst_list)
+        self.inst_list = inst_list
         self.inst_enabled = [x.model for x in inst_list]
+        ## one abort flag per bundle, an emergency stop on another rig leaves this one running
+        self.abort_event = threading.Event()
+        for x in inst_list:
+            x.abort_event = self.abort_event
+        self.pumps, self.valves = [], []
 
         for x in inst_list:
             if x.type == 'pH':
@@ -49,9 +191,11 @@ class bundle():
                 self.plate_bool = True
             elif x.type == 'pump':
                 self.pump = x
+                self.pumps.append(x)
                 self.pump_bool = True
             elif x.type == 'valve':
                 self.valve = x
+                self.valves.append(x)
                 self.valve_bool = True
             elif x.type == 'balance':
                 self.balance = x
@@ -59,14 +203,74 @@ class bundle():
             elif x.type == 'pumpvalve':
                 self.pump = x
                 self.valve = x
+                self.pumps.append(x)
+                self.valves.append(x)
                 self.pump_bool = True
                 self.valve_bool = True
 
+        ## pair syringe pumps with valves in the order given, pump-valves are their own pair
+        self.channels = [fluid_channel(self, x, x) for x in self.pumps if x.type == 'pumpvalve']
+        syringes = [x for x in self.pumps if x.type == 'pump' and hasattr(x, 'aspirate')]
+        selectors = [x for x in self.valves if x.type == 'valve']
+        self.channels += [fluid_channel(self, pump, valve) for pump, valve in zip(syringes, selectors)]
+        if len(self.channels) > 0:
+            self.pump = self.channels[0].pump
+            self.valve = self.channels[0].valve
+
         self.cell_name = 'cell'
         self.waste_name = 'waste'
         self.air_name = 'air'
         self.flush_name = 'flush'
 
+    def open_instruments(self, inst_list):
+        self.init_times = {}
+        specs = [(n, x) for n, x in enumerate(inst_list) if type(x) in (tuple, list)]
+        if len(specs) == 0:
+            return list(inst_list)
+
+        ## every device waits at the barrier once its port is open, so no setup runs unless all ports opened
+        barrier = threading.Barrier(len(specs))
+        start = time.monotonic()
+
+        def open_one(spec):
+            driver, com_port = spec[0], spec[1]
+            inst_kwargs = spec[2] if len(spec) > 2 else {}
+            try:
+                inst = driver(com_port, **inst_kwargs)
+            except Exception:
+                barrier.abort()
+                raise
+            opened = time.monotonic() - start
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                inst.close()
+                raise
+            try:
+                if len(spec) > 3 and spec[3] != None:
+                    spec[3](inst)
+            except BaseException:
+                inst.close()
+                raise
+            self.init_times[com_port] = {'model' : inst.model, 'open' : opened, 'ready' : time.monotonic() - start}
+            return inst
+
+        with ThreadPoolExecutor(max_workers=len(specs)) as pool:
+            futures = {n : pool.submit(open_one, spec) for n, spec in specs}
+            errors = [future.exception() for future in futures.values() if future.exception() != None]
+        if len(errors) > 0:
+            ## one device failed, close the ones that did open so their ports can be reopened
+            for future in futures.values():
+                if future.exception() == None:
+                    future.result().close()
+            raise errors[0]
+        opened = {n : future.result() for n, future in futures.items()}
+        self.init_times['total'] = time.monotonic() - start
+        if self.verbose == True:
+            for com_port, times in self.init_times.items():
+                print(f'{com_port}: {times}')
+        return [opened.get(n, x) for n, x in enumerate(inst_list)]
+
     def change_default_ports(self,cell_name='cell',waste_name='waste',air_name='air',flush_name='flush'):
         self.cell_name = cell_name
         self.waste_name = waste_name
@@ -79,38 +283,121 @@ class bundle():
         else:
             raise ValueError('Missing instrument!')
 
-    def load_ports(self, filepath=None):
+    def load_ports(self, filepath=None, **kwargs):
+        ## channel=n gives the n-th pump/valve pair its own port map
+        if type(filepath) == dict:
+            filepath = {key : route_entry(value) for key, value in filepath.items()}
+        if 'channel' in kwargs:
+            channel = self.channels[kwargs.get('channel')]
+            channel.port_dict = filepath if type(filepath) == dict else self.read_ports(filepath)
+            if not self.port_dict_bool:
+                self.port_dict, self.port_dict_bool = dict(channel.port_dict), True
+            return
         if type(filepath) == dict:
             self.port_dict = filepath
             self.port_dict_bool = True
         elif (type(filepath) == str) & ('.csv' in filepath):
             self.check_types([self.valve_bool])
-            self.soln_df, self.port_dict  = pd.read_csv(filepath), {}
-            for n, x in enumerate(self.soln_df['title'].values):
-                self.port_dict[x] = self.soln_df['port'].values[n]
+            self.port_dict = self.read_ports(filepath)
             self.port_dict_bool = True
         if filepath == None:
             raise ValueError('No port dictionary provided')
 
+    def read_ports(self, filepath):
+        ## an optional 'valve' column names the cascaded valve a port belongs to, titles listed twice have two routes
+        ## tables are merged, so per-channel port maps keep the stock concentrations of the others
+        self.check_types([self.valve_bool])
+        soln_df, port_dict = pd.read_csv(filepath), {}
+        if 'conc' in soln_df.columns:
+            self.conc_dict.update({x : float(c) for x, c in zip(soln_df['title'].values, soln_df['conc'].values) if c == c})
+        if hasattr(self, 'soln_df'):
+            self.soln_df = pd.concat([self.soln_df, soln_df], ignore_index=True).drop_duplicates(ignore_index=True)
+        else:
+            self.soln_df = soln_df
+        for n, x in enumerate(soln_df['title'].values):
+            entry = int(soln_df['port'].values[n])
+            if 'valve' in soln_df.columns:
+                valve = soln_df['valve'].values[n]
+                if type(valve) == str and valve != 'root':
+                    entry = (valve, entry)
+            if x in port_dict:
+                port_dict[x] = (port_dict[x] if type(port_dict[x]) == list else [port_dict[x]]) + [entry]
+            else:
+                port_dict[x] = entry
+        for channel in self.channels:
+            if hasattr(channel.pump,'settle'):
+                channel.pump.settle.load_table(soln_df)
+        return port_dict
+
+    def cascade(self, valve, port, **kwargs):
+        ## Hang a selector valve off a port of another valve: name= to refer to it in the port table,
+        ## parent= (default the pair's own valve) and channel= (default the first pump/valve pair)
+        channel = self.channels[kwargs.get('channel', 0)]
+        name = kwargs.get('name', valve.com_port)
+        channel.router.add_valve(name, valve, port, kwargs.get('parent', 'root'))
+        return name
+
+    def submit(self, label, fn, *args, **kwargs):
+        ## Hands an analysis step to the background job pool and returns its future right away
+        if self.jobs == None:
+            self.jobs = job_pool(verbose=self.verbose)
+        self.mark('submit', job=label)
+        return self.jobs.submit(label, fn, *args, **kwargs)
+
+    def gather(self, timeout=None):
+        return {} if self.jobs == None else self.jobs.gather(timeout)
+
+    def mark(self, label, **data):
+        if self.telemetry != None:
+            self.telemetry.event(label, cell=self.cell_name, **data)
+
     def change_cell(self,cell_name):
         self.cell_name = cell_name
 
     def conc(self,solution):
-        title_header = 'title'
-        conc_header = 'conc'
-        return float(self.soln_df.loc[self.soln_df[title_header] == solution, conc_header].values)
+        ## stock concentrations are indexed once when the ports table is read
+        if solution not in self.conc_dict:
+            raise ValueError(f'No stock concentration for {solution}')
+        return self.conc_dict[solution]
     
+    def channel_for(self, *lines):
+        ## first pump/valve pair whose ports cover all the lines
+        for channel in self.channels:
+            if channel.reaches(*lines):
+                return channel
+        return self.channels[0]
+
+    def buffer_channels(self, *lines):
+        ## pump/valve pairs that can all reach the given lines, used for double-buffered transfers
+        if self.double_buffer == False:
+            return []
+        channels = [x for x in self.channels if x.reaches(*lines)]
+        return channels if len(channels) > 1 else []
+
     def from_to(self, line_from, line_to, vol):
-        self.valve.port(self.port_dict[line_from])
-        self.pump.aspirate(vol)
-        self.valve.port(self.port_dict[line_to])
-        self.pump.discharge(vol)
+        self.channel_for(line_from, line_to).from_to(line_from, line_to, vol)
 
     def from_to_all(self,line_from,line_to):
-        self.valve.port(self.port_dict[line_from])
-        self.pump.aspirate(self.pump.total_volume)
-        self.valve.port(self.port_dict[line_to])
-        self.pump.discharge('all')
+        self.channel_for(line_from, line_to).from_to_all(line_from, line_to)
+
+    def run_strokes(self, channels, strokes, stroke_fn):
+        ## Alternates strokes between the channels: while one syringe discharges, the next one is already aspirating.
+        ## The shared deliver lock makes discharges into the destination take turns
+        deliver = threading.Lock()
+        turns = [strokes[n::len(channels)] for n in range(len(channels))]
+
+        def run_channel(channel, volumes):
+            for volume in volumes:
+                stroke_fn(channel, volume, deliver)
+
+        with ThreadPoolExecutor(max_workers=len(channels)) as pool:
+            list(pool.map(run_channel, channels, turns))
+
+    def split_strokes(self, volume, stroke_volume):
+        strokes = [stroke_volume]*int(volume//stroke_volume)
+        if volume - sum(strokes) > 0:
+            strokes.append(volume - sum(strokes))
+        return strokes
     
     def init_line(self,solution):
         self.check_types([self.valve_bool,self.pump_bool])
@@ -123,8 +410,31 @@ class bundle():
         self.check_types([self.valve_bool,self.pump_bool])
         if self.verbose == True:
             print(f'Resetting to waste')
-        self.valve.port(self.port_dict[self.waste_name])
-        self.pump.reset()
+        self.channels[0].reset_to_waste()
+
+    def home_chains(self):
+        ## Groups of instruments that have to home in order, the valve must reach waste before the pump empties
+        return [[x.valve, x.pump] for x in self.channels]
+
+    def home(self):
+        ## Homes every chain concurrently, rig homing takes as long as the slowest chain
+        self.check_types([self.valve_bool,self.pump_bool])
+        self.home_times = {}
+        start = time.monotonic()
+
+        def home_chain(channel):
+            valve, pump = channel.valve, channel.pump
+            if channel.reaches(self.waste_name):
+                channel.select(self.waste_name)
+            elif valve is not pump:
+                valve.reset()
+            pump.reset()
+            self.home_times[pump.com_port] = time.monotonic() - start
+
+        with ThreadPoolExecutor(max_workers=len(self.channels)) as pool:
+            list(pool.map(home_chain, self.channels))
+        self.home_times['total'] = time.monotonic() - start
+        return self.home_times
 
 
     def light_dispense(self,solution,volume, **kwargs):
@@ -144,34 +454,53 @@ class bundle():
         self.check_types([self.valve_bool,self.pump_bool])
         if self.verbose == True:
                 print(f'dispensing a total of {volume} mL of {solution}')
+        self.mark('dispense', solution=solution, volume=volume)
         
-        self.prime_volume = 0.1
-        self.aspirate_volume = self.pump.total_volume
+        ## channel= pins the dispense to one pump/valve pair (used when mixtures are dispensed in parallel)
+        lines = (solution, self.waste_name, self.cell_name, self.air_name)
+        channel = kwargs.get('channel', None)
+        if channel == None:
+            channel = self.channel_for(*lines)
+            channels = self.buffer_channels(*lines)
+        else:
+            channels = []
 
-        if 'prime_volume' in kwargs:
-            self.prime_volume = kwargs.get('prime_volume')
-        if 'aspirate_volume' in kwargs:
-            self.aspirate_volume = kwargs.get('aspirate_volume')
+        ## kept local, parallel mixture dispenses on pumps of different sizes run this at the same time
+        prime_volume = kwargs.get('prime_volume', 0.1)
+        aspirate_volume = kwargs.get('aspirate_volume', channel.pump.total_volume)
+        air_volume = kwargs.get('air_volume', 1)
 
         if volume == 0:
             pass
+        elif volume > aspirate_volume and len(channels) > 0:
+            ## double-buffered: prime every syringe, then alternate strokes between them
+            with ThreadPoolExecutor(max_workers=len(channels)) as pool:
+                list(pool.map(lambda x: (x.reset_to_waste(), x.from_to(solution, self.waste_name, prime_volume)), channels))
+            stroke_volume = min([aspirate_volume] + [x.pump.total_volume for x in channels])
+            self.run_strokes(channels, self.split_strokes(volume, stroke_volume),
+                             lambda channel, x, deliver: channel.light_dispense(solution, x, air_volume, deliver))
         else:
-            self.reset_to_waste()
+            channel.reset_to_waste()
             volume_counter = volume
-            self.from_to(solution, self.waste_name, self.prime_volume)
-            if volume > self.aspirate_volume:
-                for x in range(int(volume//self.aspirate_volume)):
-                    self.light_dispense(solution,self.aspirate_volume)
-                    volume_counter -= self.aspirate_volume
-                self.light_dispense(solution,volume_counter)
+            channel.from_to(solution, self.waste_name, prime_volume)
+            if volume > aspirate_volume:
+                for x in range(int(volume//aspirate_volume)):
+                    channel.light_dispense(solution, aspirate_volume, air_volume)
+                    volume_counter -= aspirate_volume
+                channel.light_dispense(solution, volume_counter, air_volume)
             else:
-                self.light_dispense(solution,volume)
+                channel.light_dispense(solution, volume, air_volume)
 
     def remove_cell_contents(self,volume):
         self.check_types([self.valve_bool,self.pump_bool])
 
         volume_counter = volume
-        if volume > self.pump.total_volume:
+        channels = self.buffer_channels(self.cell_name, self.waste_name)
+        if volume > self.pump.total_volume and len(channels) > 0:
+            stroke_volume = min(x.pump.total_volume for x in channels)
+            self.run_strokes(channels, self.split_strokes(volume, stroke_volume),
+                             lambda channel, x, deliver: channel.from_to(self.cell_name, self.waste_name, x, deliver))
+        elif volume > self.pump.total_volume:
             for x in range(int(volume//self.pump.total_volume)):
                 self.from_to_all(self.cell_name,self.waste_name)
                 volume_counter -= self.pump.total_volume
@@ -183,6 +512,7 @@ class bundle():
         self.check_types([self.valve_bool,self.pump_bool])
         if self.verbose == True:
             print('cleaning cell')
+        self.mark('clean', volume=volume)
 
         self.extra_volume = 5
         if 'extra_volume' in kwargs:
@@ -243,6 +573,47 @@ class bundle():
     
 
 
+    def calibrate_settle(self, solution, volume, **kwargs):
+        ## Shortens the settle delay for one solution until the balance under the cell sees a short delivery
+        self.check_types([self.valve_bool,self.pump_bool,self.balance_bool])
+
+        factors = [1, 0.5, 0.25, 0.1, 0]
+        density = 1 #g per pump volume unit
+        tolerance = 0.02 #allowed fractional deviation from the expected mass
+        if 'factors' in kwargs:
+            factors = sorted(kwargs.get('factors'), reverse=True)
+        if 'density' in kwargs:
+            density = kwargs.get('density')
+        if 'tolerance' in kwargs:
+            tolerance = kwargs.get('tolerance')
+
+        settle = self.pump.settle
+        original = settle.port_params(solution)
+        best = original['weight']
+        self.settle_calibration = []
+
+        self.prime(solution, volume)
+        for factor in factors:
+            weight = original['weight']*factor
+            settle.set_port(solution, weight, original['settle'])
+            self.balance.tare()
+            self.from_to(solution, self.cell_name, volume)
+            mass = self.balance.query_mass()
+            error = (mass - volume*density)/(volume*density)
+            self.settle_calibration.append({'weight' : weight, 'mass' : mass, 'error' : error})
+            if self.verbose == True:
+                print(f'{solution}: settle weight {weight:.3f} -> {mass} g ({error*100:.1f}%)')
+            if abs(error) > tolerance:
+                break
+            best = weight
+        settle.set_port(solution, best, original['settle'])
+        self.remove_cell_contents(volume*len(self.settle_calibration)+5)
+        return best
+
+    def settle_metrics(self):
+        self.check_types([self.pump_bool])
+        return self.pump.settle.metrics()
+
     ##### below is experimental -- everything needs refactored anyways
     ###
     ####
@@ -253,13 +624,57 @@ class bundle():
     ###
         
     def mix_component(self,solution,volume,**kwargs):
-        while True:
-            self.dispense(solution, volume, **kwargs)
-            yield volume
-        
-    def mix_dispense(self,components):
-        volume = sum([x.send(None) for x in components])
-        return volume
+        return mix_component(self, solution, volume, **kwargs)
+
+    def strokes(self, n, volume):
+        ## load of a dispense on pair n in syringe strokes, comparable between pumps of different sizes and units
+        return volume/self.channels[n].pump.total_volume
+
+    def assign_components(self, components):
+        ## Spreads the components over the pump/valve pairs that reach them, largest first onto the pair that
+        ## would finish it soonest. Returns {pair : [(index, component), ...]}
+        lines = (self.waste_name, self.cell_name, self.air_name)
+        load = {n : 0 for n in range(len(self.channels))}
+        options = {}
+        for index, component in enumerate(components):
+            options[index] = [n for n, x in enumerate(self.channels) if x.reaches(component.solution, *lines)]
+            if len(options[index]) == 0:
+                options[index] = [self.channels.index(self.channel_for(component.solution, *lines))]
+        groups = {}
+        for index in sorted(options, key=lambda x: -min(self.strokes(n, components[x].volume) for n in options[x])):
+            component = components[index]
+            n = min(options[index], key=lambda x: load[x] + self.strokes(x, component.volume))
+            load[n] += self.strokes(n, component.volume)
+            groups.setdefault(n, []).append((index, component))
+        return groups
+
+    def mix_dispense(self,components,**kwargs):
+        ## Components on different pump/valve pairs are dispensed into the cell at the same time
+        parallel = kwargs.get('parallel', True)
+        if not parallel or len(self.channels) < 2 or not all(isinstance(x, mix_component) for x in components):
+            return sum([x.send(None) for x in components])
+
+        groups = self.assign_components(components)
+        durations = {}
+        start = time.monotonic()
+
+        def run_group(n):
+            for index, component in groups[n]:
+                begin = time.monotonic()
+                component.dispense(channel=self.channels[n])
+                durations[(index, n, component.solution)] = time.monotonic() - begin
+
+        with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+            list(pool.map(run_group, groups))
+        wall = time.monotonic() - start
+
+        ## the serial time is what the same component dispenses would have taken back to back
+        serial = sum(durations.values())
+        self.mix_report = {'components' : {f'{index}: {solution} (pair {n})' : x for (index, n, solution), x in sorted(durations.items())},
+                           'serial' : serial, 'parallel' : wall, 'speedup' : serial/wall if wall > 0 else 1}
+        if self.verbose == True:
+            print(f'mixture dispensed in {wall:.1f} s instead of {serial:.1f} s ({self.mix_report["speedup"]:.2f}x)')
+        return sum(x.volume for x in components)
 
     def mix_prime(self,components,**kwargs):
         volume = self.mix_dispense(components)
@@ -1,6 +1,8 @@
 from .main import instrument
+import threading
 import time
 import numpy as np
+import pandas as pd
 from sklearn.linear_model import LinearRegression
 
 class pH_arduino(instrument):
@@ -12,13 +14,18 @@ class pH_arduino(instrument):
         self.model = 'Arduino pH meter'
         self.type = 'pH'
         self.cal_curve = False
+        self.stream_thread = None
+        self.stream_data = []
+        self.stream_errors = 0 #unreadable replies the sampler skipped
+        self.stream_error = None #exception that stopped the sampler, None while it runs or after a clean stop
         if self.verbose == True:
             print(f'{self.model} connected on {com_port} at {self.baud_rate} bits/s')
 
     def send_comm(self):
-        self.ser.write(bytes('<pH>', 'utf-8'))
-        msg = self.ser.readline()
-        return int(msg.decode('utf-8'))
+        with self.io_lock:
+            self.ser.write(bytes('<pH>', 'utf-8'))
+            msg = self.ser.readline()
+        return self.publish('pH_voltage', int(msg.decode('utf-8')))
     
     #measure the voltage output from the pH meter
     def voltage(self, **kwargs):
@@ -34,4 +41,56 @@ class pH_arduino(instrument):
         if self.cal_curve == False:
             raise ValueError('No calibration curve loaded')
         X = np.array(self.voltage(**kwargs)).reshape(-1,1)
-        return float(self.cal_curve.predict(X))
\ No newline at end of file
+        return float(self.cal_curve.predict(X))
+
+    #sample voltages continuously on a background thread, each with a monotonic timestamp
+    def start_stream(self, **kwargs):
+        if self.stream_thread != None:
+            raise RuntimeError('Stream already running')
+        interval = kwargs.get('interval', 0) #seconds between samples, 0 = as fast as the arduino answers
+        callback = kwargs.get('callback', None) #called with (timestamp, voltage) for every sample
+        on_error = kwargs.get('on_error', None) #called with the exception if sampling has to stop
+        max_errors = kwargs.get('max_errors', 10) #unreadable replies in a row before sampling stops
+        self.stream_data = []
+        self.stream_errors = 0
+        self.stream_error = None
+        self.stream_stop = threading.Event()
+
+        def sample():
+            bad = 0
+            while not self.stream_stop.is_set():
+                ## garbled or partial lines are skipped and counted, a dead port or too many bad lines stop the sampler
+                try:
+                    t, value = time.monotonic(), self.send_comm()
+                except Exception as error:
+                    self.stream_errors += 1
+                    bad += 1
+                    if isinstance(error, ValueError) and bad < max_errors:
+                        continue
+                    self.stream_error = error
+                    if on_error != None:
+                        on_error(error)
+                    return
+                bad = 0
+                self.stream_data.append((t, value))
+                if callback != None:
+                    callback(t, value)
+                if interval > 0:
+                    self.stream_stop.wait(interval)
+
+        self.stream_thread = threading.Thread(target=sample, name=f'{self.com_port} stream', daemon=True)
+        self.stream_thread.start()
+
+    #stop the sampler, returns the samples with pH filled in when a calibration is loaded
+    def stop_stream(self):
+        if self.stream_thread != None:
+            self.stream_stop.set()
+            self.stream_thread.join()
+            self.stream_thread = None
+        return self.stream_frame()
+
+    def stream_frame(self):
+        df = pd.DataFrame(list(self.stream_data), columns=['time', 'voltage'])
+        if self.cal_curve != False and len(df) > 0:
+            df['pH'] = self.cal_curve.predict(df[['voltage']].to_numpy())
+        return df
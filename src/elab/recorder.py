@@ -0,0 +1,207 @@
+'''
+Serial traffic recorder and replay transport.
+
+traffic_log writes every write/read on the wrapped ports to a compact binary file with monotonic timestamps.
+Each record is a '<dBBH' header (seconds since the log was opened, channel, direction, payload length)
+followed by the payload. Direction 2 is a channel declaration whose payload is the port name.
+
+    log = elab.traffic_log('run.elog')
+    valve = elab.SV07('COM8', record=log)
+    pump = elab.SY08('COM11', record=log)
+
+The same file can later stand in for the rig, with the original timing (speed=1), compressed (speed>1)
+or none at all (speed=0):
+
+    replay = elab.traffic_log.load('run.elog', speed=0)
+    valve = elab.SV07('COM8', replay=replay)
+'''
+
+import struct
+import threading
+import time
+
+record_struct = struct.Struct('<dBBH')
+log_magic = b'ELOG\x01'
+WRITE, READ, OPEN = 0, 1, 2
+
+class traffic_log():
+
+    def __init__(self, filepath, **kwargs):
+        self.filepath = filepath
+        self.file = open(filepath, 'wb')
+        self.file.write(log_magic)
+        self.start = time.monotonic()
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def channel(self, name):
+        with self.lock:
+            if name not in self.channels:
+                self.channels[name] = len(self.channels)
+                self._write(self.channels[name], OPEN, str(name).encode())
+            return self.channels[name]
+
+    def _write(self, channel, direction, data):
+        self.file.write(record_struct.pack(time.monotonic()-self.start, channel, direction, len(data)))
+        self.file.write(data)
+
+    def log(self, channel, direction, data):
+        with self.lock:
+            self._write(channel, direction, bytes(data))
+
+    def wrap(self, ser, name):
+        return recording_port(ser, self, name)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    @staticmethod
+    def read_records(filepath):
+        ## Returns a dict of port name -> list of (timestamp, direction, payload)
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        if not data.startswith(log_magic):
+            raise ValueError(f'{filepath} is not a traffic log')
+        names, records, offset = {}, {}, len(log_magic)
+        while offset + record_struct.size <= len(data):
+            t, channel, direction, length = record_struct.unpack_from(data, offset)
+            offset += record_struct.size
+            payload = data[offset:offset+length]
+            offset += length
+            if direction == OPEN:
+                names[channel] = payload.decode()
+                records[names[channel]] = []
+            else:
+                records[names[channel]].append((t, direction, payload))
+        return records
+
+    @classmethod
+    def load(cls, filepath, **kwargs):
+        return replay_log(cls.read_records(filepath), **kwargs)
+
+
+class recording_port():
+    ## Wraps a serial.Serial (or any transport) and logs the traffic, everything else passes through
+
+    def __init__(self, ser, log, name):
+        self.ser = ser
+        self.traffic = log
+        self.channel = log.channel(name)
+
+    def write(self, data):
+        self.traffic.log(self.channel, WRITE, data)
+        return self.ser.write(data)
+
+    def read(self, *args, **kwargs):
+        data = self.ser.read(*args, **kwargs)
+        self.traffic.log(self.channel, READ, data)
+        return data
+
+    def read_all(self):
+        data = self.ser.read_all()
+        self.traffic.log(self.channel, READ, data)
+        return data
+
+    def read_until(self, *args, **kwargs):
+        data = self.ser.read_until(*args, **kwargs)
+        self.traffic.log(self.channel, READ, data)
+        return data
+
+    def readline(self, *args, **kwargs):
+        data = self.ser.readline(*args, **kwargs)
+        self.traffic.log(self.channel, READ, data)
+        return data
+
+    def close(self):
+        self.traffic.flush()
+        self.ser.close()
+
+    def __getattr__(self, name):
+        return getattr(self.ser, name)
+
+
+class replay_log():
+
+    def __init__(self, records, **kwargs):
+        self.records = records
+        self.speed = 1 #1 = original timing, >1 compressed, 0 = no waiting
+        self.strict = False #raise if the driver writes something other than what was recorded
+
+        if 'speed' in kwargs:
+            self.speed = kwargs.get('speed')
+        if 'strict' in kwargs:
+            self.strict = kwargs.get('strict')
+
+    def port(self, name):
+        if name not in self.records:
+            raise ValueError(f'No traffic recorded for {name}')
+        return replay_port(self.records[name], name, speed=self.speed, strict=self.strict)
+
+
+class replay_port():
+    ## Fake serial port that plays back one channel of a traffic log
+
+    def __init__(self, records, name, **kwargs):
+        self.records = records
+        self.name = name
+        self.speed = kwargs.get('speed', 1)
+        self.strict = kwargs.get('strict', False)
+        self.index = 0
+        self.is_open = True
+        self.mismatches = []
+        self.last_time = None
+        self.last_wall = None
+
+    def _pace(self, t):
+        ## Sleep so that the gap since the previous event matches the recording divided by speed
+        if self.speed and self.last_time != None:
+            wait = (t - self.last_time)/self.speed - (time.monotonic() - self.last_wall)
+            if wait > 0:
+                time.sleep(wait)
+        self.last_time, self.last_wall = t, time.monotonic()
+
+    def _next(self, direction):
+        while self.index < len(self.records):
+            t, recorded_direction, payload = self.records[self.index]
+            self.index += 1
+            if recorded_direction == direction:
+                self._pace(t)
+                return payload
+            self.mismatches.append((self.index-1, direction, payload))
+        return None
+
+    def write(self, data):
+        payload = self._next(WRITE)
+        if payload != bytes(data):
+            if self.strict:
+                raise ValueError(f'{self.name}: wrote {bytes(data)!r}, recorded {payload!r}')
+            self.mismatches.append((self.index-1, WRITE, bytes(data)))
+        return len(data)
+
+    def read(self, *args, **kwargs):
+        payload = self._next(READ)
+        return b'' if payload == None else payload
+
+    read_all = read
+    read_until = read
+    readline = read
+
+    @property
+    def in_waiting(self):
+        if self.index < len(self.records) and self.records[self.index][1] == READ:
+            return len(self.records[self.index][2])
+        return 0
+
+    def reset_input_buffer(self):
+        pass
+
+    def setRTS(self, value):
+        pass
+
+    def close(self):
+        self.is_open = False
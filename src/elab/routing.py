@@ -0,0 +1,84 @@
+'''
+Valve routing for cascaded selector valves. The root valve sits in front of the pump, further valves hang off
+its ports (or off each other), so one pump/valve pair can reach more than 16 solutions.
+
+A port table entry is either a root port number, a (valve name, port) pair, or a list of those when the same
+solution is plumbed to more than one place. Where a solution can be reached several ways the router picks the
+shortest route. With lazy=True it also skips valves already on the right port and prefers the route that switches
+the fewest valves; that trusts each valve's cached position, which the drivers drop after any other command or a stop.
+
+    lab = elab.bundle([elab.SV07('COM8'), elab.SY08('COM11'), elab.SV07('COM12')])
+    lab.cascade(lab.valves[1], port=16, name='B')   # valve B's common line goes to root port 16
+    lab.load_ports({'cell' : 1, 'waste' : 2, 'glycerol' : ('B', 4)})
+'''
+
+def route_entry(entry):
+    ## Port table entries that came through JSON have lists for tuples, ['B', 4] is a (valve, port) pair
+    if type(entry) in (list, tuple):
+        if len(entry) == 2 and type(entry[0]) == str:
+            return (entry[0], entry[1])
+        return [route_entry(x) for x in entry]
+    return entry
+
+class valve_router():
+
+    def __init__(self, root, **kwargs):
+        self.valves = {'root' : root}
+        self.links = {} #valve name -> (parent valve name, parent port)
+        self.lazy = False #skip moves to the port a valve reports it is already on
+        self.moves = 0
+        self.skipped = 0
+
+        if 'lazy' in kwargs:
+            self.lazy = kwargs.get('lazy')
+
+    def add_valve(self, name, valve, port, parent='root'):
+        if parent not in self.valves:
+            raise ValueError(f'Unknown parent valve {parent}')
+        if port not in range(1, self.valves[parent].ports+1):
+            raise ValueError(f'Port must be between 1 and {self.valves[parent].ports}')
+        self.valves[name] = valve
+        self.links[name] = (parent, port)
+
+    def path_to(self, name):
+        ## (valve name, port) moves from the root down to the common line of valve name
+        path = []
+        while name != 'root':
+            parent, port = self.links[name]
+            path.insert(0, (parent, port))
+            name = parent
+        return path
+
+    def paths(self, entry):
+        entry = route_entry(entry)
+        if type(entry) == list:
+            return [path for x in entry for path in self.paths(x)]
+        if type(entry) == tuple:
+            name, port = entry
+            if name not in self.valves:
+                raise ValueError(f'Unknown valve {name}')
+            return [self.path_to(name) + [(name, int(port))]]
+        return [[('root', int(entry))]]
+
+    def pending(self, path):
+        return [(name, port) for name, port in path if not (self.lazy and self.valves[name].position == port)]
+
+    def plan(self, entry):
+        ## Route with the fewest valves to switch, shorter routes win ties
+        return min(self.paths(entry), key=lambda path: (len(self.pending(path)), len(path)))
+
+    def select(self, entry):
+        path = self.plan(entry)
+        moves = self.pending(path)
+        for name, port in moves:
+            self.valves[name].port(port)
+        self.moves += len(moves)
+        self.skipped += len(path) - len(moves)
+        return moves
+
+    def reaches(self, entry):
+        try:
+            self.paths(entry)
+            return True
+        except ValueError:
+            return False
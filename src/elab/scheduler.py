@@ -0,0 +1,125 @@
+'''
+Multi-cell scheduler. Several experiment workflows, each on its own cell, share one bundle. Every workflow
+runs in its own thread and only holds the instruments it needs while it uses them, so while one cell waits
+on a pH reading, a bubble settle or a CV, the valve and pump do fluidics for the others.
+
+    def workflow(cell):
+        with cell.fluidics('dispense'):
+            cell.lab.dispense('tempo', 3)     # lab.cell_name is this cell while the lock is held
+        cell.wait(60, 'equilibrate')          # nothing held, other cells get the valve and pump
+        with cell.use('pH', label='pH'):
+            pH = cell.lab.pH.measure(delay=0)
+
+    schedule = elab.cell_scheduler(lab)
+    schedule.add('cell1', workflow)
+    schedule.add('cell2', workflow)
+    schedule.run()
+    schedule.timeline()  # per cell start/end of every step
+'''
+
+import threading
+import time
+import pandas as pd
+from contextlib import contextmanager
+
+class cell_scheduler():
+
+    def __init__(self, lab, **kwargs):
+        self.lab = lab
+        self.verbose = kwargs.get('verbose', lab.verbose)
+        self.workflows = []
+        self.records = []
+        self.errors = {}
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.start = time.monotonic() #reset by run()
+        self.makespan = 0.0
+
+    def lock(self, resource):
+        with self.locks_lock:
+            if resource not in self.locks:
+                self.locks[resource] = threading.Lock()
+            return self.locks[resource]
+
+    def add(self, cell_name, workflow, *args, **kwargs):
+        self.workflows.append((cell_name, workflow, args, kwargs))
+
+    def record(self, cell_name, label, resources, requested, start, end):
+        self.records.append({'cell' : cell_name, 'label' : label, 'resources' : ','.join(resources),
+                             'requested' : requested - self.start, 'start' : start - self.start,
+                             'end' : end - self.start, 'blocked' : start - requested, 'duration' : end - start})
+        if self.verbose == True:
+            print(f'{cell_name}: {label} {start-self.start:.1f}-{end-self.start:.1f} s')
+
+    def run(self):
+        self.start = time.monotonic()
+
+        def run_cell(cell_name, workflow, args, kwargs):
+            try:
+                workflow(cell_context(self, cell_name), *args, **kwargs)
+            except Exception as error:
+                self.errors[cell_name] = error
+
+        threads = [threading.Thread(target=run_cell, args=x, name=f'cell {x[0]}') for x in self.workflows]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.makespan = time.monotonic() - self.start
+        if len(self.errors) > 0:
+            raise RuntimeError(f'workflows failed: {self.errors}')
+        return self.timeline()
+
+    def timeline(self):
+        return pd.DataFrame(self.records, columns=['cell','label','resources','requested','start','end','blocked','duration'])
+
+    def utilization(self):
+        ## Fraction of the run each resource was busy, plus the idle time each cell spent waiting for one (all zero before run())
+        df = self.timeline()
+        usage = {}
+        for resource in self.locks:
+            busy = df.loc[df['resources'].str.split(',').apply(lambda x: resource in x), 'duration'].sum()
+            usage[resource] = float(busy/self.makespan) if self.makespan > 0 else 0.0
+        return {'makespan' : self.makespan, 'busy' : usage, 'blocked' : {cell : float(x) for cell, x in df.groupby('cell')['blocked'].sum().items()}}
+
+
+class cell_context():
+
+    def __init__(self, scheduler, cell_name):
+        self.scheduler = scheduler
+        self.lab = scheduler.lab
+        self.cell_name = cell_name
+
+    @contextmanager
+    def use(self, *resources, **kwargs):
+        ## Holds the named resources (taken in sorted order so cells never deadlock)
+        label = kwargs.get('label', ','.join(resources))
+        locks = [self.scheduler.lock(x) for x in sorted(set(resources))]
+        requested = time.monotonic()
+        for lock in locks:
+            lock.acquire()
+        start = time.monotonic()
+        try:
+            if 'fluidics' in resources:
+                self.lab.change_cell(self.cell_name)
+            yield self.lab
+        finally:
+            end = time.monotonic()
+            for lock in reversed(locks):
+                lock.release()
+            self.scheduler.record(self.cell_name, label, sorted(set(resources)), requested, start, end)
+
+    def fluidics(self, label='fluidics', *resources):
+        ## The valve and pump, plus anything else the step needs
+        return self.use('fluidics', *resources, label=label)
+
+    def run(self, func, *args, **kwargs):
+        resources = kwargs.pop('resources', ('fluidics',))
+        label = kwargs.pop('label', getattr(func, '__name__', 'step'))
+        with self.use(*resources, label=label):
+            return func(*args, **kwargs)
+
+    def wait(self, seconds, label='wait'):
+        now = time.monotonic()
+        time.sleep(seconds)
+        self.scheduler.record(self.cell_name, label, [], now, now, time.monotonic())
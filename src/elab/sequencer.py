@@ -0,0 +1,193 @@
+'''
+Batch experiment sequencer. Takes a batch of planned mixtures and runs them in an order that keeps consecutive
+runs sharing reagents, so the cell only gets a full clean when the carry-over from the previous run is not
+acceptable and a reagent line is only primed when the previous run did not already use it.
+
+    batch = elab.batch_sequencer(lab)
+    for substrate in ['ethanol', 'glycerol']:
+        batch.add(f'{substrate} blank', {'tempo' : 5/3, 'buffer' : 10/3})
+        batch.add(f'{substrate} 0.1 M', targets={'tempo' : 0.0015, substrate : 0.1}, total_volume=5, diluent='buffer')
+    batch.order()
+    print(batch.report)      # predicted fluidics time for the given and the new order
+    batch.run(experiment)    # experiment(lab, run) is called once the mixture is in the cell
+
+Fluidics times are predicted from the pump flow rates and settle models, they are meant for comparing orders.
+'''
+
+import math
+import time
+
+class batch_sequencer():
+
+    def __init__(self, lab, **kwargs):
+        self.lab = lab
+        self.verbose = kwargs.get('verbose', lab.verbose)
+        self.runs = []
+        self.sequence = None
+        self.report = None
+
+        self.tolerance = 0 #acceptable fraction of foreign reagents left over from the previous run
+        self.residual_volume = 0.05 #mL left in the cell after it is emptied
+        self.prime_volume = 1 #mL pushed through a line that the previous run did not use
+        self.clean_volume = None #flush volume per clean, defaults to the volume of the previous run
+        self.extra_volume = 5
+        self.air_volume = 1
+        self.valve_time = 0.5 #s per valve move
+
+        for key in ['tolerance','residual_volume','prime_volume','clean_volume','extra_volume','air_volume','valve_time']:
+            if key in kwargs:
+                setattr(self, key, kwargs.get(key))
+
+    def add(self, name, components=None, **kwargs):
+        ## components is {solution : volume} or a list of mix components, targets= takes {solution : concentration}
+        ## and fills the rest of total_volume with diluent, using the conc column of the ports table
+        if type(components) == list:
+            components = {x.solution : x.volume for x in components}
+        components = dict(components or {})
+        if 'targets' in kwargs:
+            total_volume = kwargs.get('total_volume')
+            for solution, target in kwargs.get('targets').items():
+                components[solution] = components.get(solution, 0) + target/self.lab.conc(solution)*total_volume
+            remainder = total_volume - sum(components.values())
+            if remainder < 0:
+                raise ValueError(f'{name}: targets need {total_volume-remainder:.3f} mL, more than total_volume')
+            if remainder > 0:
+                if 'diluent' not in kwargs:
+                    raise ValueError(f'{name}: targets leave {remainder:.3f} mL, give a diluent')
+                diluent = kwargs.get('diluent')
+                components[diluent] = components.get(diluent, 0) + remainder
+        components = {solution : float(volume) for solution, volume in components.items() if volume > 0}
+        if len(components) == 0:
+            raise ValueError(f'{name}: a run needs at least one component with a volume')
+        run = {'name' : name, 'components' : components, 'data' : kwargs.get('data', None)}
+        self.runs.append(run)
+        return run
+
+    ## cost model
+
+    def channel(self, solution):
+        lab = self.lab
+        return lab.channel_for(solution, lab.waste_name, lab.cell_name, lab.air_name)
+
+    def transfer_time(self, channel, solution, volume):
+        ## Strokes from one line to another: plunger travel both ways, settle delays and two valve moves per stroke
+        pump = channel.pump
+        settle = pump.settle if hasattr(pump, 'settle') else None
+        strokes = max(1, math.ceil(volume/pump.total_volume - 1e-9))
+        stroke = volume/strokes
+        seconds = 2*volume/pump.flow_rate() + 2*strokes*self.valve_time
+        if settle != None:
+            port = settle.port_params(solution)
+            seconds += strokes*(settle.compute(settle.params['aspirate'], port, stroke) + settle.compute(settle.params['discharge'], port, stroke))
+        return seconds
+
+    def dispense_time(self, solution, volume):
+        channel = self.channel(solution)
+        strokes = max(1, math.ceil(volume/channel.pump.total_volume - 1e-9))
+        return (self.transfer_time(channel, solution, 0.1) + self.transfer_time(channel, solution, volume)
+                + strokes*self.transfer_time(channel, self.lab.air_name, self.air_volume))
+
+    def empty_time(self, volume):
+        return self.transfer_time(self.channel(self.lab.cell_name), self.lab.cell_name, volume + self.extra_volume)
+
+    def clean_time(self, volume):
+        clean_volume = volume if self.clean_volume == None else self.clean_volume
+        return 2*self.empty_time(clean_volume) + self.dispense_time(self.lab.flush_name, clean_volume)
+
+    def prime_time(self, solution):
+        return self.dispense_time(solution, self.prime_volume) + self.empty_time(self.prime_volume)
+
+    def carryover(self, previous, run):
+        ## Fraction of the next mixture that is left over from reagents it does not contain itself
+        foreign = sum(volume for solution, volume in previous['components'].items() if solution not in run['components'])
+        return self.residual_volume*foreign/sum(previous['components'].values())/sum(run['components'].values())
+
+    def needs_clean(self, previous, run):
+        return previous != None and self.carryover(previous, run) > self.tolerance
+
+    def new_lines(self, previous, run):
+        used = set() if previous == None else set(previous['components'])
+        return [x for x in run['components'] if x not in used]
+
+    def transition_time(self, previous, run, always=False):
+        ## Fluidics between two runs: empty or clean the cell, prime new lines, then dispense the mixture
+        seconds = sum(self.dispense_time(solution, volume) for solution, volume in run['components'].items())
+        if previous != None:
+            volume = sum(previous['components'].values())
+            seconds += self.clean_time(volume) if (always or self.needs_clean(previous, run)) else self.empty_time(volume)
+        lines = list(run['components']) if always else self.new_lines(previous, run)
+        return seconds + sum(self.prime_time(x) for x in lines)
+
+    def predict(self, sequence, always=False):
+        seconds, previous = 0, None
+        for run in sequence:
+            seconds += self.transition_time(previous, run, always)
+            previous = run
+        return seconds
+
+    ## ordering
+
+    def order(self):
+        ## Nearest neighbour from every starting run, then move single runs around while that lowers the total
+        n = len(self.runs)
+        cost = [[self.transition_time(None if a == None else self.runs[a], self.runs[b]) for b in range(n)] for a in [None] + list(range(n))]
+        total = lambda seq: sum(cost[0 if k == 0 else seq[k-1]+1][x] for k, x in enumerate(seq))
+
+        best = None
+        for first in range(n):
+            seq, left = [first], set(range(n)) - {first}
+            while len(left) > 0:
+                nxt = min(left, key=lambda x: (cost[seq[-1]+1][x], x))
+                seq.append(nxt)
+                left.remove(nxt)
+            if best == None or total(seq) < total(best):
+                best = seq
+
+        improved = best != None
+        while improved:
+            improved = False
+            for i in range(n):
+                for j in range(n):
+                    if i == j:
+                        continue
+                    seq = list(best)
+                    seq.insert(j, seq.pop(i))
+                    if total(seq) < total(best) - 1e-9:
+                        best, improved = seq, True
+
+        self.sequence = [self.runs[x] for x in (best or [])]
+        given, given_cleaned, ordered = self.predict(self.runs), self.predict(self.runs, always=True), self.predict(self.sequence)
+        self.report = {'order' : [x['name'] for x in self.sequence], 'given' : given, 'given_cleaned' : given_cleaned,
+                       'ordered' : ordered, 'saved' : given_cleaned - ordered, 'saved_by_order' : given - ordered,
+                       'cleans' : sum(self.needs_clean(a, b) for a, b in zip(self.sequence, self.sequence[1:]))}
+        if self.verbose == True:
+            print(f'predicted fluidics {ordered/60:.1f} min instead of {given_cleaned/60:.1f} min '
+                  f'({self.report["saved"]/60:.1f} min saved, {self.report["cleans"]} cleans)')
+        return self.sequence
+
+    ## execution
+
+    def run(self, experiment=None):
+        if self.sequence == None:
+            self.order()
+        lab, previous = self.lab, None
+        self.times = []
+        for run in self.sequence:
+            start = time.monotonic()
+            if previous != None:
+                volume = sum(previous['components'].values())
+                if self.needs_clean(previous, run):
+                    lab.clean_cell(volume if self.clean_volume == None else self.clean_volume, extra_volume=self.extra_volume)
+                else:
+                    lab.remove_cell_contents(volume + self.extra_volume)
+            for solution in self.new_lines(previous, run):
+                lab.prime(solution, self.prime_volume, extra_volume=self.extra_volume)
+            lab.mix_dispense([lab.mix_component(solution, volume) for solution, volume in run['components'].items()])
+            fluidics = time.monotonic() - start
+            self.times.append({'name' : run['name'], 'fluidics' : fluidics, 'predicted' : self.transition_time(previous, run)})
+            if self.verbose == True:
+                print(f'{run["name"]}: fluidics {fluidics:.1f} s')
+            if experiment != None:
+                experiment(lab, run)
+            previous = run
+        return self.times
@@ -0,0 +1,185 @@
+'''
+Lab daemon. A lab_server keeps one bundle and its instruments open and serves operations to any number of
+client scripts over a local socket, one JSON object per line. Each operation holds a lock on the instruments
+it uses, so unrelated jobs (a pH reading and a dispense) run side by side and conflicting ones queue.
+
+Server process:
+
+    lab = elab.bundle([elab.SV07('COM8'), elab.SY08('COM11'), elab.pH_arduino('COM9')])
+    lab.load_ports('ports.csv')
+    elab.lab_server(lab).serve_forever()
+
+Client scripts:
+
+    lab = elab.lab_client()
+    lab.clean_cell(10)
+    lab.mix_dispense([lab.mix_component('tempo', 1), lab.mix_component('buffer', 4)])
+    lab.instrument('pH').measure(delay=30)
+'''
+
+import json
+import socket
+import socketserver
+import threading
+from .jsonutil import to_json
+
+default_port = 5757
+
+## bundle method -> instrument attributes it needs, anything not listed locks every instrument.
+## Changing the cell or the port map takes the fluidics locks too, so it waits for transfers in progress
+resource_dict = {'from_to' : ['valve','pump'], 'from_to_all' : ['valve','pump'], 'init_line' : ['valve','pump'],
+                 'reset_to_waste' : ['valve','pump'], 'light_dispense' : ['valve','pump'], 'dispense' : ['valve','pump'],
+                 'remove_cell_contents' : ['valve','pump'], 'clean_cell' : ['valve','pump'], 'clear_line' : ['valve','pump'],
+                 'bubble' : ['valve','pump'], 'mix_dispense' : ['valve','pump'], 'mix_prime' : ['valve','pump'],
+                 'prime' : ['valve','pump'], 'home' : ['valve','pump'],
+                 'load_ports' : ['valve','pump'], 'change_cell' : ['valve','pump'], 'change_default_ports' : ['valve','pump'],
+                 'conc' : [], 'settle_metrics' : []}
+
+## Operations a client may call, anything else (attributes such as soln_df or jobs, raw port I/O, helpers) is
+## refused. Targets other than 'bundle' must name one of the bundle's instruments
+bundle_methods = set(resource_dict) | {'calibrate_pH', 'calibrate_settle', 'strokes'}
+instrument_methods = {'measure', 'voltage', 'start_stream', 'stop_stream', 'stream_frame',                  # pH
+                      'query_temp', 'set_temp', 'start_temp', 'stop_temp', 'set_spin', 'start_spin',       # hotplate
+                      'stop_spin', 'wait_until_stable', 'run_program',
+                      'port', 'reset', 'origin_reset', 'full_reset',                                       # valves
+                      'aspirate', 'discharge', 'query_position', 'move_to_position', 'set_speed',          # pumps
+                      'flow_rate', 'set_flow_rate', 'stop',
+                      'status', 'is_running', 'wait_until_done', 'infused_volume', 'withdrawn_volume',     # Legato100
+                      'clear_volumes', 'set_rate', 'set_target_volume', 'set_target_time', 'set_run_mode',
+                      'set_syringe', 'dispense', 'run_method', 'join_method',
+                      'query_mass', 'tare',                                                                # balance
+                      'read_data', 'query_data', 'query_gas', 'query_setpoint', 'set_setpoint',            # MFC
+                      'change_setpoint', 'set_gas', 'tare_flow',
+                      'electrode', 'ida', 'gen', 'coll', 'gen_all', 'coll_all', 'all'}                     # MUX8
+
+
+class lab_server(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, lab, host='127.0.0.1', port=default_port, **kwargs):
+        self.lab = lab
+        self.verbose = kwargs.get('verbose', lab.verbose)
+        self.locks = {id(x) : threading.Lock() for x in lab.inst_list}
+        self.jobs = 0
+        self.jobs_lock = threading.Lock()
+        super().__init__((host, port), lab_request_handler)
+
+    def resources(self, target, method):
+        ## Locks for one operation, always in the same order so two jobs can never deadlock
+        if target != 'bundle':
+            insts = [getattr(self.lab, target)]
+        elif method in resource_dict:
+            ## valve and pump stand for every pump/valve pair, transfers may use any of them
+            insts = [getattr(self.lab, name) for name in resource_dict[method] if hasattr(self.lab, name)]
+            if len(insts) > 0:
+                insts += self.lab.pumps + self.lab.valves
+        else:
+            insts = self.lab.inst_list
+        keys = sorted(set(id(x) for x in insts if id(x) in self.locks))
+        return [self.locks[key] for key in keys]
+
+    def decode(self, value):
+        if type(value) == dict and '__mix_component__' in value:
+            solution, volume, kwargs = value['__mix_component__']
+            return self.lab.mix_component(solution, volume, **kwargs)
+        if type(value) == list:
+            return [self.decode(x) for x in value]
+        return value
+
+    def execute(self, request):
+        target = request.get('target', 'bundle')
+        method = request['method']
+        if target == 'bundle':
+            obj, allowed = self.lab, bundle_methods
+        else:
+            obj = getattr(self.lab, target, None) if type(target) == str and not target.startswith('_') else None
+            if not any(obj is x for x in self.lab.inst_list):
+                raise PermissionError(f'{target} is not an instrument of this bundle')
+            allowed = instrument_methods
+        func = getattr(obj, method, None) if method in allowed else None
+        if not callable(func):
+            raise PermissionError(f'{target}.{method} is not an operation the server runs')
+        args = self.decode(request.get('args', []))
+        kwargs = {key : self.decode(value) for key, value in request.get('kwargs', {}).items()}
+
+        locks = self.resources(target, method)
+        for lock in locks:
+            lock.acquire()
+        try:
+            with self.jobs_lock:
+                self.jobs += 1
+                job = self.jobs
+            if self.verbose == True:
+                print(f'job {job}: {target}.{method}{tuple(args)}')
+            return func(*args, **kwargs)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+
+class lab_request_handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if line.strip() == b'':
+                continue
+            request = {}
+            try:
+                request = json.loads(line)
+                reply = {'id' : request.get('id'), 'result' : self.server.execute(request)}
+            except Exception as error:
+                ## a malformed line gets an error reply like any failed call, the connection stays usable
+                reply = {'id' : request.get('id') if type(request) == dict else None, 'error' : f'{type(error).__name__}: {error}'}
+            self.wfile.write(json.dumps(reply, default=to_json).encode() + b'\n')
+            self.wfile.flush()
+
+
+class lab_client():
+    ## Mirrors the bundle API, every call runs on the server's bundle
+
+    def __init__(self, host='127.0.0.1', port=default_port, **kwargs):
+        self.address = (host, port)
+        self.sock = socket.create_connection(self.address, timeout=kwargs.get('timeout', None))
+        self.file = self.sock.makefile('rwb')
+        self.lock = threading.Lock()
+        self.count = 0
+
+    def call(self, target, method, *args, **kwargs):
+        with self.lock:
+            self.count += 1
+            request = {'id' : self.count, 'target' : target, 'method' : method, 'args' : list(args), 'kwargs' : kwargs}
+            self.file.write(json.dumps(request, default=to_json).encode() + b'\n')
+            self.file.flush()
+            reply = json.loads(self.file.readline())
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply['result']
+
+    def mix_component(self, solution, volume, **kwargs):
+        return {'__mix_component__' : [solution, volume, kwargs]}
+
+    def instrument(self, name):
+        return remote_instrument(self, name)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call('bundle', name, *args, **kwargs)
+
+
+class remote_instrument():
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.client.call(self.name, name, *args, **kwargs)
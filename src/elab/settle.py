@@ -0,0 +1,113 @@
+'''
+Settle model for syringe pumps. Replaces the fixed sleeps that used to follow every aspirate/discharge
+with a delay derived from the pump flow rate and a per-solution weight/settle parameter from the port table.
+
+delay = base + settle + weight * fraction of stroke moved * (k_rate * strokes/sec + k_volume)
+
+The transient after a move grows with how much fluid moved and how fast, so short moves and slow speeds settle
+for less. weight is a dimensionless settle weight (1 for water). It scales the flow dependent part of the delay
+and is found with bundle.calibrate_settle(); more viscous solutions usually need more than 1, but it is not a
+viscosity.
+
+For water at the pump's default speed the defaults stay below the old fixed sleeps over the whole stroke. The
+old sleeps are kept as pump.legacy_settle so metrics() can report the time saved.
+'''
+
+import time
+
+class settle_model():
+
+    def __init__(self, pump, **kwargs):
+        self.pump = pump
+        self.min_delay = 0
+        self.current = None #port title the fluid in the syringe came from
+
+        ## per direction parameters from the pump class, legacy are the fixed sleeps they replaced
+        self.params = {direction : dict(values) for direction, values in pump.settle_defaults.items()}
+        self.legacy = {direction : dict(values) for direction, values in getattr(pump, 'legacy_settle', pump.settle_defaults).items()}
+
+        ## per port parameters, filled by load_ports() or set_port()
+        self.ports = {}
+
+        if 'min_delay' in kwargs:
+            self.min_delay = kwargs.get('min_delay')
+        if 'params' in kwargs:
+            for direction, values in kwargs.get('params').items():
+                self.params[direction].update(values)
+
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        self.metrics_dict = {'count' : 0, 'delay' : 0.0, 'legacy' : 0.0, 'ports' : {}}
+
+    def set_port(self, title, weight=1.0, settle=0.0):
+        self.ports[title] = {'weight' : float(weight), 'settle' : float(settle)}
+
+    def load_table(self, soln_df):
+        ## Optional 'weight' and 'settle' columns in the ports .csv, missing values fall back to water
+        ## ('viscosity' is still read as the weight column for older tables)
+        column = 'weight' if 'weight' in soln_df.columns else 'viscosity'
+        for n, title in enumerate(soln_df['title'].values):
+            weight, settle = 1.0, 0.0
+            if column in soln_df.columns and soln_df[column].values[n] == soln_df[column].values[n]:
+                weight = soln_df[column].values[n]
+            if 'settle' in soln_df.columns and soln_df['settle'].values[n] == soln_df['settle'].values[n]:
+                settle = soln_df['settle'].values[n]
+            self.set_port(title, weight, settle)
+
+    def select(self, title):
+        self.current = title
+
+    def port_params(self, title=None):
+        if title == None:
+            title = self.current
+        return self.ports.get(title, {'weight' : 1.0, 'settle' : 0.0})
+
+    def compute(self, params, port, volume):
+        strokes = self.pump.flow_rate()/self.pump.total_volume
+        fraction = volume/self.pump.total_volume
+        delay = params['base'] + port['settle'] + port['weight']*fraction*(params['k_rate']*strokes + params['k_volume'])
+        return max(delay, self.min_delay)
+
+    def delay(self, volume, direction):
+        port = self.port_params()
+        delay = self.compute(self.params[direction], port, volume)
+        legacy = self.compute(self.legacy[direction], {'weight' : 1.0, 'settle' : 0.0}, volume)
+
+        ## Keep running totals so a protocol can report how much sleeping it saved
+        self.metrics_dict['count'] += 1
+        self.metrics_dict['delay'] += delay
+        self.metrics_dict['legacy'] += legacy
+        port_metrics = self.metrics_dict['ports'].setdefault(self.current, {'count' : 0, 'delay' : 0.0, 'legacy' : 0.0})
+        port_metrics['count'] += 1
+        port_metrics['delay'] += delay
+        port_metrics['legacy'] += legacy
+        return delay
+
+    def wait(self, volume, direction):
+        delay = self.delay(volume, direction)
+        if self.pump.verbose == True:
+            print(f'{self.pump.model} settling {delay:.2f} s after {direction} of {volume} {self.pump.unit}')
+        time.sleep(delay)
+
+    def metrics(self):
+        metrics = dict(self.metrics_dict)
+        metrics['saved'] = self.metrics_dict['legacy'] - self.metrics_dict['delay']
+        return metrics
+
+    def calibrate_rate(self, volume, **kwargs):
+        ## Time a real aspirate/discharge pair to measure the flow rate at the current speed
+        if 'speed' in kwargs:
+            self.pump.set_speed(kwargs.get('speed'))
+        self.pump.check_movement()
+        start = time.monotonic()
+        self.pump.move_volume(volume, 'aspirate')
+        aspirate_time = time.monotonic() - start
+        start = time.monotonic()
+        self.pump.move_volume(volume, 'discharge')
+        discharge_time = time.monotonic() - start
+        rate = 2*volume/(aspirate_time + discharge_time)
+        self.pump.set_flow_rate(rate)
+        if self.pump.verbose == True:
+            print(f'{self.pump.model} measured flow rate {rate:.3f} {self.pump.unit}/s')
+        return rate
@@ -0,0 +1,147 @@
+'''
+Shared-memory ring buffers for live data. The control process writes samples into a multiprocessing.shared_memory
+block and dashboards or analysis scripts in other processes map the same block and read it without any locks or
+copies through a pipe, so they never touch the control loop's serial timing.
+
+Layout: an int64 header [sequence, count, capacity, writer pid] followed by float64 times and values. The single
+writer makes the sequence odd while it writes a slot and even again when done (a seqlock); readers copy what they
+need and retry if the sequence was odd or moved while they were copying. A block left behind by a writer that
+crashed is replaced, one whose writer is still running is not. Needs Python 3.8 or newer.
+
+Control script:
+
+    hub = elab.telemetry_hub()
+    hub.share('pH', 'temperature')          # mirrored into 'elab_pH' and 'elab_temperature'
+
+Dashboard process:
+
+    ring = elab.shared_ring.attach('elab_pH')
+    times, values = ring.latest(500)
+'''
+
+import os
+import time
+import numpy as np
+
+header_size = 4*8
+
+def writer_pid(memory):
+    if memory.size < header_size:
+        return 0
+    header = np.ndarray((4,), dtype=np.int64, buffer=memory.buf)
+    pid = int(header[3])
+    del header
+    return pid
+
+def untrack(memory):
+    ## before python 3.13 attaching registers the block, and the attaching process would unlink it on exit.
+    ## Only the POSIX resource tracker keeps such a list, on Windows the block goes when its last handle closes.
+    ## A block this process writes is registered by its writer and stays that way
+    if os.name == 'posix' and writer_pid(memory) != os.getpid():
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(memory._name, 'shared_memory')
+
+def writer_alive(pid):
+    ## False only when the writer is provably gone, which needs a POSIX pid check
+    if os.name != 'posix' or pid <= 0:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class shared_ring():
+
+    def __init__(self, name, capacity=4096, create=True):
+        try:
+            from multiprocessing import shared_memory
+        except ImportError:
+            raise ImportError('shared_ring needs multiprocessing.shared_memory (Python 3.8 or newer)') from None
+        if create:
+            size = header_size + 2*8*capacity
+            try:
+                self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+            except FileExistsError:
+                pid = self.reclaim(shared_memory, name)
+                if pid != None:
+                    raise FileExistsError(f'Shared memory {name} is still written by process {pid}') from None
+                self.memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            try:
+                self.memory = shared_memory.SharedMemory(name=name, track=False)
+            except TypeError:
+                self.memory = shared_memory.SharedMemory(name=name)
+                untrack(self.memory)
+        self.name = name
+        self.owner = create
+        self.header = np.ndarray((4,), dtype=np.int64, buffer=self.memory.buf)
+        if create:
+            self.header[:] = [0, 0, capacity, os.getpid()]
+        self.capacity = int(self.header[2])
+        self.times = np.ndarray((self.capacity,), dtype=np.float64, buffer=self.memory.buf, offset=header_size)
+        self.values = np.ndarray((self.capacity,), dtype=np.float64, buffer=self.memory.buf, offset=header_size + 8*self.capacity)
+
+    @staticmethod
+    def reclaim(shared_memory, name):
+        ## Unlinks a block whose writer has died (a crashed control script) and returns None, otherwise leaves it
+        ## alone and returns the writer's pid. Readers still mapping a reclaimed block keep their copy
+        block = shared_memory.SharedMemory(name=name)
+        pid = writer_pid(block)
+        if writer_alive(pid):
+            untrack(block)
+            block.close()
+            return pid
+        block.close()
+        block.unlink()
+        return None
+
+    @classmethod
+    def attach(cls, name):
+        return cls(name, create=False)
+
+    def append(self, t, value):
+        ## single writer only
+        slot = int(self.header[1]) % self.capacity
+        self.header[0] += 1
+        self.times[slot] = t
+        self.values[slot] = value
+        self.header[1] += 1
+        self.header[0] += 1
+
+    @property
+    def count(self):
+        return int(self.header[1])
+
+    def read(self, start, end=None):
+        ## Copies samples start..end (running sample numbers), retrying while the writer is mid-update
+        while True:
+            sequence = int(self.header[0])
+            if sequence % 2 == 1:
+                time.sleep(0)
+                continue
+            count = int(self.header[1])
+            end_ = count if end == None else min(end, count)
+            start_ = max(start, end_ - self.capacity, 0)
+            slots = np.arange(start_, end_) % self.capacity
+            times, values = self.times[slots], self.values[slots]
+            if int(self.header[0]) == sequence:
+                return times, values, end_
+
+    def latest(self, n=None):
+        count = self.count
+        times, values, _ = self.read(0 if n == None else count - n)
+        return times, values
+
+    def since(self, start):
+        ## New samples after a previous read, returns (times, values, next start)
+        return self.read(start)
+
+    def close(self):
+        ## drop the array views first, the block cannot close while they hold its buffer
+        del self.header, self.times, self.values
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
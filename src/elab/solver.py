@@ -0,0 +1,99 @@
+'''
+Concentration to volume solver. Turns target concentrations into component volumes for a whole
+design-of-experiments grid at once, using the stock concentrations in the conc column of the ports table.
+
+volume = target/stock * total volume, the diluent makes up the rest. Volumes are rounded to whole plunger steps
+of the pump that dispenses each solution (5 mL/12000 steps on the SY08) and a point is flagged infeasible when
+the components overflow the total volume, a volume is below min_volume or rounding moves a concentration by
+more than max_error.
+
+    solver = elab.conc_solver(lab, total_volume=5, diluent='buffer')
+    grid = solver.grid(tempo=[0.0015], ethanol=np.linspace(0.01, 0.3, 30), naoh=np.linspace(0, 0.05, 40))
+    plan = solver.solve(grid)
+    for n in plan.index[plan['feasible']]:
+        lab.mix_dispense(solver.mixture(plan.loc[n]))
+'''
+
+import numpy as np
+import pandas as pd
+
+class conc_solver():
+
+    def __init__(self, lab, total_volume, diluent=None, **kwargs):
+        self.lab = lab
+        self.total_volume = total_volume
+        self.diluent = diluent
+        self.min_volume = 0.01 #smallest volume worth dispensing, in the pump's unit
+        self.max_error = 0.01 #largest relative concentration error from step rounding
+        self.stocks = dict(lab.conc_dict)
+
+        if 'min_volume' in kwargs:
+            self.min_volume = kwargs.get('min_volume')
+        if 'max_error' in kwargs:
+            self.max_error = kwargs.get('max_error')
+        if 'stocks' in kwargs:
+            self.stocks.update(kwargs.get('stocks'))
+
+    def grid(self, **axes):
+        ## Every combination of the given concentrations, as {solution : flat array}
+        mesh = np.meshgrid(*[np.atleast_1d(np.asarray(x, dtype=float)) for x in axes.values()], indexing='ij')
+        return {solution : x.ravel() for solution, x in zip(axes, mesh)}
+
+    def step(self, solution):
+        ## plunger resolution of the pump that would dispense this solution, 0 when the pump does not report one
+        lab = self.lab
+        if not hasattr(lab, 'channels') or len(lab.channels) == 0:
+            return 0.0
+        pump = lab.channel_for(solution, lab.waste_name, lab.cell_name, lab.air_name).pump
+        return pump.step_volume() if hasattr(pump, 'step_volume') else 0.0
+
+    def quantize(self, volumes, steps):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(steps > 0, np.round(volumes/np.where(steps > 0, steps, 1))*steps, volumes)
+
+    def solve(self, targets):
+        ## targets is {solution : concentrations} or a DataFrame with one column per solution
+        targets = pd.DataFrame(targets) if not isinstance(targets, pd.DataFrame) else targets
+        solutions = list(targets.columns)
+        missing = [x for x in solutions if x not in self.stocks]
+        if len(missing) > 0:
+            raise ValueError(f'No stock concentration for {missing}')
+
+        target = targets.to_numpy(dtype=float) #(points, components)
+        stock = np.array([self.stocks[x] for x in solutions])
+        steps = np.array([self.step(x) for x in solutions])
+
+        ideal = target/stock*self.total_volume
+        volumes = self.quantize(ideal, steps)
+        diluent = self.total_volume - volumes.sum(axis=1)
+        if self.diluent != None:
+            diluent = self.quantize(diluent, np.array(self.step(self.diluent)))
+        total = volumes.sum(axis=1) + (diluent if self.diluent != None else 0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            actual = volumes*stock/total[:, None]
+            error = np.where(target > 0, np.abs(actual - target)/target, 0).max(axis=1)
+
+        ## step rounding can push the diluent a hair below zero, anything more is an overflow
+        overflow = diluent < -(steps.max() if len(steps) else 0)
+        too_small = ((volumes > 0) & (volumes < self.min_volume)) | ((ideal > 0) & (volumes == 0))
+        too_small = too_small.any(axis=1)
+        if self.diluent != None:
+            too_small |= (diluent > 0) & (diluent < self.min_volume)
+        else:
+            overflow |= np.abs(diluent) > (steps.max() if len(steps) else 0)
+        feasible = ~overflow & ~too_small & (error <= self.max_error)
+
+        plan = pd.DataFrame(volumes, columns=solutions, index=targets.index)
+        if self.diluent != None:
+            plan[self.diluent] = plan.get(self.diluent, 0) + np.maximum(diluent, 0)
+        plan['error'] = error
+        plan['overflow'] = overflow
+        plan['too_small'] = too_small
+        plan['feasible'] = feasible
+        self.solutions = solutions + ([self.diluent] if self.diluent != None and self.diluent not in solutions else [])
+        return plan
+
+    def mixture(self, row):
+        ## One row of a solved plan as mix components for bundle.mix_dispense()
+        return [self.lab.mix_component(x, float(row[x])) for x in self.solutions if row[x] > 0]
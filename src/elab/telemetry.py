@@ -0,0 +1,176 @@
+'''
+Time-aligned telemetry. Every reading from every instrument is stamped with the same monotonic clock and kept
+per channel in growable NumPy columns, so the values at any moment of the run (each dispense, each CV start)
+come from the buffers with an as-of or interpolated join instead of another serial query.
+
+    hub = elab.telemetry_hub()
+    hub.watch(lab.plate, interval=5)                       # every reading the driver takes, plus one each 5 s
+    lab.pH.start_stream(callback=hub.feed('pH'))           # pushed by an existing sampler
+    lab = elab.bundle([...], telemetry=hub)                # dispenses are marked as events
+    hub.event('CV', filename='CV1')
+    hub.align(hub.events(), how='interpolate')             # events with temperature and pH columns
+'''
+
+import threading
+import time
+import numpy as np
+import pandas as pd
+from .shared import shared_ring
+
+class channel_buffer():
+    ## Two float64 columns that double in size when full
+
+    def __init__(self, name, capacity=1024):
+        self.name = name
+        self.times = np.empty(capacity)
+        self.values = np.empty(capacity)
+        self.count = 0
+        self.mirror = None #shared_ring that gets a copy of every sample
+        self.lock = threading.Lock()
+
+    def append(self, t, value):
+        with self.lock:
+            if self.count == len(self.times):
+                self.times = np.concatenate([self.times, np.empty(len(self.times))])
+                self.values = np.concatenate([self.values, np.empty(len(self.values))])
+            self.times[self.count] = t
+            self.values[self.count] = value
+            self.count += 1
+            if self.mirror != None:
+                self.mirror.append(t, value)
+
+    def arrays(self):
+        with self.lock:
+            return self.times[:self.count], self.values[:self.count]
+
+    def asof(self, t, tolerance=None):
+        ## last sample at or before each time, NaN before the first sample or when older than tolerance
+        times, values = self.arrays()
+        t = np.asarray(t, dtype=float)
+        n = np.searchsorted(times, t, side='right') - 1
+        out = np.where(n >= 0, values[np.clip(n, 0, None)] if len(values) else np.nan, np.nan)
+        if tolerance != None and len(times):
+            out = np.where(t - times[np.clip(n, 0, None)] <= tolerance, out, np.nan)
+        return out
+
+    def interpolate(self, t):
+        ## linear between the samples either side, NaN outside the sampled range
+        times, values = self.arrays()
+        if len(times) == 0:
+            return np.full(np.shape(t), np.nan)
+        return np.interp(t, times, values, left=np.nan, right=np.nan)
+
+
+class telemetry_hub():
+
+    def __init__(self, **kwargs):
+        self.start = time.monotonic()
+        self.channels = {}
+        self.event_list = []
+        self.pollers = []
+        self.subscriptions = [] #(instrument, listener) from watch()
+        self.stop_event = threading.Event()
+        self.errors = {}
+
+    def channel(self, name):
+        if name not in self.channels:
+            self.channels[name] = channel_buffer(name)
+        return self.channels[name]
+
+    def record(self, name, value, t=None):
+        self.channel(name).append(time.monotonic() if t == None else t, value)
+
+    def feed(self, name):
+        ## callback(t, value) for samplers that already timestamp on the monotonic clock
+        return lambda t, value: self.record(name, value, t)
+
+    def event(self, label, t=None, **data):
+        self.event_list.append(dict({'time' : time.monotonic() if t == None else t, 'event' : label}, **data))
+
+    def poll(self, name, read, interval=1, record=True):
+        ## reads a value every interval seconds on its own thread, stamped halfway through the query,
+        ## record=False only triggers the read for drivers that publish it themselves
+        def run():
+            while not self.stop_event.is_set():
+                before = time.monotonic()
+                try:
+                    value = read()
+                except Exception as error:
+                    self.errors[name] = error
+                else:
+                    if record:
+                        self.record(name, value, (before + time.monotonic())/2)
+                self.stop_event.wait(max(interval - (time.monotonic() - before), 0))
+
+        thread = threading.Thread(target=run, name=f'telemetry {name}', daemon=True)
+        self.pollers.append(thread)
+        thread.start()
+
+    def watch(self, inst, interval=None, name=None):
+        ## Records every reading the driver takes anyway (measure(), streams, position queries), so watching adds
+        ## no serial traffic. interval= also asks for a reading that often, through the driver's own locked query;
+        ## syringe pumps then report the position they already track without a query, the Legato100 its volume
+        readers = {'hotplate' : ('temperature', lambda: inst.query_temp(), False),
+                   'pH' : ('pH_voltage', lambda: inst.send_comm(), False),
+                   'balance' : ('mass', lambda: inst.query_mass(), False),
+                   'MFC' : ('flow', lambda: inst.read_data(), False),
+                   'pump' : ('position', lambda: inst.current_position, True),
+                   'pumpvalve' : ('position', lambda: inst.current_position, True)}
+        if inst.type not in readers:
+            raise ValueError(f'No telemetry reading for {inst.type}')
+        default, read, record = readers[inst.type]
+        if inst.type == 'pump' and not hasattr(inst, 'current_position'):
+            default, read, record = 'volume', lambda: inst.status(), False
+        channel = name if name != None else default
+        listener = inst.subscribe(lambda reading, t, value: self.record(channel if reading == default else reading, value, t))
+        self.subscriptions.append((inst, listener))
+        if interval != None:
+            self.poll(channel, read, interval, record)
+
+    def stop(self):
+        self.stop_event.set()
+        for thread in self.pollers:
+            thread.join()
+        self.pollers = []
+        for inst, listener in self.subscriptions:
+            inst.unsubscribe(listener)
+        self.subscriptions = []
+
+    def share(self, *names, **kwargs):
+        ## Mirrors channels into shared-memory rings named prefix + channel for readers in other processes
+        prefix = kwargs.get('prefix', 'elab_')
+        capacity = kwargs.get('capacity', 4096)
+        for name in names:
+            buffer = self.channel(name)
+            buffer.mirror = shared_ring(prefix + name, capacity)
+            times, values = buffer.arrays()
+            for t, value in zip(times[-capacity:], values[-capacity:]):
+                buffer.mirror.append(t, value)
+        return [prefix + name for name in names]
+
+    def close(self):
+        self.stop()
+        for buffer in self.channels.values():
+            if buffer.mirror != None:
+                buffer.mirror.close()
+                buffer.mirror = None
+
+    def events(self):
+        return pd.DataFrame(self.event_list)
+
+    def frame(self, name):
+        times, values = self.channels[name].arrays()
+        return pd.DataFrame({'time' : times - self.start, name : values})
+
+    def align(self, timeline, how='asof', channels=None, tolerance=None):
+        ## Adds one column per channel to a timeline (DataFrame with a monotonic 'time' column, or the times themselves)
+        if isinstance(timeline, pd.DataFrame):
+            df = timeline.copy()
+        else:
+            df = pd.DataFrame({'time' : np.asarray(timeline, dtype=float)})
+        t = df['time'].to_numpy(dtype=float) if len(df) else np.empty(0)
+        for name in (channels if channels != None else list(self.channels)):
+            buffer = self.channels[name]
+            df[name] = buffer.interpolate(t) if how == 'interpolate' else buffer.asof(t, tolerance)
+        df['elapsed'] = t - self.start
+        return df
@@ -0,0 +1,186 @@
+'''
+Continuous-infusion titration. The Legato100 infuses titrant at a constant rate while the pH meter is sampled
+on a background thread, the volume added at each sample is rate * time since the infusion started. One sweep
+gives the whole titration curve instead of a step, wait and measure loop per point.
+
+    titration = elab.infusion_titration(legato, lab.pH, rate=0.1, unit='ml/min')
+    curve = titration.run(15)     # 15 mL over 150 minutes
+    curve[['volume','pH']].to_csv('curve.csv')
+
+titration_analyzer follows a titration point by point. A local quadratic over the last few points, fitted with the
+volumes centred and scaled on the window, gives smoothed first and second derivatives in constant time per point;
+equivalence points (peaks in dpH/dV where the second derivative changes sign) and buffer regions (flat stretches)
+are raised as events.
+
+    analyzer = elab.titration_analyzer(window=7)
+    analyzer.on('equivalence', lambda event: print(event))
+    for x in range(150):
+        lab.dispense('naoh', 0.1)
+        analyzer.add(0.1*(x+1), lab.pH.measure(delay=30))
+        if analyzer.resolved(3):
+            break
+'''
+
+import time
+from collections import deque
+import numpy as np
+
+time_units = {'s' : 1, 'sec' : 1, 'min' : 60, 'hr' : 3600, 'h' : 3600}
+
+class infusion_titration():
+
+    def __init__(self, pump, pH, **kwargs):
+        self.pump = pump
+        self.pH = pH
+        self.rate = 0.1
+        self.unit = 'ml/min'
+        self.interval = 0 #seconds between pH samples, 0 = as fast as the meter answers
+        self.hold = 0 #keep sampling this long after the infusion ends
+        self.callback = None #called with (timestamp, voltage) as samples arrive
+        self.verbose = kwargs.get('verbose', pump.verbose)
+
+        for key in ['rate','unit','interval','hold','callback']:
+            if key in kwargs:
+                setattr(self, key, kwargs.get(key))
+
+    def rate_per_second(self):
+        volume_unit, time_unit = self.unit.split('/')
+        return self.rate/time_units[time_unit.lower()]
+
+    def volume_at(self, t):
+        ## volume delivered at monotonic time(s) t, flat before the start and after the target volume
+        elapsed = (t - self.start).clip(0, self.duration) if hasattr(t, 'clip') else min(max(t - self.start, 0), self.duration)
+        return elapsed*self.rate_per_second()
+
+    def run(self, volume, **kwargs):
+        for key in ['rate','unit','hold']:
+            if key in kwargs:
+                setattr(self, key, kwargs.get(key))
+        volume_unit = self.unit.split('/')[0]
+        self.duration = volume/self.rate_per_second()
+
+        ## the Legato reports a rejected rate in its return value, the volume axis would be wrong if it kept the old one
+        if self.pump.set_rate(self.rate, self.unit) != None:
+            raise ValueError(f'{self.rate} {self.unit} is out of range for {self.pump.model} on {self.pump.com_port}')
+        self.pump.set_target_volume(volume, volume_unit)
+        self.pH.start_stream(interval=self.interval, callback=self.callback)
+        try:
+            ## the clock starts when the run command has gone out, irun infuses whatever direction the pump last ran
+            self.pump.compile_cmd(command='infuse')
+            self.start = time.monotonic()
+            if self.verbose == True:
+                print(f'infusing {volume} {volume_unit} at {self.rate} {self.unit}, {self.duration/60:.1f} min')
+            ## wakes early on an abort or when the pH sampler fails, either way the pump is stopped
+            end = self.start + self.duration + self.hold
+            while time.monotonic() < end and self.pH.stream_error == None:
+                self.pump.abort_event.wait(min(end - time.monotonic(), 0.2))
+                self.pump.check_abort()
+            if self.pH.stream_error != None:
+                raise RuntimeError(f'pH sampling stopped: {self.pH.stream_error!r}') from self.pH.stream_error
+        except BaseException:
+            self.pump.stop()
+            raise
+        finally:
+            self.curve = self.pH.stop_stream()
+
+        self.curve['volume'] = self.volume_at(self.curve['time'].to_numpy())
+        self.curve['time'] = self.curve['time'] - self.start
+        return self.curve
+
+
+class titration_analyzer():
+
+    def __init__(self, **kwargs):
+        self.window = 7 #points in the local fit, odd so the derivatives sit on a measured point
+        self.min_slope = 1.0 #pH/mL a dpH/dV peak must reach to count as an equivalence point
+        self.buffer_slope = 0.5 #pH/mL below which the curve counts as buffered
+        self.buffer_points = 3 #consecutive flat points before a buffer region is reported
+
+        for key in ['window','min_slope','buffer_slope','buffer_points']:
+            if key in kwargs:
+                setattr(self, key, kwargs.get(key))
+
+        self.points = deque()
+        self.derivatives = [] #(volume, pH, dpH/dV, d2pH/dV2) at the window centres
+        self.events = []
+        self.callbacks = {}
+        self.flat = []
+        self.buffered = False
+
+    def on(self, event, callback):
+        ## event is 'equivalence', 'buffer_start', 'buffer_end' or 'any'
+        self.callbacks.setdefault(event, []).append(callback)
+
+    def fit(self):
+        ## quadratic in u = (x - centre)/half width, so the normal equations stay well conditioned at any volume
+        ## and nothing accumulates between windows. Returns dpH/dV and d2pH/dV2 at the centre point
+        x, y = np.array(self.points).T
+        centre = x[self.window//2]
+        scale = np.abs(x - centre).max()
+        if scale <= 0:
+            return None
+        u = (x - centre)/scale
+        coefficients, residuals, rank, singular = np.linalg.lstsq(np.vander(u, 3, increasing=True), y, rcond=None)
+        if rank < 3:
+            return None
+        a, b, c = coefficients
+        return float(b/scale), float(2*c/scale**2)
+
+    def add(self, volume, pH):
+        ## Adds one reading and returns the events it completed
+        self.points.append((float(volume), float(pH)))
+        if len(self.points) > self.window:
+            self.points.popleft()
+        if len(self.points) < self.window:
+            return []
+
+        derivatives = self.fit()
+        if derivatives == None:
+            return []
+        x, y = self.points[self.window//2]
+        self.derivatives.append((x, y) + derivatives)
+        return self.detect()
+
+    def emit(self, event, **data):
+        event = dict({'event' : event}, **data)
+        self.events.append(event)
+        for callback in self.callbacks.get(event['event'], []) + self.callbacks.get('any', []):
+            callback(event)
+        return event
+
+    def detect(self):
+        found = []
+        volume, pH, slope, curvature = self.derivatives[-1]
+
+        ## equivalence: dpH/dV peaked at the previous centre, placed where d2pH/dV2 crosses zero
+        if len(self.derivatives) >= 3:
+            (v0, p0, s0, c0), (v1, p1, s1, c1) = self.derivatives[-3], self.derivatives[-2]
+            if s1 >= self.min_slope and s1 > s0 and s1 >= slope:
+                if c1 > 0 >= curvature:
+                    va, pa, ca, vb, pb, cb = v1, p1, c1, volume, pH, curvature
+                else:
+                    va, pa, ca, vb, pb, cb = v0, p0, c0, v1, p1, c1
+                f = ca/(ca - cb) if ca != cb and ca*cb <= 0 else 0.5 #linear zero crossing of the curvature
+                found.append(self.emit('equivalence', volume=va + f*(vb - va), pH=pa + f*(pb - pa), slope=s1))
+
+        ## buffer regions: runs of flat points, the flattest point estimates the pKa
+        if abs(slope) < self.buffer_slope:
+            self.flat.append((volume, pH, abs(slope)))
+            if not self.buffered and len(self.flat) >= self.buffer_points:
+                self.buffered = True
+                found.append(self.emit('buffer_start', volume=self.flat[0][0], pH=self.flat[0][1]))
+        else:
+            if self.buffered:
+                flattest = min(self.flat, key=lambda x: x[2])
+                found.append(self.emit('buffer_end', start=self.flat[0][0], volume=self.flat[-1][0],
+                                       pH=flattest[1], pKa_volume=flattest[0]))
+            self.buffered = False
+            self.flat = []
+        return found
+
+    def equivalence_points(self):
+        return [x for x in self.events if x['event'] == 'equivalence']
+
+    def resolved(self, n):
+        ## True once n equivalence points have been seen
+        return len(self.equivalence_points()) >= n
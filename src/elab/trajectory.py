@@ -0,0 +1,152 @@
+'''
+Setpoint trajectories for AlicatMFC. A setpoint_profile is a list of steps, ramps and holds; the
+trajectory_executor streams one profile per MFC from dedicated threads ticking on a monotonic clock. Every tick
+sends the commanded setpoint (or just polls when it has not changed) and logs the measured flow from the data
+frame the MFC answers with, together with how late the tick was. If a thread fails (a bad reply, a serial
+error, an abort) its MFC is sent to the safe setpoint and join() raises the error.
+
+    co2 = elab.setpoint_profile(0).ramp(50, 60).hold(120).step(0)
+    n2 = elab.setpoint_profile(100).hold(60).ramp(50, 120).step(100)
+    run = elab.trajectory_executor(period=0.1)
+    run.add(mfc_co2, co2)
+    run.add(mfc_n2, n2)
+    log = run.run()        # time, mfc, commanded, measured, error
+    print(run.report())
+'''
+
+import threading
+import time
+from bisect import bisect_right
+import numpy as np
+import pandas as pd
+
+class setpoint_profile():
+
+    def __init__(self, start=0):
+        self.points = [(0.0, float(start))] #(seconds, setpoint) corners, linear in between
+
+    @property
+    def duration(self):
+        return self.points[-1][0]
+
+    def step(self, value):
+        self.points.append((self.duration, float(value)))
+        return self
+
+    def hold(self, seconds):
+        self.points.append((self.duration + seconds, self.points[-1][1]))
+        return self
+
+    def ramp(self, value, seconds):
+        self.points.append((self.duration + seconds, float(value)))
+        return self
+
+    def value(self, t):
+        ## setpoint at t seconds, the latest corner wins on a step
+        times = [x[0] for x in self.points]
+        n = bisect_right(times, t) - 1
+        if n < 0:
+            return self.points[0][1]
+        if n >= len(self.points) - 1:
+            return self.points[-1][1]
+        (t0, v0), (t1, v1) = self.points[n], self.points[n+1]
+        return v0 + (v1 - v0)*(t - t0)/(t1 - t0)
+
+
+class trajectory_executor():
+
+    def __init__(self, **kwargs):
+        self.period = 0.1 #seconds between ticks
+        self.digits = 3 #setpoint rounding, ticks with an unchanged setpoint only poll
+        self.callback = None #called with every log row
+        self.safe_setpoint = 0 #setpoint an MFC is sent to when its thread fails
+        self.jobs = []
+        self.log = []
+        self.errors = {} #name -> exception that ended that MFC's thread
+        self.lock = threading.Lock()
+
+        for key in ['period','digits','callback','safe_setpoint']:
+            if key in kwargs:
+                setattr(self, key, kwargs.get(key))
+
+    def add(self, mfc, profile, name=None):
+        self.jobs.append((mfc, profile, name if name != None else mfc.com_port))
+
+    def run(self, wait=True):
+        self.log = []
+        self.errors = {}
+        self.stop_event = threading.Event()
+        self.start = time.monotonic() + self.period #first tick shared by every MFC
+
+        def stream(mfc, profile, name):
+            try:
+                follow(mfc, profile, name)
+            except BaseException as error:
+                with self.lock:
+                    self.errors[name] = error
+                try:
+                    mfc.setpoint_data(self.safe_setpoint)
+                except Exception as safe_error:
+                    with self.lock:
+                        self.errors[f'{name} safe setpoint'] = safe_error
+
+        def follow(mfc, profile, name):
+            last = None
+            ticks = int(np.ceil(profile.duration/self.period)) + 1
+            for k in range(ticks):
+                planned = self.start + k*self.period
+                delay = planned - time.monotonic()
+                if delay > 0 and self.stop_event.wait(delay):
+                    return
+                if self.stop_event.is_set():
+                    return
+                mfc.check_abort()
+                actual = time.monotonic()
+                if actual - planned > self.period:
+                    ## more than a whole tick late, skip to the next one rather than bunching up
+                    with self.lock:
+                        self.log.append({'time' : k*self.period, 'mfc' : name, 'commanded' : None, 'measured' : None,
+                                         'error' : actual - planned, 'missed' : True})
+                    continue
+                commanded = round(profile.value(min(k*self.period, profile.duration)), self.digits)
+                data = mfc.setpoint_data(commanded) if commanded != last else mfc.read_data()
+                last = commanded
+                row = {'time' : k*self.period, 'mfc' : name, 'commanded' : commanded, 'measured' : data['mass_flow'],
+                       'error' : actual - planned, 'missed' : False}
+                with self.lock:
+                    self.log.append(row)
+                if self.callback != None:
+                    self.callback(row)
+
+        self.threads = [threading.Thread(target=stream, args=job, name=f'{job[2]} trajectory', daemon=True) for job in self.jobs]
+        for thread in self.threads:
+            thread.start()
+        if wait:
+            return self.join()
+        return self.threads
+
+    def join(self):
+        ## Waits for every MFC, then raises the first error if a thread failed
+        for thread in self.threads:
+            thread.join()
+        for name, error in self.errors.items():
+            raise error
+        return self.frame()
+
+    def stop(self):
+        self.stop_event.set()
+        return self.join()
+
+    def frame(self):
+        with self.lock:
+            return pd.DataFrame(list(self.log), columns=['time','mfc','commanded','measured','error','missed']).sort_values(['time','mfc'], ignore_index=True)
+
+    def report(self):
+        ## Tick timing error per MFC in seconds
+        df = self.frame()
+        report = {}
+        for name, group in df.groupby('mfc'):
+            error = group['error'].abs()
+            report[name] = {'ticks' : len(group), 'missed' : int(group['missed'].sum()), 'mean' : float(error.mean()),
+                            'p95' : float(error.quantile(0.95)), 'max' : float(error.max())}
+        return report
@@ -0,0 +1,224 @@
+'''
+Transports the instruments talk through. All of them offer the pyserial calls the drivers use
+(write, read, read_until, readline, read_all, in_waiting, reset_input_buffer, setRTS, close), plus a
+per-call timeout on the blocking reads and read_nonblocking().
+
+    serial_transport    local serial port, 'COM8' or '/dev/ttyUSB0'
+    tcp_transport       raw TCP socket to a serial-to-Ethernet server (ser2net etc.), 'tcp://host:port'
+    loopback_transport  in-process stand-in, 'loop://', replies come from an optional responder callable
+'''
+
+import select
+import serial
+import socket
+import threading
+import time
+import abc
+
+class base_transport(abc.ABC):
+
+    def __init__(self, timeout=1):
+        self.timeout = timeout
+        self.buffer = bytearray()
+        self.is_open = True
+
+    @abc.abstractmethod
+    def _receive(self, timeout):
+        ## Return whatever bytes arrive within timeout seconds (0 = don't block), b'' if none
+        pass
+
+    @abc.abstractmethod
+    def _send(self, data):
+        pass
+
+    def _pull(self):
+        data = self._receive(0)
+        while data:
+            self.buffer.extend(data)
+            data = self._receive(0)
+
+    def write(self, data):
+        return self._send(bytes(data))
+
+    def read(self, size=1, timeout=None):
+        deadline = time.monotonic() + (self.timeout if timeout == None else timeout)
+        while len(self.buffer) < size:
+            data = self._receive(max(0, deadline - time.monotonic()))
+            if data:
+                self.buffer.extend(data)
+            elif time.monotonic() >= deadline:
+                break
+        out = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return out
+
+    def read_until(self, expected=b'\n', size=None, timeout=None):
+        deadline = time.monotonic() + (self.timeout if timeout == None else timeout)
+        while True:
+            end = self.buffer.find(expected)
+            if end >= 0:
+                end += len(expected)
+                break
+            if size != None and len(self.buffer) >= size:
+                end = size
+                break
+            data = self._receive(max(0, deadline - time.monotonic()))
+            if data:
+                self.buffer.extend(data)
+            elif time.monotonic() >= deadline:
+                end = len(self.buffer)
+                break
+        if size != None:
+            end = min(end, size)
+        out = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        return out
+
+    def readline(self, size=None, timeout=None):
+        return self.read_until(b'\n', size, timeout)
+
+    def read_nonblocking(self):
+        self._pull()
+        out = bytes(self.buffer)
+        self.buffer.clear()
+        return out
+
+    def read_all(self):
+        return self.read_nonblocking()
+
+    @property
+    def in_waiting(self):
+        self._pull()
+        return len(self.buffer)
+
+    def reset_input_buffer(self):
+        self.read_nonblocking()
+
+    def setRTS(self, value):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class serial_transport(base_transport):
+
+    def __init__(self, com_port, baud_rate=9600, timeout=1, **kwargs):
+        super().__init__(timeout)
+        ## the port timeout is set once to a short poll, the deadlines of the blocking reads are kept by the base class
+        self.poll_interval = kwargs.get('poll_interval', 0.01)
+        self.ser = serial.Serial(port=com_port, baudrate=baud_rate, timeout=self.poll_interval, rtscts=kwargs.get('rtscts', False))
+
+    def _receive(self, timeout):
+        ## everything already buffered in one read, otherwise wait up to one poll for the first byte and take the rest with it
+        waiting = self.ser.in_waiting
+        if waiting:
+            return self.ser.read(waiting)
+        if timeout <= 0:
+            return b''
+        data = self.ser.read(1)
+        if data:
+            waiting = self.ser.in_waiting
+            if waiting:
+                data += self.ser.read(waiting)
+        return data
+
+    def _pull(self):
+        waiting = self.ser.in_waiting
+        if waiting:
+            self.buffer.extend(self.ser.read(waiting))
+
+    def _send(self, data):
+        return self.ser.write(data)
+
+    def setRTS(self, value):
+        self.ser.setRTS(value)
+
+    def close(self):
+        self.ser.close()
+        self.is_open = False
+
+
+class tcp_transport(base_transport):
+
+    def __init__(self, host, port, timeout=1, **kwargs):
+        super().__init__(timeout)
+        self.address = (host, int(port))
+        self.sock = socket.create_connection(self.address, timeout=kwargs.get('connect_timeout', 5))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) #commands are tiny, don't wait to coalesce them
+        self.sock.setblocking(False)
+
+    def _receive(self, timeout):
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return b''
+        data = self.sock.recv(4096)
+        if data == b'':
+            raise ConnectionError(f'{self.address[0]}:{self.address[1]} closed the connection')
+        return data
+
+    def _send(self, data):
+        ## the socket is non-blocking, so keep sending whatever fits until all of it is out or the timeout passes
+        view = memoryview(data)
+        deadline = time.monotonic() + self.timeout
+        while len(view):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'{self.address[0]}:{self.address[1]} write timed out with {len(view)} bytes unsent')
+            _, writable, _ = select.select([], [self.sock], [], remaining)
+            if not writable:
+                continue
+            try:
+                sent = self.sock.send(view)
+            except (BlockingIOError, InterruptedError):
+                continue
+            view = view[sent:]
+        return len(data)
+
+    def close(self):
+        self.sock.close()
+        self.is_open = False
+
+
+class loopback_transport(base_transport):
+    ## Writes go to responder(data), whose return value becomes readable. Without a responder writes are echoed
+
+    def __init__(self, responder=None, timeout=1, **kwargs):
+        super().__init__(timeout)
+        self.responder = responder
+        self.incoming = bytearray()
+        self.written = []
+        self.condition = threading.Condition()
+
+    def feed(self, data):
+        ## Inject bytes as if the device had sent them
+        with self.condition:
+            self.incoming.extend(data)
+            self.condition.notify_all()
+
+    def _receive(self, timeout):
+        with self.condition:
+            if not self.incoming and timeout > 0:
+                self.condition.wait(timeout)
+            data = bytes(self.incoming)
+            self.incoming.clear()
+        return data
+
+    def _send(self, data):
+        self.written.append(data)
+        reply = self.responder(data) if self.responder != None else data
+        if reply:
+            self.feed(reply)
+        return len(data)
+
+
+def open_transport(com_port, baud_rate=9600, timeout=1, **kwargs):
+    ## Picks the back-end from the port string, an already built transport can be passed with transport=
+    if 'transport' in kwargs:
+        return kwargs.get('transport')
+    if str(com_port).startswith('tcp://'):
+        host, port = com_port[len('tcp://'):].rsplit(':', 1)
+        return tcp_transport(host, port, timeout, **kwargs)
+    if str(com_port).startswith('loop://'):
+        return loopback_transport(kwargs.get('responder'), timeout)
+    return serial_transport(com_port, baud_rate, timeout, **kwargs)
@@ -0,0 +1,118 @@
+import sys
+import threading
+import time
+import pytest
+import elab
+from elab.codec import runze_codec
+
+
+def idle(data):
+    ## every Runze command is answered with an idle status frame
+    return bytes(runze_codec().encode(0x00))
+
+
+@pytest.fixture
+def valves(monkeypatch):
+    monkeypatch.setattr(sys.modules['elab.SV07'].time, 'sleep', lambda seconds: None)
+    return [elab.SV07(f'loop://{n}', responder=idle, timeout=0.1) for n in range(2)]
+
+
+def stops(valve):
+    ## strong stop frames written to a valve
+    return [frame for frame in valve.ser.written if frame[2] == valve.command_dict['strong_stop']]
+
+
+def test_trigger_stops_every_port(valves):
+    stop = elab.emergency_stop(valves)
+    for valve in valves:
+        valve.position = 3
+    report = stop.trigger('test')
+    assert report['missing'] == []
+    assert sorted(report['ports']) == ['loop://0', 'loop://1']
+    for valve in valves:
+        assert len(stops(valve)) == 1
+        assert valve.position == None
+        with pytest.raises(elab.run_aborted):
+            valve.check_abort()
+
+
+def test_reset_before_trigger_fires_once(valves):
+    stop = elab.emergency_stop(valves)
+    stop.reset()
+    stop.reset()
+    stop.trigger('test')
+    time.sleep(0.1)
+    assert [len(stops(valve)) for valve in valves] == [1, 1]
+
+
+def test_reset_clears_the_flag_and_rearms(valves):
+    stop = elab.emergency_stop(valves)
+    stop.trigger('first')
+    stop.reset()
+    valves[0].check_abort()
+    report = stop.trigger('second')
+    assert report['reason'] == 'second' and report['missing'] == []
+    assert [len(stops(valve)) for valve in valves] == [2, 2]
+
+
+def test_abort_flag_is_per_bundle(valves):
+    stop = elab.emergency_stop(valves[:1])
+    stop.trigger('test')
+    with pytest.raises(elab.run_aborted):
+        valves[0].check_abort()
+    valves[1].check_abort()
+    assert len(stops(valves[1])) == 0
+
+
+def test_stop_waits_for_the_exchange_in_progress(valves):
+    stop = elab.emergency_stop(valves[:1])
+    held = threading.Event()
+
+    def exchange():
+        with valves[0].io_lock:
+            held.set()
+            threading.Event().wait(0.2) #time.sleep is patched out by the fixture
+
+    thread = threading.Thread(target=exchange)
+    thread.start()
+    held.wait()
+    report = stop.trigger('test')
+    thread.join()
+    assert report['ports']['loop://0']['sent'] >= 0.15
+    assert report['ports']['loop://0']['error'] == None
+    ## the interrupted driver gives up at its next command instead of moving on
+    with pytest.raises(elab.run_aborted):
+        valves[0].port(2)
+
+
+def test_trigger_reentrant_from_signal_handler(valves):
+    ## a second Ctrl-C can arrive while the main thread is inside trigger() or wait()
+    stop = elab.emergency_stop(valves)
+    with stop.lock:
+        stop.trigger('SIGINT', wait=False)
+        assert stop.trigger('SIGINT', wait=False) == None
+    assert stop.wait()['missing'] == []
+
+
+def test_silent_syringe_query_gives_up_on_trigger():
+    ## a pump that stopped answering would otherwise keep query_position retrying for max_silent port timeouts
+    pump = elab.SY01B('loop://dt', responder=lambda data: b'', timeout=0.2)
+    pump.max_silent = 50
+    outcome = []
+
+    def query():
+        try:
+            pump.query_position()
+        except Exception as error:
+            outcome.append(error)
+
+    thread = threading.Thread(target=query)
+    thread.start()
+    threading.Event().wait(0.3)
+    stop = elab.emergency_stop([pump], ack_timeout=0.1)
+    begin = time.monotonic()
+    stop.trigger('test')
+    thread.join(2)
+    assert not thread.is_alive()
+    assert time.monotonic() - begin < 1
+    assert isinstance(outcome[0], elab.run_aborted)
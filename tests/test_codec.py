@@ -0,0 +1,83 @@
+import threading
+import pytest
+import elab
+from elab.codec import runze_codec, dt_codec, runze_valid
+
+
+def runze_reply(status=0x00, address=0x00):
+    ## replies carry the status in the command byte
+    return bytes(runze_codec(address).encode(status))
+
+
+def test_runze_encode_checksum():
+    codec = runze_codec(0x01)
+    frame = codec.encode(0x44, 3, 0)
+    assert runze_valid(frame)
+    assert frame[:6] == bytes([0xCC, 0x01, 0x44, 3, 0, 0xDD])
+
+
+def test_runze_encode_returns_new_frames():
+    codec = runze_codec()
+    first = codec.encode(0x44, 1)
+    second = codec.encode(0x44, 2)
+    assert first[3] == 1 and second[3] == 2
+
+
+def test_runze_encode_concurrent():
+    codec = runze_codec()
+    bad = []
+
+    def encode(n):
+        for x in range(2000):
+            frame = codec.encode(0x4E, n, x % 256)
+            if frame[3] != n or frame[4] != x % 256 or not runze_valid(frame):
+                bad.append(frame)
+
+    threads = [threading.Thread(target=encode, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert bad == []
+
+
+def test_runze_read_frame_resyncs():
+    codec = runze_codec()
+    port = elab.loopback_transport(timeout=0.2)
+    port.feed(b'\x01\xCC\x02' + runze_reply())
+    assert codec.read_frame(port) == runze_reply()
+    assert codec.resyncs > 0
+
+
+def test_runze_read_frame_timeout():
+    port = elab.loopback_transport(timeout=0.05)
+    assert runze_codec().read_frame(port) == b''
+
+
+def test_dt_read_reply_skips_noise():
+    codec = dt_codec()
+    port = elab.loopback_transport(timeout=0.2)
+    port.feed(b'noise\x03/0`1200\x03\r\n')
+    assert codec.read_reply(port) == b'/0`1200\x03'
+    assert codec.status(b'/0`1200\x03') == (ord('`'), '1200')
+
+
+def test_dt_read_reply_bounded():
+    codec = dt_codec(max_skips=3)
+    port = elab.loopback_transport(timeout=0.2)
+    port.feed(b'x\x03'*100)
+    assert codec.read_reply(port) == b''
+    assert codec.resyncs == 4
+
+
+def test_check_movement_times_out_on_silent_device():
+    pump = elab.SY08('loop://', responder=lambda data: b'', timeout=0.01)
+    with pytest.raises(TimeoutError):
+        pump.check_movement()
+
+
+def test_check_movement_waits_for_idle():
+    replies = iter([runze_reply(0x01), runze_reply(0x01), runze_reply(0x00)])
+    valve = elab.SV07('loop://', responder=lambda data: next(replies), timeout=0.1)
+    valve.check_movement()
+    assert len(valve.ser.written) == 3
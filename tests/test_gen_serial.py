@@ -0,0 +1,40 @@
+import threading
+import elab
+
+
+def sensor(data):
+    ## answers 'T?' with a reading, everything else is ignored
+    return b'T=21.5\r\n' if data == b'T?' else b''
+
+
+def make():
+    return elab.gen_serial('loop://sensor', responder=sensor, timeout=0.2)
+
+
+def test_readline_same_with_and_without_reader():
+    direct, background = make(), make()
+    background.start_reader()
+    try:
+        for port in [direct, background]:
+            port.ser.feed(b'hello\r\nworld\n')
+        assert [direct.readline() for x in range(2)] == ['hello\r\n', 'world\n']
+        assert [background.readline() for x in range(2)] == ['hello\r\n', 'world\n']
+        assert direct.readline() == background.readline() == ''
+    finally:
+        background.stop_reader()
+
+
+def test_handlers_get_stripped_lines():
+    port = make()
+    lines, seen = [], threading.Event()
+    port.on('^P=', lambda line, match: lines.append(line) or seen.set())
+    port.start_reader()
+    try:
+        port.ser.feed(b'P=1.0\r\nother\r\n')
+        assert seen.wait(1)
+        assert lines == ['P=1.0']
+        assert port.readline() == 'other\r\n'
+        line, match = port.request('T?', r'T=([\d.]+)')
+        assert line == 'T=21.5' and match.group(1) == '21.5'
+    finally:
+        port.stop_reader()
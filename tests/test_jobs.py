@@ -0,0 +1,63 @@
+import json
+import threading
+import pytest
+import elab
+
+
+def square(x):
+    return x*x
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = elab.job_pool(kind='thread', max_workers=2, log=str(tmp_path / 'jobs.jsonl'))
+    yield pool
+    pool.shutdown()
+
+
+def test_repeated_labels_get_suffixes(pool):
+    futures = [pool.submit('CV1', square, x) for x in range(3)]
+    assert [x.label for x in futures] == ['CV1', 'CV1_2', 'CV1_3']
+    assert pool.gather(timeout=5) == {'CV1' : 0, 'CV1_2' : 1, 'CV1_3' : 4}
+
+
+def test_gather_returns_each_job_once(pool):
+    pool.submit('a', square, 2)
+    assert pool.gather(timeout=5) == {'a' : 4}
+    assert pool.futures == [] and pool.completed == []
+    assert pool.gather(timeout=5) == {}
+    pool.submit('b', square, 3)
+    assert pool.gather(timeout=5) == {'b' : 9}
+
+
+def test_failed_job_raises_in_gather(pool):
+    pool.submit('bad', fail, 'no peaks')
+    with pytest.raises(ValueError, match='no peaks'):
+        pool.gather(timeout=5)
+    pool.shutdown() #joins the workers, so the done callbacks have run
+    assert pool.log[-1]['error'] == 'ValueError: no peaks'
+
+
+def test_gather_timeout(pool):
+    release = threading.Event()
+    pool.submit('slow', release.wait, 5)
+    with pytest.raises(TimeoutError):
+        pool.gather(timeout=0.05)
+    release.set()
+    assert pool.gather(timeout=5) == {'slow' : True}
+
+
+def test_finished_jobs_are_logged(pool):
+    pool.submit('a', square, 4)
+    pool.submit('b', fail, 'oops')
+    with pytest.raises(ValueError):
+        pool.gather(timeout=5)
+    pool.shutdown()
+    with open(pool.log_path) as f:
+        entries = {x['label'] : x for x in map(json.loads, f)}
+    assert entries['a']['result'] == 16 and entries['a']['duration'] >= 0
+    assert entries['b']['error'] == 'ValueError: oops'
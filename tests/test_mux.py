@@ -0,0 +1,68 @@
+import pytest
+import elab
+
+
+def relay(data):
+    ## the MUX acknowledges every <n> command with a line
+    return b'ok\r\n' * data.count(b'<')
+
+
+def silent(data):
+    return b''
+
+
+@pytest.fixture
+def mux():
+    return elab.MUX8('loop://mux', responder=relay, timeout=0.1)
+
+
+def record(mux):
+    ## order of writes and acknowledgement reads on the port
+    events = []
+    write, readline = mux.ser.write, mux.ser.readline
+    mux.ser.write = lambda data: events.append(('write', data)) or write(data)
+    mux.ser.readline = lambda: events.append(('read',)) or readline()
+    return events
+
+
+def test_pair_is_one_write(mux):
+    results = mux.scan([('pair', 1, 2), ('electrode', 3)], lambda step, mux: step[0])
+    assert mux.ser.written == [b'<14><16>', b'<13>']
+    assert [x[2] for x in results] == ['pair', 'electrode']
+    assert mux.ser.readline() == b''
+
+
+def test_settle_pipelines_acks(mux):
+    events = record(mux)
+    mux.scan([('electrode', 1), ('electrode', 2)], lambda step, mux: events.append(('acquire', step[1])), settle=0.01)
+    ## the first step's acknowledgement is read after the second switch has gone out
+    assert events == [('write', b'<11>'), ('acquire', 1), ('write', b'<12>'), ('read',), ('acquire', 2), ('read',)]
+
+
+def test_no_settle_waits_for_acks(mux):
+    events = record(mux)
+    mux.scan([('electrode', 1), ('electrode', 2)], lambda step, mux: events.append(('acquire', step[1])))
+    assert events == [('write', b'<11>'), ('read',), ('acquire', 1), ('write', b'<12>'), ('read',), ('acquire', 2)]
+
+
+def test_missing_ack_raises(mux):
+    mux.ser.responder = silent
+    with pytest.raises(TimeoutError):
+        mux.scan([('electrode', 1)], lambda step, mux: None)
+    with pytest.raises(TimeoutError):
+        mux.scan([('electrode', 1), ('electrode', 2)], lambda step, mux: None, settle=0.01)
+
+
+def test_failed_acquire_drains_acks(mux):
+    def acquire(step, mux):
+        raise RuntimeError('potentiostat')
+    with pytest.raises(RuntimeError):
+        mux.scan([('electrode', 1)], acquire, settle=0.01)
+    assert mux.ser.readline() == b''
+
+
+def test_scan_stops_on_abort(mux):
+    mux.abort_event.set()
+    with pytest.raises(elab.run_aborted):
+        mux.scan([('electrode', 1)], lambda step, mux: None)
+    assert mux.ser.written == []
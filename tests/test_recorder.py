@@ -0,0 +1,60 @@
+import sys
+import pytest
+import elab
+from elab.codec import runze_codec
+
+
+def idle(data):
+    ## every Runze command is answered with an idle status frame
+    return bytes(runze_codec().encode(0x00))
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(sys.modules['elab.SV07'].time, 'sleep', lambda seconds: None)
+
+
+def record(path):
+    log = elab.traffic_log(str(path))
+    valve = elab.SV07('loop://valve', responder=idle, timeout=0.1, record=log)
+    valve.port(3)
+    valve.close()
+    log.close()
+    return valve
+
+
+def test_records_every_write_and_read(tmp_path):
+    record(tmp_path / 'run.elog')
+    records = elab.traffic_log.read_records(str(tmp_path / 'run.elog'))
+    assert list(records) == ['loop://valve']
+    directions = [direction for t, direction, payload in records['loop://valve']]
+    assert directions.count(0) >= 2 and directions.count(1) >= 2
+    times = [t for t, direction, payload in records['loop://valve']]
+    assert times == sorted(times)
+
+
+def test_replay_answers_like_the_rig(tmp_path):
+    record(tmp_path / 'run.elog')
+    replay = elab.traffic_log.load(str(tmp_path / 'run.elog'), speed=0, strict=True)
+    valve = elab.SV07('loop://valve', replay=replay)
+    valve.port(3)
+    assert valve.position == 3
+    assert valve.ser.mismatches == []
+
+
+def test_strict_replay_rejects_other_commands(tmp_path):
+    record(tmp_path / 'run.elog')
+    replay = elab.traffic_log.load(str(tmp_path / 'run.elog'), speed=0, strict=True)
+    valve = elab.SV07('loop://valve', replay=replay)
+    with pytest.raises(ValueError):
+        valve.port(5)
+
+
+def test_replay_unknown_port_and_bad_file(tmp_path):
+    record(tmp_path / 'run.elog')
+    replay = elab.traffic_log.load(str(tmp_path / 'run.elog'), speed=0)
+    with pytest.raises(ValueError):
+        replay.port('COM99')
+    (tmp_path / 'other.bin').write_bytes(b'not a log')
+    with pytest.raises(ValueError):
+        elab.traffic_log.read_records(str(tmp_path / 'other.bin'))
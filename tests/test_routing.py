@@ -0,0 +1,65 @@
+import json
+import sys
+import pytest
+import elab
+from elab.codec import runze_codec
+from elab.routing import route_entry
+
+
+def idle(data):
+    ## every Runze command is answered with an idle status frame
+    return bytes(runze_codec().encode(0x00))
+
+
+@pytest.fixture
+def valves(monkeypatch):
+    monkeypatch.setattr(sys.modules['elab.SV07'].time, 'sleep', lambda seconds: None)
+    return [elab.SV07(f'loop://{n}', responder=idle, timeout=0.1) for n in range(2)]
+
+
+def moves(valve):
+    ## ports of the change_port frames written to a valve
+    return [frame[3] for frame in valve.ser.written if frame[2] == 0x44]
+
+
+def test_route_entry_normalizes_json_lists():
+    entry = json.loads(json.dumps({'a' : ('B', 4), 'b' : [5, ('B', 7)], 'c' : 3}))
+    assert route_entry(entry['a']) == ('B', 4)
+    assert route_entry(entry['b']) == [5, ('B', 7)]
+    assert route_entry(entry['c']) == 3
+
+
+def test_cascaded_route(valves):
+    root, b = valves
+    router = elab.valve_router(root)
+    router.add_valve('B', b, 16)
+    router.select(['B', 4])
+    assert moves(root) == [16] and moves(b) == [4]
+    assert router.reaches(('B', 4)) and not router.reaches(('C', 1))
+
+
+def test_not_lazy_by_default(valves):
+    root, b = valves
+    router = elab.valve_router(root)
+    router.select(3)
+    router.select(3)
+    assert moves(root) == [3, 3]
+
+
+def test_lazy_skips_and_picks_fewest_switches(valves):
+    root, b = valves
+    router = elab.valve_router(root, lazy=True)
+    router.add_valve('B', b, 16)
+    router.select(('B', 7))
+    assert router.select([5, ('B', 7)]) == []
+    assert router.skipped == 2
+
+
+def test_other_commands_clear_cached_position(valves):
+    root, b = valves
+    router = elab.valve_router(root, lazy=True)
+    router.select(3)
+    root.compile_cmd('strong_stop')
+    assert root.position == None
+    router.select(3)
+    assert moves(root) == [3, 3]
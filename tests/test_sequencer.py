@@ -0,0 +1,81 @@
+import pytest
+import elab
+
+
+class fake_pump():
+    total_volume = 5
+    verbose = False
+
+    def flow_rate(self):
+        return 1.0
+
+
+class fake_channel():
+    pump = fake_pump()
+
+
+class fake_lab():
+    ## the parts of a bundle the sequencer plans with, one pump and a flat 1 s/mL transfer
+    verbose = False
+    waste_name, cell_name, air_name, flush_name = 'waste', 'cell', 'air', 'flush'
+
+    def conc(self, solution):
+        return {'tempo' : 0.01, 'ethanol' : 1.0}[solution]
+
+    def channel_for(self, *lines):
+        return fake_channel()
+
+
+@pytest.fixture
+def batch():
+    return elab.batch_sequencer(fake_lab(), residual_volume=0.05)
+
+
+def test_targets_fill_with_diluent(batch):
+    run = batch.add('r', targets={'tempo' : 0.0015, 'ethanol' : 0.1}, total_volume=5, diluent='buffer')
+    assert run['components']['tempo'] == pytest.approx(0.75)
+    assert run['components']['ethanol'] == pytest.approx(0.5)
+    assert run['components']['buffer'] == pytest.approx(3.75)
+    with pytest.raises(ValueError):
+        batch.add('no diluent', targets={'tempo' : 0.0015}, total_volume=5)
+    with pytest.raises(ValueError):
+        batch.add('too much', targets={'tempo' : 0.02}, total_volume=5, diluent='buffer')
+
+
+def test_empty_runs_are_rejected(batch):
+    with pytest.raises(ValueError):
+        batch.add('empty')
+    with pytest.raises(ValueError):
+        batch.add('zero', {'tempo' : 0})
+
+
+def test_carryover_and_clean_decision(batch):
+    previous = batch.add('a', {'tempo' : 4, 'buffer' : 1})
+    same = batch.add('b', {'tempo' : 2, 'buffer' : 3})
+    other = batch.add('c', {'tempo' : 5})
+    assert batch.carryover(previous, same) == 0
+    assert batch.carryover(previous, other) == pytest.approx(0.05*1/5/5)
+    assert not batch.needs_clean(previous, same)
+    assert batch.needs_clean(previous, other)
+    batch.tolerance = 0.01
+    assert not batch.needs_clean(previous, other)
+    assert not batch.needs_clean(None, other)
+
+
+def test_new_lines(batch):
+    previous = batch.add('a', {'tempo' : 1, 'buffer' : 4})
+    run = batch.add('b', {'tempo' : 1, 'ethanol' : 4})
+    assert batch.new_lines(previous, run) == ['ethanol']
+    assert sorted(batch.new_lines(None, run)) == ['ethanol', 'tempo']
+
+
+def test_order_groups_shared_reagents(batch):
+    for n in range(2):
+        batch.add(f'ethanol {n}', {'tempo' : 1, 'ethanol' : 4})
+        batch.add(f'glycerol {n}', {'tempo' : 1, 'glycerol' : 4})
+    sequence = batch.order()
+    substrates = [x['name'].split()[0] for x in sequence]
+    assert substrates in (['ethanol']*2 + ['glycerol']*2, ['glycerol']*2 + ['ethanol']*2)
+    assert batch.report['cleans'] == 1
+    assert batch.report['ordered'] <= batch.report['given'] <= batch.report['given_cleaned']
+    assert batch.report['saved'] > 0
@@ -0,0 +1,46 @@
+import threading
+import pytest
+import elab
+
+
+class small_lab():
+    ## the parts of a bundle the server uses, with a loopback pH meter
+    verbose = False
+
+    def __init__(self):
+        self.pH = elab.pH_arduino('loop://pH', responder=lambda data: b'512\n', timeout=0.1)
+        self.inst_list = [self.pH]
+        self.soln_df = None
+        self.conc_dict = {'tempo' : 0.1}
+
+    def conc(self, solution):
+        return self.conc_dict[solution]
+
+
+@pytest.fixture
+def server():
+    server = elab.lab_server(small_lab(), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_serves_operations(server):
+    client = elab.lab_client(port=server.server_address[1], timeout=5)
+    assert client.conc('tempo') == 0.1
+    assert client.instrument('pH').voltage(delay=0, average=2) == 512
+    client.close()
+
+
+@pytest.mark.parametrize('target, method', [('bundle', 'soln_df'), ('bundle', 'inst_list'), ('bundle', 'check_types'),
+                                            ('pH', 'ser'), ('pH', 'send_comm'), ('pH', 'close'),
+                                            ('conc_dict', 'clear'), ('__class__', 'mro'), ('pH', '__init__')])
+def test_refuses_anything_else(server, target, method):
+    client = elab.lab_client(port=server.server_address[1], timeout=5)
+    with pytest.raises(RuntimeError, match='PermissionError'):
+        client.call(target, method)
+    ## the connection stays usable after a refusal
+    assert client.conc('tempo') == 0.1
+    client.close()
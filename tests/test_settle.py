@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import elab
+from elab.codec import runze_codec
+
+
+def idle(data):
+    ## every Runze command is answered with an idle status frame
+    return bytes(runze_codec().encode(0x00))
+
+
+def dt_idle(data):
+    ## DT replies: ready status, position 0 for a query
+    return b'/0`0\x03\r\n' if data.endswith(b'?\r') else b'/0`\x03\r\n'
+
+
+@pytest.fixture(params=['SY08', 'SY01B'])
+def pump(request):
+    if request.param == 'SY08':
+        return elab.SY08('loop://sy08', responder=idle, timeout=0.1)
+    return elab.SY01B('loop://sy01b', responder=dt_idle, timeout=0.1)
+
+
+def test_never_above_legacy_over_the_stroke(pump):
+    for volume in np.linspace(pump.step_volume(), pump.total_volume, 200):
+        for direction in ['aspirate', 'discharge']:
+            settle = pump.settle
+            delay = settle.delay(volume, direction)
+            legacy = settle.compute(settle.legacy[direction], {'weight' : 1.0, 'settle' : 0.0}, volume)
+            assert delay <= legacy + 1e-12
+
+
+def test_typical_protocol_saves_time(pump):
+    ## a 1 mL dispense (prime, delivery, air push) and a clean, scaled to the syringe
+    scale = pump.total_volume/5
+    protocol = [(0.1, 'aspirate'), (0.1, 'discharge'), (1, 'aspirate'), (1, 'discharge'), (1, 'aspirate'),
+                (1, 'discharge'), (5, 'aspirate'), (5, 'discharge'), (5, 'aspirate'), (5, 'discharge')]
+    pump.settle.reset_metrics()
+    for volume, direction in protocol:
+        pump.settle.delay(volume*scale, direction)
+    assert pump.settle.metrics()['saved'] > 0
+
+
+def test_slower_speed_and_heavier_solution(pump):
+    settle = pump.settle
+    fast = settle.delay(pump.total_volume, 'aspirate')
+    pump.speed = pump.speed/2
+    assert settle.delay(pump.total_volume, 'aspirate') < fast
+    settle.set_port('glycerol', weight=3, settle=0.5)
+    settle.select('glycerol')
+    assert settle.delay(pump.total_volume, 'aspirate') > fast
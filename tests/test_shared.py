@@ -0,0 +1,71 @@
+import subprocess
+import sys
+import uuid
+import numpy as np
+import pytest
+import elab
+
+shared_memory = pytest.importorskip('multiprocessing.shared_memory')
+
+
+def ring_name():
+    return f'elab_test_{uuid.uuid4().hex[:8]}'
+
+
+def test_write_read_wraparound():
+    ring = elab.shared_ring(ring_name(), capacity=8)
+    try:
+        for n in range(20):
+            ring.append(float(n), 10.0*n)
+        times, values = ring.latest()
+        assert times.tolist() == [float(n) for n in range(12, 20)]
+        assert values.tolist() == [10.0*n for n in range(12, 20)]
+        assert ring.latest(3)[0].tolist() == [17.0, 18.0, 19.0]
+        ## a reader that fell behind gets what is still in the ring
+        times, values, start = ring.since(5)
+        assert times[0] == 12.0 and start == 20
+        ring.append(20.0, 200.0)
+        times, values, start = ring.since(start)
+        assert times.tolist() == [20.0] and start == 21
+    finally:
+        ring.close()
+
+
+def test_reader_sees_writer_samples():
+    name = ring_name()
+    ring = elab.shared_ring(name, capacity=16)
+    try:
+        ring.append(1.0, 2.0)
+        reader = elab.shared_ring.attach(name)
+        assert reader.capacity == 16
+        assert reader.latest()[1].tolist() == [2.0]
+        reader.close()
+    finally:
+        ring.close()
+
+
+def test_live_writer_is_not_replaced():
+    name = ring_name()
+    ring = elab.shared_ring(name, capacity=8)
+    try:
+        with pytest.raises(FileExistsError):
+            elab.shared_ring(name, capacity=8)
+        ring.append(1.0, 1.0)
+        assert ring.latest()[1].tolist() == [1.0]
+    finally:
+        ring.close()
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='a crashed writer leaves no block behind on Windows')
+def test_block_of_a_dead_writer_is_replaced():
+    name = ring_name()
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    block = shared_memory.SharedMemory(name=name, create=True, size=4*8 + 2*8*8)
+    np.ndarray((4,), dtype=np.int64, buffer=block.buf)[:] = [0, 5, 8, dead.pid]
+    block.close()
+    ring = elab.shared_ring(name, capacity=4)
+    try:
+        assert ring.capacity == 4 and ring.count == 0
+    finally:
+        ring.close()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import elab
+
+
+class fake_lab():
+    ## stock concentrations from a ports table, no pumps so volumes are not rounded
+    conc_dict = {'tempo' : 0.01, 'ethanol' : 1.0, 'naoh' : 0.5}
+
+    def mix_component(self, solution, volume):
+        return (solution, volume)
+
+
+def test_grid_is_every_combination():
+    solver = elab.conc_solver(fake_lab(), 5, diluent='buffer')
+    grid = solver.grid(tempo=[0.0015], ethanol=[0.1, 0.2], naoh=[0, 0.01, 0.02])
+    assert all(len(x) == 6 for x in grid.values())
+    assert sorted(set(zip(grid['ethanol'], grid['naoh']))) == sorted((e, n) for e in [0.1, 0.2] for n in [0, 0.01, 0.02])
+
+
+def test_volumes_and_diluent():
+    solver = elab.conc_solver(fake_lab(), 5, diluent='buffer')
+    plan = solver.solve({'tempo' : [0.0015], 'ethanol' : [0.1]})
+    row = plan.iloc[0]
+    assert row['tempo'] == pytest.approx(0.75)
+    assert row['ethanol'] == pytest.approx(0.5)
+    assert row['buffer'] == pytest.approx(3.75)
+    assert row['feasible'] and row['error'] == pytest.approx(0)
+    assert solver.mixture(row) == [('tempo', 0.75), ('ethanol', 0.5), ('buffer', 3.75)]
+
+
+def test_infeasible_points_are_flagged():
+    solver = elab.conc_solver(fake_lab(), 5, diluent='buffer', min_volume=0.05)
+    plan = solver.solve({'tempo' : [0.0015, 0.009, 0.00005], 'ethanol' : [0.1, 0.5, 0.1]})
+    assert list(plan['feasible']) == [True, False, False]
+    assert list(plan['overflow']) == [False, True, False]
+    assert list(plan['too_small']) == [False, False, True]
+
+
+def test_step_rounding_error():
+    solver = elab.conc_solver(fake_lab(), 5, diluent='buffer', max_error=0.01)
+    solver.step = lambda solution: 0.1
+    plan = solver.solve({'ethanol' : [0.1, 0.011]})
+    assert plan['ethanol'].tolist() == pytest.approx([0.5, 0.1])
+    assert list(plan['feasible']) == [True, False]
+    assert plan['error'].iloc[1] == pytest.approx(0.1/5/0.011 - 1)
+
+
+def test_missing_stock():
+    solver = elab.conc_solver(fake_lab(), 5)
+    with pytest.raises(ValueError):
+        solver.solve({'glycerol' : [0.1]})
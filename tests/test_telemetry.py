@@ -0,0 +1,57 @@
+import time
+import numpy as np
+import pytest
+import elab
+
+
+def test_asof_and_interpolate():
+    hub = elab.telemetry_hub()
+    for t, value in [(1, 10), (2, 20), (4, 40)]:
+        hub.record('T', value, t)
+    table = hub.align([0.5, 1, 3, 5])
+    assert np.isnan(table['T'][0])
+    assert list(table['T'][1:]) == [10, 20, 40]
+    table = hub.align([0.5, 3, 5], how='interpolate')
+    assert np.isnan(table['T'][0]) and table['T'][1] == 30 and np.isnan(table['T'][2])
+    table = hub.align([4.2, 5], tolerance=0.5)
+    assert table['T'][0] == 40 and np.isnan(table['T'][1])
+
+
+def test_buffers_grow():
+    hub = elab.telemetry_hub()
+    feed = hub.feed('pH')
+    for n in range(3000):
+        feed(float(n), n)
+    times, values = hub.channels['pH'].arrays()
+    assert len(times) == 3000 and values[-1] == 2999
+
+
+def test_events_align_with_readings():
+    hub = elab.telemetry_hub()
+    hub.record('T', 25, 1)
+    hub.event('dispense', t=2, solution='tempo')
+    table = hub.align(hub.events())
+    assert list(table.columns[:3]) == ['time', 'event', 'solution'] and table['T'][0] == 25
+
+
+def test_watch_records_readings_without_queries():
+    pH = elab.pH_arduino('loop://pH', responder=lambda data: b'512\n', timeout=0.2)
+    hub = elab.telemetry_hub()
+    hub.watch(pH)
+    time.sleep(0.1)
+    assert 'pH_voltage' not in hub.channels and pH.ser.written == []
+    pH.send_comm()
+    pH.send_comm()
+    assert hub.channels['pH_voltage'].arrays()[1].tolist() == [512, 512]
+    hub.stop()
+    assert pH.listeners == []
+
+
+def test_watch_legato_polls_status():
+    legato = elab.Legato100('loop://legato', responder=lambda data: b'\r\n100 2000 5000000000 i..\r\n:', timeout=0.2)
+    hub = elab.telemetry_hub()
+    hub.watch(legato, interval=0.02)
+    time.sleep(0.15)
+    hub.stop()
+    assert hub.errors == {}
+    assert hub.channels['volume'].arrays()[1][0] == pytest.approx(0.005)
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+import elab
+
+
+def curve(volume, equivalence=10.0):
+    ## strong acid / strong base shape, steepest at the equivalence volume
+    return 7 + 4*np.tanh(2*(volume - equivalence))
+
+
+def test_derivatives_of_a_quadratic_are_exact():
+    analyzer = elab.titration_analyzer(window=7)
+    for x in np.arange(1000, 1001.4, 0.1):
+        analyzer.add(x, 3 + 0.5*(x - 1000) + 2*(x - 1000)**2)
+    for volume, pH, slope, curvature in analyzer.derivatives:
+        assert abs(slope - (0.5 + 4*(volume - 1000))) < 1e-6
+        assert abs(curvature - 4) < 1e-6
+
+
+def test_no_drift_over_a_long_run():
+    analyzer = elab.titration_analyzer(window=7)
+    volumes = np.arange(0, 500, 0.05)
+    for x in volumes:
+        analyzer.add(x, 0.2*x)
+    assert max(abs(slope - 0.2) for volume, pH, slope, curvature in analyzer.derivatives) < 1e-9
+
+
+def test_equivalence_point_found_once():
+    analyzer = elab.titration_analyzer(window=7)
+    seen = []
+    analyzer.on('equivalence', seen.append)
+    for x in np.arange(0, 20, 0.1):
+        analyzer.add(x, curve(x))
+    assert len(seen) == 1
+    assert abs(seen[0]['volume'] - 10.0) < 0.1
+    assert analyzer.resolved(1)
+
+
+def test_buffer_region_reported():
+    analyzer = elab.titration_analyzer(window=5, buffer_points=3)
+    events = []
+    analyzer.on('any', events.append)
+    for x in np.arange(0, 20, 0.1):
+        analyzer.add(x, curve(x))
+    kinds = [x['event'] for x in events]
+    assert kinds[0] == 'buffer_start'
+    assert 'buffer_end' in kinds
+
+
+def test_repeated_volumes_are_skipped():
+    analyzer = elab.titration_analyzer(window=3)
+    for x in range(5):
+        assert analyzer.add(1.0, 7.0) == []
+    assert analyzer.derivatives == []
+
+
+class legato_rig():
+    ## loopback Legato100 that records its commands, 'irate' above max_rate is rejected like the pump does
+    def __init__(self, max_rate=10):
+        self.commands = []
+        self.max_rate = max_rate
+
+    def __call__(self, data):
+        command = data.decode().strip()
+        self.commands.append(command)
+        if command.startswith('irate') and float(command.split()[1]) > self.max_rate:
+            return b'\nArgument error: 20\r\n   Out of range\r\n:'
+        return b'\r\n:'
+
+
+def titration_rig(rig):
+    legato = elab.Legato100('loop://legato', responder=rig, timeout=0.2)
+    pH = elab.pH_arduino('loop://pH', responder=lambda data: b'512\n', timeout=0.2)
+    return elab.infusion_titration(legato, pH, interval=0.01)
+
+
+def test_titration_infuses_explicitly():
+    rig = legato_rig()
+    titration = titration_rig(rig)
+    curve = titration.run(0.005, rate=1, unit='ml/s')
+    assert 'irun' in rig.commands and 'run' not in rig.commands
+    assert len(curve) > 0 and curve['volume'].max() <= 0.005 + 1e-12
+
+
+def test_titration_rejects_out_of_range_rate():
+    rig = legato_rig(max_rate=1)
+    titration = titration_rig(rig)
+    with pytest.raises(ValueError):
+        titration.run(1, rate=50, unit='ml/min')
+    assert 'irun' not in rig.commands
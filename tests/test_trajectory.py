@@ -0,0 +1,59 @@
+import pytest
+import elab
+
+
+class fake_mfc():
+    ## answers every setpoint with a data frame whose mass flow equals the setpoint, fails after fail_after calls
+    def __init__(self, name, fail_after=None):
+        self.com_port = name
+        self.setpoints = []
+        self.polls = 0
+        self.fail_after = fail_after
+
+    def check_abort(self):
+        pass
+
+    def setpoint_data(self, value):
+        if self.fail_after != None and len(self.setpoints) >= self.fail_after:
+            self.fail_after = None
+            raise ValueError('Unexpected data frame')
+        self.setpoints.append(value)
+        return {'mass_flow' : value}
+
+    def read_data(self):
+        self.polls += 1
+        return {'mass_flow' : self.setpoints[-1]}
+
+
+def test_profile_values():
+    profile = elab.setpoint_profile(0).ramp(50, 10).hold(5).step(0)
+    assert profile.duration == 15
+    assert [profile.value(t) for t in [-1, 0, 5, 10, 12]] == [0, 0, 25, 50, 50]
+    assert profile.value(15) == 0 and profile.value(100) == 0
+
+
+def test_executor_follows_each_profile():
+    a, b = fake_mfc('a'), fake_mfc('b')
+    run = elab.trajectory_executor(period=0.05)
+    run.add(a, elab.setpoint_profile(0).ramp(10, 0.25))
+    run.add(b, elab.setpoint_profile(5).hold(0.25))
+    log = run.run()
+    assert a.setpoints[0] == 0 and a.setpoints[-1] == 10
+    assert a.setpoints == sorted(a.setpoints)
+    ## an unchanged setpoint is only polled
+    assert b.setpoints == [5] and b.polls > 0
+    done = log[~log['missed']]
+    assert (done['commanded'] == done['measured']).all()
+    assert set(run.report()) == {'a', 'b'}
+
+
+def test_failure_goes_to_safe_setpoint_and_raises():
+    a, b = fake_mfc('a', fail_after=2), fake_mfc('b')
+    run = elab.trajectory_executor(period=0.01, safe_setpoint=0)
+    run.add(a, elab.setpoint_profile(1).ramp(10, 0.1))
+    run.add(b, elab.setpoint_profile(5).hold(0.05))
+    with pytest.raises(ValueError):
+        run.run()
+    assert a.setpoints[-1] == 0
+    assert list(run.errors) == ['a']
+    assert b.setpoints == [5]
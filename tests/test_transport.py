@@ -0,0 +1,39 @@
+import socket
+import pytest
+import elab
+
+
+def test_transport_module_is_not_shadowed():
+    assert type(elab.transport).__name__ == 'module'
+    with pytest.raises(TypeError):
+        elab.base_transport()
+
+
+def test_loopback_responder_and_reads():
+    port = elab.loopback_transport(responder=lambda data: data.upper() + b'\n', timeout=0.2)
+    port.write(b'ping')
+    assert port.in_waiting == 5
+    assert port.readline() == b'PING\n'
+    assert port.read(1, timeout=0.01) == b''
+
+
+def test_tcp_round_trip_and_full_buffer():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    host, number = server.getsockname()
+    port = elab.tcp_transport(host, number, timeout=0.5)
+    peer, _ = server.accept()
+    try:
+        peer.sendall(b'/0`0\x03\r\n')
+        assert port.read_until(b'\x03') == b'/0`0\x03'
+        port.write(b'ZR\r')
+        assert peer.recv(16) == b'ZR\r'
+
+        ## the peer never reads, so the send buffers fill and the write has to time out instead of raising BlockingIOError
+        with pytest.raises(TimeoutError):
+            port.write(b'x'*(64 << 20))
+    finally:
+        port.close()
+        peer.close()
+        server.close()